@@ -187,6 +187,49 @@ class BaseConfig(object):
       self.feature_names = "shit"
       self.feature_sizes = "0"
 
+    # decode up to this many frame-level SequenceExamples per reader op
+    # invocation, 0 to parse them one at a time
+    self.frame_read_batch_size = 0
+    # carry the frame features as uint8 through the input queues and
+    # dequantize them in build_graph
+    self.frame_keep_quantized = False
+    # batch frame-level videos by num_frames in buckets split at these
+    # lengths, e.g. [60, 120, 180, 240], None to pad every batch to
+    # max_frames. A batch is padded to its longest video, so only models
+    # that set BaseModel.supports_dynamic_frames can use it, setup rejects
+    # the others
+    self.frame_bucket_boundaries = None
+
+    # the global class ids of the model outputs, as a list of [start, end)
+    # ranges or a file of class ids; by default derived from the number of
+    # classes of the model, see data_io.label_space
+    self.label_ranges = None
+    self.label_index_file = None
+    # carry the labels through the input queues as up to this many int16
+    # label ids per video (e.g. 32, more labels are dropped) and densify them
+    # in build_graph, 0 to carry dense labels
+    self.sparse_label_max = 0
+
+    # capacity of the batching queue, None for 10 batches in training and 3
+    # in evaluation (1500 videos with use_hdfs)
+    self.input_queue_capacity = None
+    # feeder threads of the hdfs readers, and the directory of their HDF5
+    # stores and vid_info/ (None for the default locations)
+    self.hdfs_num_threads = 8
+    self.hdfs_data_dir = None
+    # read the rows of the hdfs readers with h5py ("h5") or from a memory-mapped
+    # .npy store converted by data_io.row_store ("npy")
+    self.hdfs_backend = "h5"
+    # in training, read the hdfs rows in shuffled blocks of this many rows
+    # (e.g. 1024) through a shuffle buffer of hdfs_shuffle_buffer_blocks
+    # blocks, 0 to read 32 random rows per batch; see
+    # data_io.row_store.BlockShuffleSampler for the randomness trade-off
+    self.hdfs_block_size = 0
+    self.hdfs_shuffle_buffer_blocks = 64
+    # fill the hdfs batches in this many worker processes through shared
+    # memory (see data_io.process_feeder), 0 to fill them in the feeder threads
+    self.hdfs_num_processes = 0
+
     self.stage = stage
     self.input_setup()
 
@@ -207,8 +250,17 @@ class BaseConfig(object):
 
     self.regularization_penalty = 1
 
+    # compute the training Hit@1, PERR and GAP in a background thread, for
+    # every n-th step and on at most sample_size rows (None for all rows)
+    self.train_metrics_async = False
+    self.train_metrics_every_n = 10
+    self.train_metrics_sample_size = None
+    self.train_metrics_queue_size = 2
+
     self.start_new_model = False
     self.top_k = 20
+    # approximate the eval GAP with this many histogram bins, None for exact
+    self.gap_num_bins = None
 
 
   def input_setup(self):
@@ -229,6 +281,10 @@ class BaseConfig(object):
       execute_shell("cd {0}/../../../ && tar cf src.tar src/ && cp src.tar {1}".format(pwd, code_saver_dir))
       # execute_shell("cp -ar {0}/../../../src {1}".format(
           # pwd, os.path.join(code_saver_dir)))
+    elif self.stage == "benchmark":
+      # the training input pipeline without a run directory
+      self.phase_train = True
+      data_pattern_str = "train"
     elif self.stage == "eval" or self.stage == "inference":
       self.phase_train = False
       data_pattern_str = "validate" if self.stage == "eval" else "test"
@@ -16,7 +16,7 @@ class FeedingQueueRunner(qr.QueueRunner):
 
   def __init__(self, queue=None, enqueue_ops=None, close_op=None,
                cancel_op=None, feed_fns=None,
-               queue_closed_exception_types=None):
+               queue_closed_exception_types=None, stop_fns=None):
     """Initialize the queue runner.
 
     For further documentation, see `queue_runner.py`. Note that
@@ -34,6 +34,8 @@ class FeedingQueueRunner(qr.QueueRunner):
         indicate that the queue has been closed when raised during an enqueue
         operation.  Defaults to
         `(tf.errors.OutOfRangeError, tf.errors.CancelledError)`.
+      stop_fns: Optional list of functions called after the queue is closed
+        when the coordinator requests a stop, e.g. to stop feeder processes.
 
     Raises:
       ValueError: `feed_fns` is not `None` and has different length than
@@ -53,6 +55,7 @@ class FeedingQueueRunner(qr.QueueRunner):
             "If feed_fns is not None, it must have the same length as "
             "enqueue_ops.")
       self._feed_fns = feed_fns
+    self._stop_fns = stop_fns or []
 
   # pylint: disable=broad-except
   def _run(self, sess, enqueue_op, feed_fn, coord=None):
@@ -154,6 +157,15 @@ class FeedingQueueRunner(qr.QueueRunner):
         t.start()
     return ret_threads
 
+  def _close_on_stop(self, sess, cancel_op, coord):
+    """Close the queue and run the stop functions when `coord` stops."""
+    super(FeedingQueueRunner, self)._close_on_stop(sess, cancel_op, coord)
+    for stop_fn in self._stop_fns:
+      try:
+        stop_fn()
+      except Exception as e:
+        logging.error("Exception in stop function: %s", str(e))
+
   def _init_from_proto(self, queue_runner_def):
     raise NotImplementedError(
         "{} does not support initialization from proto.".format(type(
@@ -1,4 +1,3 @@
-import h5py
 import threading
 import cPickle as pkl
 import random
@@ -8,28 +7,26 @@ import Queue
 import tensorflow as tf
 from tensorflow.python.training import queue_runner
 from . import feeding_queue_runner as fqr
+from . import label_index
+from . import row_store
 
 
 class Feed_fn_setup(object):
-  def __init__(self, num_classes):
+  def __init__(self, num_classes, backend="h5"):
     with open("/data/state/linchao/YT/video_hdfs/train/mean.pkl") as fin:
       vid_list = pkl.load(fin)
       self.vid_dict = {}
       for i, vid in enumerate(vid_list):
         self.vid_dict[vid] = i
-    self.mean_data = h5py.File("/data/state/linchao/YT/video_hdfs/train/mean.h5", 'r', driver='core')['feas']
+    self.mean_data = row_store.open_feas(
+        "/data/state/linchao/YT/video_hdfs/train/mean.h5", backend,
+        mem_map=True)
 
-    print("loading vid info")
-    with open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_vid_to_labels_-1.pkl") as fin:
-      self.vid_to_labels = pkl.load(fin)
-
-    self.label_to_vid_dict = {}
-    for vid, labels in self.vid_to_labels.iteritems():
-      for l in labels:
-        l = int(l)
-        c = self.label_to_vid_dict.get(l, [])
-        c.append(vid)
-        self.label_to_vid_dict[l] = c
+    self.label_index = label_index.LabelIndex.load(
+        "/data/uts700/linchao/yt8m/YT/data/vid_info/train_label_index")
+    # a private copy of the inverse CSR, the rows of every label are shuffled
+    # in place
+    self.label_rows = np.array(self.label_index.label_rows)
 
     self.num_classes = num_classes
     self.batch_size = 32
@@ -48,15 +45,20 @@ class Feed_fn_setup(object):
 
     # step_size = num_classes / batch_size
     # batch_labels = classes[step_size * i: step_size * (i + 1)]
-    batch_vids = []
+    batch_rows = []
+    offsets = self.label_index.label_vid_offsets
     while True:
       np.random.shuffle(labels)
       for label in labels:
-        vids = self.label_to_vid_dict[label]
+        if label >= self.label_index.num_labels:
+          continue
+        label_rows = self.label_rows[offsets[label]: offsets[label + 1]]
+        if label_rows.shape[0] == 0:
+          continue
         vid_ptr = label_vid_ptr[label]
         trav_cnt = 0
-        while vids[vid_ptr] in batch_vids:
-          if len(vids) == vid_ptr + 1:
+        while label_rows[vid_ptr] in batch_rows:
+          if len(label_rows) == vid_ptr + 1:
             vid_ptr = 0
           else:
             vid_ptr += 1
@@ -65,14 +67,15 @@ class Feed_fn_setup(object):
             break
         if trav_cnt == 100:
           continue
-        batch_vids.append(vids[vid_ptr])
-        if len(batch_vids) == self.batch_size:
-          self.batch_id_queue.put(batch_vids)
-          batch_vids = []
+        batch_rows.append(label_rows[vid_ptr])
+        if len(batch_rows) == self.batch_size:
+          self.batch_id_queue.put(
+              self.label_index.video_ids[batch_rows].tolist())
+          batch_rows = []
 
-        if len(vids) == vid_ptr + 1:
+        if len(label_rows) == vid_ptr + 1:
           label_vid_ptr[label] = 0
-          random.shuffle(self.label_to_vid_dict[label])
+          np.random.shuffle(label_rows)
         else:
           label_vid_ptr[label] = vid_ptr + 1
 
@@ -81,24 +84,20 @@ class Feed_fn(object):
   def __init__(self, info, placeholders):
     self._i = info
     self.vid_dict = info.vid_dict
-    self.vid_to_labels = info.vid_to_labels
+    self.label_index = info.label_index
     self.placeholders = placeholders
+    # the labels of the previous batch were fed before the next call
+    self.labels_buffer = np.zeros((info.batch_size, info.num_classes),
+                                  dtype=np.uint8)
 
   def __call__(self):
     vids = self._i.batch_id_queue.get()
-    vid_index = []
-    dense_labels = np.zeros((len(vids), self._i.num_classes), dtype=np.int64)
-    for vid_idx, vid in enumerate(vids):
-      idx = self.vid_dict[vid]
-      vid_index.append(idx)
-      labels = self.vid_to_labels[vid]
-      for l in labels:
-        dense_labels[vid_idx, int(l)] = 1
-
-    vid_index = np.array(vid_index)
-    vid_index_sortidx = np.argsort(vid_index)
-    batch_data = self._i.mean_data[vid_index[vid_index_sortidx], :]
-    batch_data = batch_data[np.argsort(vid_index_sortidx), :]
+    vid_index = [self.vid_dict[vid] for vid in vids]
+    dense_labels = self.label_index.dense_labels(
+        self.label_index.rows_of(vids), self._i.num_classes,
+        out=self.labels_buffer)
+
+    batch_data = row_store.gather_rows(self._i.mean_data, vid_index)
 
     vals = [np.array(vids), dense_labels, batch_data]
     feed_dict = {}
@@ -106,9 +105,10 @@ class Feed_fn(object):
       feed_dict[pl.name] = val
     return feed_dict
 
-def enqueue_data(batch_size, num_classes, feature_size, name="enqueue_input",):
-  fn_setup = Feed_fn_setup(num_classes)
-  queue_types = [tf.string, tf.int64, tf.float32]
+def enqueue_data(batch_size, num_classes, feature_size, name="enqueue_input",
+                 backend="h5"):
+  fn_setup = Feed_fn_setup(num_classes, backend)
+  queue_types = [tf.string, tf.uint8, tf.float32]
   queue_shapes = [(), (num_classes,), (feature_size,)]
   capacity = 1500
   num_threads = 8
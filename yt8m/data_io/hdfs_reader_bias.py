@@ -11,6 +11,7 @@ import tensorflow as tf
 from tensorflow.python.training import queue_runner
 from tensorflow.python.framework import errors
 from . import feeding_queue_runner as fqr
+from . import label_index
 
 
 class Feed_fn_setup(object):
@@ -40,13 +41,11 @@ class Feed_fn_setup(object):
     self.phase_train = phase_train
     if self.phase_train:
       stage = "train"
-      print("loading vid info")
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_vid_to_labels_-1.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
     else:
       stage = "validate"
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/validate_vid_to_labels.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
+    self.label_index = label_index.LabelIndex.load(
+        "/data/uts700/linchao/yt8m/YT/data/vid_info/{}_label_index".format(
+            stage))
     if feat_type == "video":
       self.vid_dict, self.mean_data = self.load_video_info(stage)
     elif feat_type == "vlad":
@@ -55,13 +54,10 @@ class Feed_fn_setup(object):
     # TODO
     target_label = 0
     # target_label = 4712
-    self.pos_vids, self.neg_vids = [], []
-    for vid, labels in self.vid_to_labels.iteritems():
-      labels = [int(l) for l in labels]
-      if target_label in labels:
-        self.pos_vids.append(vid)
-      else:
-        self.neg_vids.append(vid)
+    is_pos = np.zeros([len(self.label_index)], dtype=np.bool)
+    is_pos[self.label_index.rows_of_label(target_label)] = True
+    self.pos_vids = self.label_index.video_ids[is_pos].tolist()
+    self.neg_vids = self.label_index.video_ids[~is_pos].tolist()
     random.shuffle(self.pos_vids)
     random.shuffle(self.neg_vids)
     print("num pos: {}; num neg: {}".format(len(self.pos_vids), len(self.neg_vids)))
@@ -162,7 +158,7 @@ class Feed_fn(object):
   def __init__(self, info, placeholders):
     self._i = info
     self.vid_dict = info.vid_dict
-    self.vid_to_labels = info.vid_to_labels
+    self.label_index = info.label_index
     self.placeholders = placeholders
 
   def __call__(self):
@@ -11,6 +11,7 @@ import tensorflow as tf
 from tensorflow.python.training import queue_runner
 from tensorflow.python.framework import errors
 from . import feeding_queue_runner as fqr
+from . import label_index
 
 
 class Feed_fn_setup(object):
@@ -29,9 +30,7 @@ class Feed_fn_setup(object):
         self.mean_data_list.append(
             h5py.File("/data//state/linchao/YT/vlad_hdfs/train/feas_{}.h5".format(split_idx), 'r')['feas'])
 
-      print("loading vid info")
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_vid_to_labels_-1.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
+      stage = "train"
     else:
       for split_idx in xrange(160):
         print(split_idx)
@@ -41,17 +40,16 @@ class Feed_fn_setup(object):
             self.vid_dict[vid] = (split_idx, vid_idx)
         self.mean_data_list.append(
             h5py.File("/data//state/linchao/YT/vlad_hdfs/train/feas_{}.h5".format(split_idx), 'r')['feas'])
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/validate_vid_to_labels.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
+      stage = "validate"
+    self.label_index = label_index.LabelIndex.load(
+        "/data/uts700/linchao/yt8m/YT/data/vid_info/{}_label_index".format(
+            stage))
 
     target_label = 0
-    self.pos_vids, self.neg_vids = [], []
-    for vid, labels in self.vid_to_labels.iteritems():
-      labels = [int(l) for l in labels]
-      if target_label in labels:
-        self.pos_vids.append(vid)
-      else:
-        self.neg_vids.append(vid)
+    is_pos = np.zeros([len(self.label_index)], dtype=np.bool)
+    is_pos[self.label_index.rows_of_label(target_label)] = True
+    self.pos_vids = self.label_index.video_ids[is_pos].tolist()
+    self.neg_vids = self.label_index.video_ids[~is_pos].tolist()
     random.shuffle(self.pos_vids)
     random.shuffle(self.neg_vids)
 
@@ -127,7 +125,7 @@ class Feed_fn(object):
   def __init__(self, info, placeholders):
     self._i = info
     self.vid_dict = info.vid_dict
-    self.vid_to_labels = info.vid_to_labels
+    self.label_index = info.label_index
     self.placeholders = placeholders
 
   def __call__(self):
@@ -1,4 +1,3 @@
-import h5py
 import time
 import math
 import threading
@@ -11,44 +10,67 @@ import tensorflow as tf
 from tensorflow.python.training import queue_runner
 from tensorflow.python.framework import errors
 from . import feeding_queue_runner as fqr
+from . import label_index
+from . import row_store
+from . import process_feeder
+
+
+# where the HDF5 stores and vid_info/, with the label indexes, live by default
+FEAS_DIR = "/data/state/linchao/YT"
+VID_INFO_DIR = "/data/uts700/linchao/yt8m/YT/data"
 
 
 class Feed_fn_setup(object):
   def load_video_info(self, stage="train", mem_map=True):
     vid_dict = {}
-    with open("/data/state/linchao/YT/video_hdfs/{}/mean.pkl".format(stage)) as fin:
+    with open("{}/video_hdfs/{}/mean.pkl".format(self.feas_dir, stage)) as fin:
       vid_list = pkl.load(fin)
       for i, vid in enumerate(vid_list):
         vid_dict[vid] = i
-    if mem_map:
-      mean_data = h5py.File("/data/state/linchao/YT/video_hdfs/{}/mean.h5".format(stage), 'r', driver='core')['feas']
-    else:
-      mean_data = h5py.File("/data/state/linchao/YT/video_hdfs/{}/mean.h5".format(stage), 'r')['feas']
+    self.feas_path = "{}/video_hdfs/{}/mean.h5".format(self.feas_dir, stage)
+    self.mem_map = mem_map
+    mean_data = row_store.open_feas(self.feas_path, self.backend, mem_map)
     return vid_dict, mean_data
 
   def load_vlad_info(self, stage="train"):
     vid_dict = {}
-    with open("/data/state/linchao/YT/vlad_hdfs/{}/mean.pkl".format(stage)) as fin:
+    with open("{}/vlad_hdfs/{}/mean.pkl".format(self.feas_dir, stage)) as fin:
       vid_list = pkl.load(fin)
       for i, vid in enumerate(vid_list):
         vid_dict[vid] = i
-    mean_data = h5py.File("/data/state/linchao/YT/vlad_hdfs/{}/mean.h5".format(stage), 'r')['feas']
+    self.feas_path = "{}/vlad_hdfs/{}/mean.h5".format(self.feas_dir, stage)
+    self.mem_map = False
+    mean_data = row_store.open_feas(self.feas_path, self.backend)
     return vid_dict, mean_data
 
-  def __init__(self, feat_type, num_classes, phase_train, num_threads):
+  def reopen_feas(self):
+    """Reopens an h5 file read from disk, h5py handles must not be shared
+    across a fork. Memory-mapped and in-memory rows are shared as they are."""
+    if self.backend == "h5" and not self.mem_map:
+      self.mean_data = row_store.open_feas(self.feas_path, self.backend)
+
+  def __init__(self, feat_type, num_classes, phase_train, num_threads,
+               max_labels=0, data_dir=None, backend="h5", block_size=0,
+               buffer_blocks=64):
     self.num_threads = num_threads
+    self.backend = backend
+    self.block_size = block_size
+    self.buffer_blocks = buffer_blocks
+    self.max_labels = max_labels
     self.phase_train = phase_train
+    # data_dir holds both the stores and vid_info/, e.g. a synthetic dataset
+    self.feas_dir = data_dir or FEAS_DIR
+    vid_info_dir = data_dir or VID_INFO_DIR
     if self.phase_train:
       stage = "train"
-      print("loading vid info")
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_vid_to_labels_-1.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
     else:
       stage = "validate"
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/validate_vid_to_labels.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
+    self.label_index = label_index.LabelIndex.load(
+        "{}/vid_info/{}_label_index".format(vid_info_dir, stage))
     if feat_type == "video":
-      self.vid_dict, self.mean_data = self.load_video_info(stage)
+      # block reads are for the file on disk, not an in-memory copy
+      self.vid_dict, self.mean_data = self.load_video_info(
+          stage, mem_map=not (self.phase_train and self.block_size > 0))
     elif feat_type == "vlad":
       self.vid_dict, self.mean_data = self.load_vlad_info(stage)
 
@@ -57,35 +79,69 @@ class Feed_fn_setup(object):
     # TODO
     self.batch_size = 32
 
-    self.batch_id_queue = Queue.Queue(1500)
+    if self.phase_train and self.block_size > 0:
+      # the video id of every row, to label the rows of a block
+      self.row_vids = [None] * self.mean_data.shape[0]
+      for vid, row in self.vid_dict.iteritems():
+        self.row_vids[row] = vid
+      # the batches carry their rows, hold about two shuffle buffers
+      self.batch_id_queue = Queue.Queue(
+          2 * self.block_size * self.buffer_blocks // self.batch_size + 1)
+    else:
+      self.batch_id_queue = Queue.Queue(1500)
+
+  def start_sampler(self):
+    """Starts the thread queueing the video ids of the batches."""
     if self.phase_train:
       bi_threads = threading.Thread(target=self.input_vid_threads_train)
     else:
       bi_threads = threading.Thread(target=self.input_vid_threads_val)
+    # the train thread never returns, do not keep the process alive for it
+    bi_threads.daemon = True
     bi_threads.start()
 
+  def new_labels_buffer(self):
+    """A labels array for the batches of one feeder thread."""
+    if self.max_labels > 0:
+      return np.zeros((self.batch_size, self.max_labels), dtype=np.int16)
+    return np.zeros((self.batch_size, self.num_classes), dtype=np.uint8)
+
+  def batch_labels(self, batch_vids, out=None):
+    """The dense uint8 labels of batch_vids, or their label ids with
+    max_labels.
+
+    Args:
+      batch_vids: the video ids of a batch.
+      out: optional array of at least len(batch_vids) rows to write the labels
+        to, a buffer from new_labels_buffer or a feeder slot.
+
+    Returns:
+      The labels, a view of out if given.
+    """
+    rows = self.label_index.rows_of(batch_vids)
+    if self.max_labels > 0:
+      return self.label_index.packed_labels(rows, self.max_labels, out=out)
+    return self.label_index.dense_labels(rows, self.num_classes,
+                                         dtype=np.uint8, out=out)
+
   def input_vid_threads_val(self):
     for i in xrange(0, len(self.vids), self.batch_size):
       batch_vids = self.vids[i: i + self.batch_size]
       if len(batch_vids) == 0:
         continue
-      dense_labels = np.zeros((len(batch_vids), self.num_classes), dtype=np.int64)
-      for vid_idx, vid in enumerate(batch_vids):
-        for l in self.vid_to_labels[vid]:
-          dense_labels[vid_idx, int(l)] = 1
-      self.batch_id_queue.put((batch_vids, np.array(dense_labels)))
+      self.batch_id_queue.put((batch_vids, None))
     for i in xrange(self.num_threads):
       self.batch_id_queue.put(False)
 
   def input_vid_threads_train(self):
+    if self.block_size > 0:
+      self.input_block_threads_train()
+      return
     vid_ptr = 0
     batch_vids = []
-    dense_labels = np.zeros((self.batch_size, self.num_classes), dtype=np.int64)
     shuffle = False
     while True:
       vid = self.vids[vid_ptr]
-      for l in self.vid_to_labels[vid]:
-        dense_labels[len(batch_vids), int(l)] = 1
       batch_vids.append(vid)
       if len(self.vids) == vid_ptr + 1:
         vid_ptr = 0
@@ -94,44 +150,69 @@ class Feed_fn_setup(object):
         vid_ptr += 1
 
       if len(batch_vids) == self.batch_size:
-        self.batch_id_queue.put((batch_vids, np.array(dense_labels)))
+        self.batch_id_queue.put((batch_vids, None))
         batch_vids = []
-        dense_labels = np.zeros((self.batch_size, self.num_classes), dtype=np.int64)
         if shuffle:
           random.shuffle(self.vids)
           shuffle = False
 
+  def input_block_threads_train(self):
+    """Reads the rows in shuffled blocks and queues batches with their data.
+
+    The feeders then skip the random row reads, see
+    row_store.BlockShuffleSampler.
+    """
+    sampler = row_store.BlockShuffleSampler(
+        self.mean_data, self.batch_size, self.block_size, self.buffer_blocks)
+    for rows, batch_data in sampler.batches():
+      batch_vids = [self.row_vids[row] for row in rows]
+      self.batch_id_queue.put((batch_vids, batch_data))
+
+  def next_task(self):
+    """The next (batch_vids, batch_data) of the sampler, None at the end."""
+    ins = self.batch_id_queue.get()
+    if ins is False:
+      return None
+    return ins
+
+  def gather_feas(self, batch_vids, out=None):
+    """Reads the rows of batch_vids."""
+    rows = [self.vid_dict[vid] for vid in batch_vids]
+    return row_store.gather_rows(self.mean_data, rows, out)
+
+  def fill_batch(self, task, views):
+    """Writes a (batch_vids, batch_data) task into the ids, labels and
+    features arrays of a feeder slot, returns the number of videos."""
+    batch_vids, batch_data = task
+    ids, labels, feas = views
+    num_videos = len(batch_vids)
+    ids[:num_videos] = batch_vids
+    self.batch_labels(batch_vids, out=labels)
+    if batch_data is None:
+      self.gather_feas(batch_vids, out=feas[:num_videos])
+    else:
+      feas[:num_videos] = batch_data
+    return num_videos
+
 
 class Feed_fn(object):
   def __init__(self, info, placeholders):
     self._i = info
     self.vid_dict = info.vid_dict
-    self.vid_to_labels = info.vid_to_labels
+    self.label_index = info.label_index
     self.placeholders = placeholders
+    # the labels of the previous batch were fed before the next call
+    self.labels_buffer = info.new_labels_buffer()
 
   def __call__(self):
     ins = self._i.batch_id_queue.get()
     if ins is False:
       raise errors.OutOfRangeError(None, None,
                                    "Already emitted epochs.")
-    vids, dense_labels = ins
-    vid_index = []
-    for vid_idx, vid in enumerate(vids):
-      idx = self.vid_dict[vid]
-      vid_index.append(idx)
-
-    vid_index = np.array(vid_index)
-    vid_index_sortidx = np.argsort(vid_index)
-    try:
-      # TODO
-      batch_data = self._i.mean_data[vid_index[vid_index_sortidx], :]
-      # batch_data = self._i.mean_data[vid_index[vid_index_sortidx], :1024]
-    except:
-      print(vid_index[vid_index_sortidx])
-      print(vids)
-      print("\n")
-
-    batch_data = batch_data[np.argsort(vid_index_sortidx), :]
+    vids, batch_data = ins
+    dense_labels = self._i.batch_labels(vids, out=self.labels_buffer)
+    if batch_data is None:
+      batch_data = self._i.gather_feas(vids)
 
     vals = [np.array(vids), dense_labels, batch_data]
     feed_dict = {}
@@ -139,12 +220,34 @@ class Feed_fn(object):
       feed_dict[pl.name] = val
     return feed_dict
 
-def enqueue_data(feat_type, phase_train, batch_size, num_classes, feature_size, name="enqueue_input",):
-  num_threads = 8
-  fn_setup = Feed_fn_setup(feat_type, num_classes, phase_train, num_threads)
-  queue_types = [tf.string, tf.int64, tf.float32]
-  queue_shapes = [(), (num_classes,), (feature_size,)]
-  capacity = 1500
+def enqueue_data(feat_type, phase_train, batch_size, num_classes, feature_size, name="enqueue_input", max_labels=0,
+                 num_threads=8, capacity=1500, data_dir=None, backend="h5",
+                 block_size=0, buffer_blocks=64, num_processes=0):
+  fn_setup = Feed_fn_setup(feat_type, num_classes, phase_train, num_threads,
+                           max_labels, data_dir, backend, block_size,
+                           buffer_blocks)
+  if max_labels > 0:
+    # label ids padded with -1, densified in build_graph
+    queue_types = [tf.string, tf.int16, tf.float32]
+    queue_shapes = [(), (max_labels,), (feature_size,)]
+  else:
+    # 0/1 labels, cast to float32 in build_graph
+    queue_types = [tf.string, tf.uint8, tf.float32]
+    queue_shapes = [(), (num_classes,), (feature_size,)]
+  if num_processes > 0:
+    # the ids, labels and features of a batch in shared memory, see
+    # process_feeder; the slots match the queue dtypes so they are fed as is
+    max_vid_len = max(len(vid) for vid in fn_setup.vid_dict)
+    feeder = process_feeder.ProcessFeeder(
+        [("S{}".format(max_vid_len), ()),
+         (queue_types[1].as_numpy_dtype, queue_shapes[1]),
+         (np.float32, queue_shapes[2])],
+        fn_setup.batch_size, fn_setup.next_task, fn_setup.fill_batch,
+        init_fn=fn_setup.reopen_feas, num_workers=num_processes,
+        num_slots=2 * num_processes + num_threads)
+    # fork the workers before any other thread runs
+    feeder.start()
+  fn_setup.start_sampler()
   with tf.name_scope(name):
     queue = tf.FIFOQueue(capacity,
                          dtypes=queue_types,
@@ -163,11 +266,14 @@ def enqueue_data(feat_type, phase_train, batch_size, num_classes, feature_size,
       out_ops = return_identity(placeholders)
 
       enqueue_ops.append(queue.enqueue_many(out_ops))
-      feed_fns.append(Feed_fn(fn_setup, placeholders))
+      if num_processes > 0:
+        feed_fns.append(process_feeder.SlotFeedFn(feeder, placeholders))
+      else:
+        feed_fns.append(Feed_fn(fn_setup, placeholders))
 
-    runner = fqr.FeedingQueueRunner(queue=queue,
-                                    enqueue_ops=enqueue_ops,
-                                    feed_fns=feed_fns)
+    runner = fqr.FeedingQueueRunner(
+        queue=queue, enqueue_ops=enqueue_ops, feed_fns=feed_fns,
+        stop_fns=[feeder.stop] if num_processes > 0 else None)
     queue_runner.add_queue_runner(runner)
 
     if phase_train:
@@ -11,6 +11,7 @@ import tensorflow as tf
 from tensorflow.python.training import queue_runner
 from tensorflow.python.framework import errors
 from . import feeding_queue_runner as fqr
+from . import label_index
 
 
 class Feed_fn_setup(object):
@@ -29,19 +30,17 @@ class Feed_fn_setup(object):
     self.phase_train = phase_train
     if self.phase_train:
       stage = "train"
-      print("loading vid info")
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_vid_to_labels_-1.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
     else:
       stage = "validate"
-      with open("/data/uts700/linchao/yt8m/YT/data/vid_info/validate_vid_to_labels.pkl") as fin:
-        self.vid_to_labels = pkl.load(fin)
+    self.label_index = label_index.LabelIndex.load(
+        "/data/uts700/linchao/yt8m/YT/data/vid_info/{}_label_index".format(
+            stage))
     self.vid_dict, self.mean_data = self.load_video_info(stage)
 
     self.vid_dense_labels = []
-    for vid, labels in self.vid_to_labels.iteritems():
+    for row, vid in enumerate(self.label_index.video_ids.tolist()):
       dense_l = np.zeros((num_classes), dtype=np.int64)
-      for l in labels:
+      for l in self.label_index.labels_of(row):
         l = int(l)
         dense_l[l] = 1
       self.vid_dense_labels.append((vid, dense_l))
@@ -84,7 +83,7 @@ class Feed_fn(object):
   def __init__(self, info, placeholders):
     self._i = info
     self.vid_dict = info.vid_dict
-    self.vid_to_labels = info.vid_to_labels
+    self.label_index = info.label_index
     self.placeholders = placeholders
 
   def __call__(self):
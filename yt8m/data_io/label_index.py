@@ -0,0 +1,276 @@
+"""A compact, memory-mappable index from video ids to labels.
+
+The index is a directory of .npy files:
+  video_ids.npy: the sorted video ids as fixed-width byte strings.
+  label_offsets.npy: int64 CSR offsets, the labels of the video in row i are
+    labels[label_offsets[i]: label_offsets[i + 1]].
+  labels.npy: int16 label ids.
+  label_vid_offsets.npy, label_rows.npy: the inverse CSR, the rows of the
+    videos with label l are label_rows[label_vid_offsets[l]:
+    label_vid_offsets[l + 1]], in ascending order.
+
+The files are opened with np.load(mmap_mode="r"), so loading is near instant
+and processes on one machine share the page cache. The hdfs readers expect
+the indexes of the vid_info pickles next to them, as
+vid_info/train_label_index and vid_info/validate_label_index. Only the
+TFRecord builder imports TensorFlow.
+
+Usage:
+  python -m yt8m.data_io.label_index \
+      --vid_to_labels_pkl=vid_info/train_vid_to_labels_-1.pkl \
+      --output_dir=vid_info/train_label_index
+  python -m yt8m.data_io.label_index \
+      --data_pattern='/data/video/validate/validate-*.tfrecord' \
+      --output_dir=vid_info/validate_label_index
+"""
+
+import argparse
+import os
+import cPickle as pkl
+
+import numpy as np
+
+
+class LabelIndex(object):
+  """Maps video ids to rows, rows to sparse or dense labels and labels to
+  rows."""
+
+  # the arrays saved to an index directory, in the order of __init__
+  FILES = ("video_ids", "label_offsets", "labels", "label_vid_offsets",
+           "label_rows")
+
+  def __init__(self, video_ids, label_offsets, labels, label_vid_offsets=None,
+               label_rows=None):
+    """Construct a LabelIndex from its arrays.
+
+    Args:
+      video_ids: a sorted 1-D array of fixed-width byte strings.
+      label_offsets: a 1-D int64 array with len(video_ids) + 1 entries.
+      labels: a 1-D int16 array with the labels of all videos.
+      label_vid_offsets: a 1-D int64 array with num_labels + 1 entries;
+        computed from the other arrays if None.
+      label_rows: a 1-D int32 array with the rows of the videos of all labels;
+        computed from the other arrays if None.
+    """
+    self.video_ids = video_ids
+    self.label_offsets = label_offsets
+    self.labels = labels
+    if label_vid_offsets is None or label_rows is None:
+      label_vid_offsets, label_rows = self.invert()
+    self.label_vid_offsets = label_vid_offsets
+    self.label_rows = label_rows
+
+  def __len__(self):
+    return self.video_ids.shape[0]
+
+  @property
+  def num_labels(self):
+    """One more than the largest label."""
+    return self.label_vid_offsets.shape[0] - 1
+
+  def invert(self):
+    """Computes the label to rows CSR from the row to labels CSR.
+
+    Returns:
+      A tuple (label_vid_offsets, label_rows).
+    """
+    labels = np.asarray(self.labels)
+    rows = np.repeat(np.arange(len(self), dtype=np.int32),
+                     np.diff(self.label_offsets))
+    # a stable sort keeps the rows of every label ascending
+    label_rows = rows[np.argsort(labels, kind="mergesort")]
+    num_labels = int(labels.max()) + 1 if labels.shape[0] else 0
+    label_vid_offsets = np.zeros([num_labels + 1], dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=num_labels),
+              out=label_vid_offsets[1:])
+    return label_vid_offsets, label_rows
+
+  @classmethod
+  def build(cls, vid_to_labels):
+    """Build the index from a dictionary of video id to a list of labels."""
+    sorted_vids = sorted(vid_to_labels.keys())
+    video_ids = np.array(sorted_vids, dtype="S")
+    label_lists = [vid_to_labels[vid] for vid in sorted_vids]
+    label_offsets = np.zeros([len(label_lists) + 1], dtype=np.int64)
+    np.cumsum([len(l) for l in label_lists], out=label_offsets[1:])
+    labels = np.array([int(label) for label_list in label_lists
+                       for label in label_list], dtype=np.int16)
+    return cls(video_ids, label_offsets, labels)
+
+  @classmethod
+  def build_from_tfrecords(cls, data_pattern):
+    """Build the index from the video ids and labels of TFRecord files.
+
+    Reads video-level Examples and frame-level SequenceExamples alike: the
+    context of a SequenceExample has the field number of the features of an
+    Example, so both parse as an Example.
+    """
+    import tensorflow as tf
+    vid_to_labels = {}
+    for path in tf.gfile.Glob(data_pattern):
+      for record in tf.python_io.tf_record_iterator(path):
+        feature = tf.train.Example.FromString(record).features.feature
+        vid_to_labels[feature["video_id"].bytes_list.value[0]] = list(
+            feature["labels"].int64_list.value)
+    return cls.build(vid_to_labels)
+
+  def save(self, index_dir):
+    if not os.path.exists(index_dir):
+      os.makedirs(index_dir)
+    for name in self.FILES:
+      np.save(os.path.join(index_dir, name + ".npy"), getattr(self, name))
+
+  @classmethod
+  def load(cls, index_dir, mmap_mode="r"):
+    """Opens a saved index; the inverse CSR of an index saved without it is
+    computed in memory."""
+    arrays = []
+    for name in cls.FILES:
+      path = os.path.join(index_dir, name + ".npy")
+      arrays.append(np.load(path, mmap_mode=mmap_mode)
+                    if os.path.exists(path) else None)
+    return cls(*arrays)
+
+  def lookup(self, video_ids):
+    """Find the rows of video_ids with a binary search.
+
+    Args:
+      video_ids: a list or 1-D array of video ids.
+
+    Returns:
+      A 1-D int64 array with the row of every video id, -1 if it is unknown.
+    """
+    video_ids = np.asarray(video_ids, dtype=self.video_ids.dtype)
+    if len(self) == 0:
+      return np.zeros(video_ids.shape, dtype=np.int64) - 1
+    rows = np.searchsorted(self.video_ids, video_ids)
+    rows = np.minimum(rows, len(self) - 1)
+    rows[self.video_ids[rows] != video_ids] = -1
+    return rows
+
+  def rows_of(self, video_ids):
+    """Like lookup, but raises KeyError for an unknown video id."""
+    rows = self.lookup(video_ids)
+    if np.any(rows < 0):
+      raise KeyError(np.asarray(video_ids)[rows < 0][0])
+    return rows
+
+  def labels_of(self, row):
+    """Returns the labels of the video in row."""
+    return self.labels[self.label_offsets[row]: self.label_offsets[row + 1]]
+
+  def label_lists(self, rows):
+    """Returns the labels of the videos in rows, one array per row."""
+    return [self.labels_of(row) for row in rows]
+
+  def rows_of_label(self, label):
+    """Returns the ascending rows of the videos with label."""
+    if label >= self.num_labels:
+      return self.label_rows[:0]
+    return self.label_rows[self.label_vid_offsets[label]:
+                           self.label_vid_offsets[label + 1]]
+
+  def video_ids_of_label(self, label):
+    """Returns the ids of the videos with label."""
+    return self.video_ids[self.rows_of_label(label)]
+
+  def gather_positions(self, rows):
+    """Gather the label slices of many rows with their positions.
+
+    Args:
+      rows: a 1-D array of rows.
+
+    Returns:
+      A tuple (batch_rows, within, labels): the labels of all rows
+      concatenated, and for every label the position in rows it belongs to
+      and its position inside the slice of its row.
+    """
+    rows = np.asarray(rows, dtype=np.int64)
+    starts = self.label_offsets[rows]
+    counts = self.label_offsets[rows + 1] - starts
+    batch_rows = np.repeat(np.arange(rows.shape[0]), counts)
+    within = np.arange(batch_rows.shape[0]) - np.repeat(
+        np.cumsum(counts) - counts, counts)
+    return batch_rows, within, self.labels[np.repeat(starts, counts) + within]
+
+  def gather(self, rows):
+    """Like gather_positions, returns only (batch_rows, labels)."""
+    batch_rows, _, labels = self.gather_positions(rows)
+    return batch_rows, labels
+
+  def packed_labels(self, rows, max_labels, out=None):
+    """Build the 'len(rows)' x 'max_labels' int16 label ids of rows padded
+    with -1, the NumPy counterpart of LabelSpace.sparse_ids.
+
+    The first max_labels labels of every row are kept and scattered with one
+    fancy assignment.
+
+    Args:
+      rows: a 1-D array of rows.
+      max_labels: the columns of the matrix.
+      out: optional array with at least len(rows) rows and max_labels
+        columns; its first len(rows) rows are overwritten.
+
+    Returns:
+      The label ids, a view of out if given.
+    """
+    batch_rows, within, labels = self.gather_positions(rows)
+    keep = within < max_labels
+    if out is None:
+      packed = np.empty([len(rows), max_labels], dtype=np.int16)
+    else:
+      packed = out[:len(rows)]
+    packed.fill(-1)
+    packed[batch_rows[keep], within[keep]] = labels[keep]
+    return packed
+
+  def dense_labels(self, rows, num_classes, dtype=np.float32, out=None):
+    """Build the dense 'len(rows)' x 'num_classes' label matrix of rows.
+
+    The label slices of all rows are gathered at once and scattered with one
+    fancy assignment. Labels that are not below num_classes are dropped.
+
+    Args:
+      rows: a 1-D array of rows.
+      num_classes: the columns of the matrix.
+      dtype: the dtype of a new matrix.
+      out: optional array with at least len(rows) rows and num_classes
+        columns, e.g. a buffer reused for every batch; its first len(rows)
+        rows are overwritten.
+
+    Returns:
+      The label matrix, a view of out if given.
+    """
+    batch_rows, labels = self.gather(rows)
+    keep = labels < num_classes
+    if out is None:
+      dense = np.zeros([len(rows), num_classes], dtype=dtype)
+    else:
+      dense = out[:len(rows)]
+      dense.fill(0)
+    dense[batch_rows[keep], labels[keep]] = 1
+    return dense
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Build a label index from a vid_to_labels pickle or the "
+      "video ids and labels of TFRecord files.")
+  source = parser.add_mutually_exclusive_group(required=True)
+  source.add_argument("--vid_to_labels_pkl")
+  source.add_argument("--data_pattern")
+  parser.add_argument("--output_dir", required=True)
+  args = parser.parse_args()
+  if args.vid_to_labels_pkl:
+    with open(args.vid_to_labels_pkl, "rb") as fin:
+      vid_to_labels = pkl.load(fin)
+    index = LabelIndex.build(vid_to_labels)
+  else:
+    index = LabelIndex.build_from_tfrecords(args.data_pattern)
+  index.save(args.output_dir)
+  print("wrote {} videos and {} labels to {}".format(
+      len(index), index.num_labels, args.output_dir))
+
+
+if __name__ == "__main__":
+  main()
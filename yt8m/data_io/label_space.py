@@ -0,0 +1,216 @@
+"""The subset of the vocabulary a model is trained and evaluated on.
+
+Partition models only predict a part of the 4716 classes. A LabelSpace lists
+the global class ids of the model outputs, in output order. The readers use it
+to filter and remap the sparse label ids of an example before densifying them,
+so only the columns of the model are materialized, and the eval and inference
+code use it to map the output columns back to global class ids.
+
+A label space is configured with either
+  config.label_ranges: a list of [start, end) ranges of global class ids, or
+  config.label_index_file: a text file with one global class id per line, or
+    a .npy file of class ids.
+Without either, it is derived from the number of classes of the model, which
+reproduces the fixed partitions of the partition models.
+
+Sparse label transport: with config.sparse_label_max > 0 the readers emit the
+labels of a video as 'max_labels' int16 output columns padded with -1 instead
+of a dense 'num_classes' indicator, and build_graph densifies the batch once
+with LabelSpace.densify. The labels take 2 * max_labels bytes per video in the
+input queues instead of num_classes bools (or int64s).
+"""
+
+import numpy as np
+import tensorflow as tf
+
+TOTAL_NUM_CLASSES = 4716
+
+# the [start, end) ranges of the partition models, by their num_classes
+LEGACY_PARTITIONS = {
+    500: (0, 500),
+    501: (500, 1001),
+    502: (1001, 1503),
+    503: (1503, 2006),
+    504: (2006, 2510),
+    505: (2510, 3015),
+    506: (3015, 3521),
+    507: (3521, 4028),
+    508: (4028, 4716),
+    1000: (0, 1000),
+    1001: (1000, 2001),
+    3000: (1000, 4000),
+}
+
+
+class LabelSpace(object):
+  """Maps global class ids to the output columns of a model and back."""
+
+  def __init__(self, class_ids, total_num_classes=TOTAL_NUM_CLASSES):
+    """Construct a LabelSpace.
+
+    Args:
+      class_ids: the global class id of every output column.
+      total_num_classes: the size of the global vocabulary.
+
+    Raises:
+      ValueError: The class ids are out of range or not unique.
+    """
+    class_ids = np.asarray(class_ids, dtype=np.int64)
+    if class_ids.size and (class_ids.min() < 0 or
+                           class_ids.max() >= total_num_classes):
+      raise ValueError("class ids must be in [0, {}).".format(
+          total_num_classes))
+    if np.unique(class_ids).size != class_ids.size:
+      raise ValueError("class ids must be unique.")
+    self.class_ids = class_ids
+    self.total_num_classes = total_num_classes
+    # the output column of every global class id, -1 if it is left out
+    self.columns = np.zeros([total_num_classes], dtype=np.int64) - 1
+    self.columns[class_ids] = np.arange(class_ids.size)
+
+  @property
+  def num_classes(self):
+    return self.class_ids.size
+
+  @property
+  def is_full(self):
+    """Whether the output columns are exactly the global class ids."""
+    return (self.num_classes == self.total_num_classes and
+            np.all(self.class_ids == np.arange(self.total_num_classes)))
+
+  @classmethod
+  def from_ranges(cls, ranges, total_num_classes=TOTAL_NUM_CLASSES):
+    return cls(np.concatenate([np.arange(start, end) for start, end in ranges]),
+               total_num_classes)
+
+  @classmethod
+  def from_index_file(cls, path, total_num_classes=TOTAL_NUM_CLASSES):
+    if path.endswith(".npy"):
+      class_ids = np.load(path)
+    else:
+      class_ids = np.loadtxt(path, dtype=np.int64, ndmin=1)
+    return cls(class_ids, total_num_classes)
+
+  @classmethod
+  def for_num_classes(cls, num_classes):
+    """The label space of a model, derived from its number of classes."""
+    start, end = LEGACY_PARTITIONS.get(
+        num_classes, (0, min(num_classes, TOTAL_NUM_CLASSES)))
+    return cls.from_ranges([(start, end)])
+
+  @classmethod
+  def from_config(cls, config, num_classes):
+    """The label space configured by config, see the module docstring.
+
+    Raises:
+      ValueError: The configured label space does not have num_classes
+        classes.
+    """
+    if getattr(config, "label_ranges", None):
+      label_space = cls.from_ranges(config.label_ranges)
+    elif getattr(config, "label_index_file", None):
+      label_space = cls.from_index_file(config.label_index_file)
+    else:
+      return cls.for_num_classes(num_classes)
+    if label_space.num_classes != num_classes:
+      raise ValueError("the label space has {} classes, the model {}.".format(
+          label_space.num_classes, num_classes))
+    return label_space
+
+  def _local_ids(self, class_ids):
+    """Remaps global class ids, returns the kept ids and the keep mask."""
+    local_ids = tf.gather(tf.constant(self.columns), class_ids)
+    keep = tf.greater_equal(local_ids, 0)
+    return tf.boolean_mask(local_ids, keep), keep
+
+  def sparse_to_dense(self, class_ids):
+    """Densifies the 1-D global class ids of one video into a bool vector."""
+    if not self.is_full:
+      class_ids, _ = self._local_ids(class_ids)
+    return tf.cast(
+        tf.sparse_to_dense(class_ids, (self.num_classes,), 1,
+                           validate_indices=False),
+        tf.bool)
+
+  def sparse_to_indicator(self, sparse_labels):
+    """Densifies a batch of global class ids into a bool matrix.
+
+    Args:
+      sparse_labels: a 'batch' x 'max_labels' SparseTensor of class ids, as
+        parsed from a VarLenFeature.
+
+    Returns:
+      A 'batch' x 'num_classes' bool tensor.
+    """
+    if self.is_full:
+      return tf.sparse_to_indicator(sparse_labels, self.num_classes)
+    local_ids, keep = self._local_ids(sparse_labels.values)
+    rows = tf.boolean_mask(sparse_labels.indices[:, 0], keep)
+    labels = tf.sparse_to_dense(
+        tf.stack([rows, local_ids], 1),
+        tf.stack([sparse_labels.dense_shape[0], self.num_classes]),
+        True, default_value=False, validate_indices=False)
+    labels.set_shape([None, self.num_classes])
+    return labels
+
+  def sparse_ids(self, class_ids, max_labels):
+    """Packs the global class ids of one video for sparse label transport.
+
+    Args:
+      class_ids: 1-D int64 tensor of global class ids.
+      max_labels: the number of slots; labels past it are dropped.
+
+    Returns:
+      A 'max_labels' int16 tensor of output columns padded with -1.
+    """
+    if not self.is_full:
+      class_ids, _ = self._local_ids(class_ids)
+    class_ids = class_ids[:max_labels]
+    label_ids = tf.concat([
+        class_ids,
+        tf.fill([max_labels - tf.size(class_ids)],
+                tf.constant(-1, dtype=tf.int64))], 0)
+    label_ids = tf.cast(label_ids, tf.int16)
+    label_ids.set_shape([max_labels])
+    return label_ids
+
+  def sparse_ids_batch(self, sparse_labels, max_labels):
+    """Like sparse_ids for a 'batch' x 'max_labels' SparseTensor of class ids.
+
+    Returns:
+      A 'batch' x 'max_labels' int16 tensor of output columns padded with -1.
+    """
+    indices, class_ids = sparse_labels.indices, sparse_labels.values
+    keep = indices[:, 1] < max_labels
+    if not self.is_full:
+      class_ids = tf.gather(tf.constant(self.columns), class_ids)
+      keep = tf.logical_and(keep, tf.greater_equal(class_ids, 0))
+    label_ids = tf.sparse_to_dense(
+        tf.boolean_mask(indices, keep),
+        tf.stack([sparse_labels.dense_shape[0], max_labels]),
+        tf.boolean_mask(class_ids, keep), default_value=-1,
+        validate_indices=False)
+    label_ids = tf.cast(label_ids, tf.int16)
+    label_ids.set_shape([None, max_labels])
+    return label_ids
+
+  def densify(self, label_ids):
+    """Densifies 'batch' x 'max_labels' label ids padded with -1.
+
+    Returns:
+      A 'batch' x 'num_classes' bool tensor.
+    """
+    label_ids = tf.to_int64(label_ids)
+    positions = tf.where(tf.greater_equal(label_ids, 0))
+    labels = tf.sparse_to_dense(
+        tf.stack([positions[:, 0], tf.gather_nd(label_ids, positions)], 1),
+        tf.stack([tf.shape(label_ids, out_type=tf.int64)[0],
+                  self.num_classes]),
+        True, default_value=False, validate_indices=False)
+    labels.set_shape([None, self.num_classes])
+    return labels
+
+  def to_global(self, columns):
+    """Maps output columns to global class ids."""
+    return self.class_ids[columns]
+
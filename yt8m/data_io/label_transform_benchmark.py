@@ -0,0 +1,169 @@
+"""Throughput of the label transforms of the readers.
+
+Compares the native TensorFlow label transforms in readers with the NumPy
+versions they replaced, which ran through tf.py_func. Every transform is run
+by num_threads Python threads on one session, like the reader threads of the
+input pipeline, on labels generated in the graph.
+
+Usage:
+  python -m yt8m.data_io.label_transform_benchmark --num_threads=8
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from . import readers
+
+NUM_CLASSES = 4716
+
+
+def sort_and_pad_py(x, num_max_labels, sos_id, eos_id, pad_id):
+  """The NumPy sort_and_pad, kept as a reference."""
+  x = np.sort(x)[::-1]
+  x = x.tolist()
+  w = np.ones((num_max_labels), dtype=np.int64)
+  w[-1] = 0
+  caps_len = num_max_labels - 2
+  if len(x) > caps_len:
+    s = np.random.randint(len(x) - caps_len + 1)
+    x = [sos_id] + x[s: s+caps_len] + [eos_id]
+  else:
+    x = [sos_id] + x + [eos_id]
+    num_pad = num_max_labels - len(x)
+    x = x + [pad_id] * num_pad
+    w[-1 * num_pad - 1:] = 0
+  return (np.array(x, dtype=np.int64), w)
+
+
+def random_pick_one_py(x, num_classes):
+  """The NumPy random_pick_one, kept as a reference."""
+  x = x.tolist()
+  if np.random.randint(5) == 0:
+    exclude_x = list(set(range(num_classes)) - set(x))
+    x = [exclude_x[np.random.randint(len(exclude_x))],]
+    w = [num_classes + x[0]]
+  else:
+    idx = np.random.randint(len(x))
+    x = [x[idx],]
+    w = x
+  return (np.array(x, dtype=np.int64), np.array(w, dtype=np.int64))
+
+
+def gen_sparse_label_py(x):
+  """The NumPy gen_sparse_label, kept as a reference."""
+  return_x = np.zeros((NUM_CLASSES), dtype=np.int64) + NUM_CLASSES
+  return_w = np.zeros((NUM_CLASSES), dtype=np.float32) + 1/float(NUM_CLASSES)
+  for i in x.tolist():
+    return_x[i] = i
+    return_w[i] = 1.
+  return (return_x, return_w)
+
+
+def gen_sparse_label_batch_py(x):
+  """The NumPy gen_sparse_label_batch, kept as a reference."""
+  return_x = np.zeros((x.shape[0], NUM_CLASSES), dtype=np.int64) + NUM_CLASSES
+  return_w = np.zeros((x.shape[0], NUM_CLASSES), dtype=np.float32) + \
+      3/float(NUM_CLASSES)
+  indicator = np.where(x == 1)
+  r, c = indicator[0], indicator[1]
+  for i in xrange(r.shape[0]):
+    return_x[r[i], c[i]] = c[i]
+    return_w[r[i], c[i]] = 1.
+  return (return_x, return_w)
+
+
+def random_labels(max_labels=8):
+  """The labels of one video: 1 to max_labels distinct class ids."""
+  num_labels = tf.random_uniform([], minval=1, maxval=max_labels + 1,
+                                 dtype=tf.int32)
+  labels, _ = tf.unique(tf.random_uniform([num_labels], maxval=NUM_CLASSES,
+                                          dtype=tf.int64))
+  return labels
+
+
+def random_dense_labels(batch_size, mean_labels=3.):
+  return tf.random_uniform([batch_size, NUM_CLASSES]) < (
+      mean_labels / NUM_CLASSES)
+
+
+def build_transforms(batch_size, num_max_labels=10):
+  """Builds the (name, py_func op, native op, examples per run) cases."""
+  sos_id, eos_id, pad_id = NUM_CLASSES + 1, NUM_CLASSES + 2, NUM_CLASSES
+  cases = []
+
+  labels = random_labels()
+  cases.append((
+      "sort_and_pad",
+      tf.py_func(lambda x: sort_and_pad_py(x, num_max_labels, sos_id, eos_id,
+                                           pad_id),
+                 [labels], [tf.int64, tf.int64]),
+      readers.sort_and_pad(labels, num_max_labels, sos_id, eos_id, pad_id),
+      1))
+
+  labels = random_labels()
+  cases.append((
+      "random_pick_one",
+      tf.py_func(lambda x: random_pick_one_py(x, NUM_CLASSES), [labels],
+                 [tf.int64, tf.int64]),
+      readers.random_pick_one(labels, NUM_CLASSES),
+      1))
+
+  labels = random_labels()
+  cases.append((
+      "gen_sparse_label",
+      tf.py_func(gen_sparse_label_py, [labels], [tf.int64, tf.float32]),
+      readers.gen_sparse_label(labels, NUM_CLASSES),
+      1))
+
+  dense_labels = random_dense_labels(batch_size)
+  cases.append((
+      "gen_sparse_label_batch",
+      tf.py_func(gen_sparse_label_batch_py, [dense_labels],
+                 [tf.int64, tf.float32]),
+      readers.gen_sparse_label_batch(dense_labels),
+      batch_size))
+  return cases
+
+
+def examples_per_second(sess, op, examples_per_run, num_threads, num_runs):
+  """Runs op num_runs times in each of num_threads threads."""
+  def run():
+    for _ in xrange(num_runs):
+      sess.run(op)
+
+  sess.run(op)  # warm up
+  threads = [threading.Thread(target=run) for _ in xrange(num_threads)]
+  start = time.time()
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+  return num_threads * num_runs * examples_per_run / (time.time() - start)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--num_threads", type=int, default=8)
+  parser.add_argument("--num_runs", type=int, default=200)
+  parser.add_argument("--batch_size", type=int, default=1024)
+  args = parser.parse_args()
+
+  cases = build_transforms(args.batch_size)
+  with tf.Session() as sess:
+    for name, py_func_op, native_op, examples_per_run in cases:
+      num_runs = max(args.num_runs // examples_per_run, 10)
+      py_func_rate = examples_per_second(sess, py_func_op, examples_per_run,
+                                         args.num_threads, num_runs)
+      native_rate = examples_per_second(sess, native_op, examples_per_run,
+                                        args.num_threads, num_runs)
+      print("%s, %d threads: py_func %.0f ex/s | native %.0f ex/s | "
+            "speedup %.1fx" % (name, args.num_threads, py_func_rate,
+                               native_rate, native_rate / py_func_rate))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,208 @@
+"""Feeder worker processes filling shared-memory batch slots.
+
+The feed functions of FeedingQueueRunner run in Python threads, so their
+NumPy indexing and label densification share one core under the GIL. A
+ProcessFeeder moves that work into worker processes:
+
+  a task thread in the training process hands small picklable tasks (e.g.
+      the video ids of a batch) to the workers,
+  every worker process fills a free slot of a ring of preallocated
+      shared-memory batches with a task (features, labels, ids) and passes
+      the slot back,
+  the enqueue threads feed views of the filled slot to sess.run(enqueue_op)
+      without copying it, and return the slot when they ask for the next one.
+
+Worker errors are raised in the enqueue threads, where FeedingQueueRunner
+reports them to the Coordinator; when the Coordinator stops, the runner stops
+the feeder through its stop_fns. The workers are forked when the feeder is
+started, which should happen while building the graph, before a Session
+starts the TensorFlow threads.
+"""
+
+import multiprocessing
+import Queue
+import threading
+import traceback
+
+import numpy as np
+from tensorflow.python.framework import errors
+
+# the messages of the workers to the enqueue threads
+_SLOT, _DONE, _ERROR = range(3)
+# seconds between checks for a stop or a dead worker while waiting for a slot
+_POLL_SECS = 1.
+
+
+class SharedBatchRing(object):
+  """Preallocated batches in shared memory, one array per field per slot."""
+
+  def __init__(self, fields, batch_size, num_slots):
+    """Allocate the ring.
+
+    Args:
+      fields: a list of (dtype, row_shape) of the fields of a batch.
+      batch_size: the rows of a slot.
+      num_slots: the number of slots.
+    """
+    self.num_slots = num_slots
+    self.slots = []
+    for _ in xrange(num_slots):
+      views = []
+      for dtype, row_shape in fields:
+        dtype = np.dtype(dtype)
+        shape = (batch_size,) + tuple(row_shape)
+        buf = multiprocessing.RawArray(
+            "b", int(np.prod(shape)) * dtype.itemsize)
+        views.append(np.frombuffer(buf, dtype=dtype).reshape(shape))
+      self.slots.append(views)
+
+  def views(self, slot):
+    return self.slots[slot]
+
+
+class ProcessFeeder(object):
+  """Fills the slots of a SharedBatchRing in worker processes."""
+
+  def __init__(self, fields, batch_size, task_fn, fill_fn, init_fn=None,
+               num_workers=4, num_slots=None):
+    """Construct a ProcessFeeder; call start() to fork the workers.
+
+    Args:
+      fields: a list of (dtype, row_shape) of the fields of a batch.
+      batch_size: the maximum rows of a batch.
+      task_fn: called in the task thread, returns the next task or None when
+        there are no more.
+      fill_fn: called in a worker as fill_fn(task, views), writes the batch
+        of task into the first rows of the field arrays views and returns
+        the number of rows.
+      init_fn: called once in every worker before its first task, e.g. to
+        reopen files that must not be shared across a fork.
+      num_workers: the number of worker processes.
+      num_slots: the slots of the ring, by default two per worker.
+    """
+    self.fields = fields
+    self.task_fn = task_fn
+    self.fill_fn = fill_fn
+    self.init_fn = init_fn
+    self.num_workers = num_workers
+    self.ring = SharedBatchRing(fields, batch_size,
+                                num_slots or 2 * num_workers)
+    self.task_queue = multiprocessing.Queue(2 * num_workers)
+    self.free_slots = multiprocessing.Queue()
+    for slot in xrange(self.ring.num_slots):
+      self.free_slots.put(slot)
+    self.filled_slots = multiprocessing.Queue()
+    self.workers = []
+    self._lock = threading.Lock()
+    self._num_done = 0
+    self._stopped = threading.Event()
+
+  def start(self):
+    for worker_id in xrange(self.num_workers):
+      worker = multiprocessing.Process(target=self._work, args=(worker_id,))
+      worker.daemon = True
+      worker.start()
+      self.workers.append(worker)
+    task_thread = threading.Thread(target=self._put_tasks)
+    task_thread.daemon = True
+    task_thread.start()
+
+  def _put_tasks(self):
+    while not self._stopped.is_set():
+      task = self.task_fn()
+      if task is None:
+        break
+      self.task_queue.put(task)
+    for _ in xrange(self.num_workers):
+      self.task_queue.put(None)
+
+  def _work(self, worker_id):
+    try:
+      if self.init_fn is not None:
+        self.init_fn()
+      while True:
+        task = self.task_queue.get()
+        if task is None:
+          break
+        slot = self.free_slots.get()
+        num_rows = self.fill_fn(task, self.ring.views(slot))
+        self.filled_slots.put((_SLOT, slot, num_rows))
+      self.filled_slots.put((_DONE, worker_id, 0))
+    except Exception:
+      self.filled_slots.put((_ERROR, traceback.format_exc(), 0))
+
+  def get(self):
+    """Waits for a filled slot.
+
+    Returns:
+      A tuple (slot, num_rows).
+
+    Raises:
+      OutOfRangeError: All workers finished their tasks.
+      CancelledError: The feeder was stopped.
+      RuntimeError: A worker failed.
+    """
+    while True:
+      with self._lock:
+        if self._num_done == self.num_workers:
+          raise errors.OutOfRangeError(None, None,
+                                       "The feeder workers are done.")
+      if self._stopped.is_set():
+        raise errors.CancelledError(None, None, "The feeder was stopped.")
+      try:
+        kind, value, num_rows = self.filled_slots.get(timeout=_POLL_SECS)
+      except Queue.Empty:
+        for worker in self.workers:
+          if worker.exitcode not in (0, None):
+            raise RuntimeError("feeder worker {} exited with code {}".format(
+                worker.pid, worker.exitcode))
+        continue
+      if kind == _SLOT:
+        return value, num_rows
+      elif kind == _DONE:
+        with self._lock:
+          self._num_done += 1
+      else:
+        raise RuntimeError("feeder worker failed:\n" + value)
+
+  def release(self, slot):
+    self.free_slots.put(slot)
+
+  def stop(self):
+    self._stopped.set()
+    for worker in self.workers:
+      if worker.is_alive():
+        worker.terminate()
+    for worker in self.workers:
+      worker.join()
+    # nobody reads the queues anymore, do not wait for their buffers to be
+    # flushed when the process exits
+    for queue in (self.task_queue, self.free_slots, self.filled_slots):
+      queue.cancel_join_thread()
+
+
+class SlotFeedFn(object):
+  """The feed function of one enqueue thread of a ProcessFeeder.
+
+  Feeds views of a filled slot; the slot is returned to the ring on the next
+  call, after the enqueue op of the thread consumed it.
+  """
+
+  def __init__(self, feeder, placeholders):
+    self.feeder = feeder
+    self.placeholders = placeholders
+    self._slot = None
+
+  def __call__(self):
+    if self._slot is not None:
+      self.feeder.release(self._slot)
+      self._slot = None
+    self._slot, num_rows = self.feeder.get()
+    feed_dict = {}
+    for pl, view in zip(self.placeholders, self.feeder.ring.views(self._slot)):
+      if view.dtype.kind == "S":
+        # fixed-width ids are fed as a list of the ids without padding
+        feed_dict[pl.name] = view[:num_rows].tolist()
+      else:
+        feed_dict[pl.name] = view[:num_rows]
+    return feed_dict
@@ -17,6 +17,7 @@
 import numpy as np
 import tensorflow as tf
 from yt8m import utils
+from yt8m.data_io import label_space as label_space_lib
 
 from tensorflow import logging
 
@@ -57,61 +58,112 @@ def resize_axis(tensor, axis, new_size, fill_value=0):
   resized.set_shape(new_shape)
   return resized
 
-def sort_and_pad(x):
-  # TODO
-  x = np.sort(x)[::-1]
-  x = x.tolist()
-  w = np.ones((self.num_max_labels), dtype=np.int64)
-  w[-1] = 0
-  caps_len = self.num_max_labels - 2
-  if len(x) > caps_len:
-    s = np.random.randint(len(x) - caps_len + 1)
-    x = [self.sos_id] + x[s: s+caps_len] + [self.eos_id]
-  else:
-    x = [self.sos_id] + x + [self.eos_id]
-    num_pad = self.num_max_labels - len(x)
-    x = x + [self.pad_id] * num_pad
-    w[-1 * num_pad - 1:] = 0
-
-    # pad = np.zeros((self.num_max_labels,), dtype=np.int64)
-    # pad[: len(x)] = x
-    # w[x.shape[0]:] = 0
-    # x = pad
-  return (x, w)
-
-def random_pick_one(x):
-  x = x.tolist()
-  # TODO
-  if np.random.randint(5) == 0:
-    exclude_x = list(self.classes - set(x))
-    x = [exclude_x[np.random.randint(len(exclude_x))],]
-    w = [self.num_classes + x[0]]
-    # w = [1,]
-  else:
-    idx = np.random.randint(len(x))
-    x = [x[idx],]
-    w = x
-    # w = [1,]
-  return (x, w)
-
-def gen_sparse_label(x):
-  return_x = np.zeros((4716), dtype=np.int64) + 4716
-  return_w = np.zeros((4716), dtype=np.float32) + 1/4716.
-  x = x.tolist()
-  for i in x:
-    return_x[i] = i
-    return_w[i] = 1.
-  return (return_x, return_w)
-
-def gen_sparse_label_batch(x):
-  return_x = np.zeros((x.shape[0], 4716), dtype=np.int64) + 4716
-  return_w = np.zeros((x.shape[0], 4716), dtype=np.float32) + 3/4716.
-  indicator = np.where(x == 1)
-  r, c = indicator[0], indicator[1]
-  for i in xrange(r.shape[0]):
-    return_x[r[i], c[i]] = c[i]
-    return_w[r[i], c[i]] = 1.
-  return (return_x, return_w)
+def dequantize_frames(quantized_matrix, num_frames, max_quantized_value=2,
+                      min_quantized_value=-2):
+  """Dequantizes a batch of padded uint8 frame matrices.
+
+  Args:
+    quantized_matrix: 'batch' x 'max_frames' x 'feature_size' uint8 tensor.
+    num_frames: 'batch' int32 tensor of the valid frames of every video.
+    max_quantized_value: the maximum of the quantized value.
+    min_quantized_value: the minimum of the quantized value.
+
+  Returns:
+    The float32 frame matrices, with the padded frames set to zero.
+  """
+  # the padded length is only known at run time with bucketed batches
+  max_frames = tf.shape(quantized_matrix)[1]
+  video_matrix = utils.Dequantize(tf.cast(quantized_matrix, tf.float32),
+                                  max_quantized_value,
+                                  min_quantized_value)
+  mask = tf.sequence_mask(num_frames, max_frames, dtype=tf.float32)
+  return video_matrix * tf.expand_dims(mask, 2)
+
+def sort_and_pad(labels, num_max_labels, sos_id, eos_id, pad_id):
+  """Frames the labels of one video as a fixed-length label sequence.
+
+  The labels are sorted in descending order, and a random window of at most
+  num_max_labels - 2 of them is framed by sos_id and eos_id and padded with
+  pad_id.
+
+  Args:
+    labels: 1-D int64 tensor of the labels of one video.
+    num_max_labels: the length of the label sequence.
+    sos_id, eos_id, pad_id: the start, end and padding ids.
+
+  Returns:
+    A tuple (sequence, weights) of 'num_max_labels' int64 tensors; the weights
+    are 1 for the start id and the labels, 0 from the end id on.
+  """
+  num_labels = tf.size(labels)
+  sorted_labels, _ = tf.nn.top_k(labels, k=num_labels)
+  num_kept = tf.minimum(num_labels, num_max_labels - 2)
+  start = tf.random_uniform([], maxval=num_labels - num_kept + 1,
+                            dtype=tf.int32)
+  sequence = tf.concat([
+      tf.constant([sos_id], dtype=tf.int64),
+      tf.slice(sorted_labels, [start], [num_kept]),
+      tf.constant([eos_id], dtype=tf.int64),
+      tf.fill([num_max_labels - num_kept - 2],
+              tf.constant(pad_id, dtype=tf.int64))], 0)
+  sequence.set_shape([num_max_labels])
+  weights = tf.to_int64(tf.range(num_max_labels) < num_kept + 1)
+  return sequence, weights
+
+def random_pick_one(labels, num_classes):
+  """Picks one label of a video, or with probability 1/5 a negative class.
+
+  Args:
+    labels: 1-D int64 tensor of the labels of one video.
+    num_classes: the number of classes.
+
+  Returns:
+    A tuple (label, weight) of 1-element int64 tensors: the picked label and
+    the label itself, or the negative class and num_classes plus the class.
+  """
+  positive = labels[tf.random_uniform([], maxval=tf.size(labels),
+                                      dtype=tf.int32)]
+  is_label = tf.sparse_to_dense(labels, [num_classes], True,
+                                default_value=False, validate_indices=False)
+  negatives = tf.where(tf.logical_not(is_label))[:, 0]
+  negative = negatives[tf.random_uniform([], maxval=tf.size(negatives),
+                                         dtype=tf.int32)]
+  pick_negative = tf.random_uniform([], maxval=5, dtype=tf.int32) < 1
+  label = tf.where(pick_negative, negative, positive)
+  weight = tf.where(pick_negative, num_classes + negative, positive)
+  return tf.reshape(label, [1]), tf.reshape(weight, [1])
+
+def _sparse_label_from_dense(dense_labels, negative_weight):
+  """Labels become their class id and weight 1, the rest the pad class."""
+  num_classes = tf.shape(dense_labels)[-1]
+  is_label = tf.cast(dense_labels, tf.bool)
+  class_ids = tf.to_int64(tf.range(num_classes)) + tf.zeros_like(
+      dense_labels, dtype=tf.int64)
+  sparse_labels = tf.where(is_label, class_ids,
+                           tf.zeros_like(class_ids) + tf.to_int64(num_classes))
+  label_weights = tf.where(is_label, tf.ones_like(class_ids, dtype=tf.float32),
+                           tf.zeros_like(class_ids, dtype=tf.float32) +
+                           negative_weight)
+  return sparse_labels, label_weights
+
+def gen_sparse_label(labels, num_classes=4716):
+  """Expands the labels of one video over all classes.
+
+  Returns:
+    A tuple of 'num_classes' tensors: the class id at the labels and
+    num_classes elsewhere, and weight 1 at the labels and 1 / num_classes
+    elsewhere.
+  """
+  dense_labels = tf.sparse_to_dense(labels, [num_classes], True,
+                                    default_value=False,
+                                    validate_indices=False)
+  return _sparse_label_from_dense(dense_labels, 1. / num_classes)
+
+def gen_sparse_label_batch(dense_labels):
+  """Like gen_sparse_label for a 'batch' x 'num_classes' label matrix, with
+  weight 3 / num_classes off the labels."""
+  num_classes = dense_labels.get_shape().as_list()[-1]
+  return _sparse_label_from_dense(dense_labels, 3. / num_classes)
 
 class BaseReader(object):
   """Inherit from this class when implementing new readers."""
@@ -133,13 +185,20 @@ class YT8MAggregatedFeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["mean_inc3"],
-               num_max_labels=-1):
+               num_max_labels=-1,
+               label_space=None,
+               sparse_label_max=0):
     """Construct a YT8MAggregatedFeatureReader.
 
     Args:
       num_classes: a positive integer for the number of classes.
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
+      label_space: the LabelSpace of the labels, by default derived from
+        num_classes.
+      sparse_label_max: if positive, the labels are emitted as this many
+        int16 label ids padded with -1 instead of a dense indicator, see
+        label_space.
     """
 
     assert len(feature_names) == len(feature_sizes), \
@@ -150,6 +209,10 @@ class YT8MAggregatedFeatureReader(BaseReader):
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.num_max_labels = num_max_labels
+    self.label_space = (label_space or
+                        label_space_lib.LabelSpace.for_num_classes(num_classes))
+    # the label transforms of num_max_labels > 0 need the dense labels
+    self.sparse_label_max = sparse_label_max if num_max_labels <= 0 else 0
 
   def prepare_reader(self, filename_queue, batch_size=1024):
     """Creates a single reader thread for pre-aggregated YouTube 8M Examples.
@@ -180,40 +243,11 @@ class YT8MAggregatedFeatureReader(BaseReader):
     # TODO
     # labels = tf.sparse_to_indicator(features["labels"], self.num_classes)
     # labels = tf.zeros((self.num_classes), dtype=tf.float32)
-    labels = tf.sparse_to_indicator(features["labels"], 4716)
-    if self.num_classes == 500:            # 500
-      labels = labels[:, 0: 500]
-    if self.num_classes == 501:            # 501
-      labels = labels[:, 500: 1001]
-    if self.num_classes == 502:            # 502
-      labels = labels[:, 1001: 1503]
-    if self.num_classes == 503:            # 503
-      labels = labels[:, 1503: 2006]
-    if self.num_classes == 504:            # 504
-      labels = labels[:, 2006: 2510]
-    if self.num_classes == 505:            # 505
-      labels = labels[:, 2510: 3015]
-    if self.num_classes == 506:            # 506
-      labels = labels[:, 3015: 3521]
-    if self.num_classes == 507:            # 507
-      labels = labels[:, 3521: 4028]
-    if self.num_classes == 508:            # 508
-      labels = labels[:, 4028: 4716]
-    '''
-    if self.num_classes == 25:            # 25
-      labels = labels[:, 0: 25]
-    elif self.num_classes == 250 - 25:    # 225
-      labels = labels[:, 25: 250]
-    elif self.num_classes == 1250 - 250:  # 1000
-      labels = labels[:, 250: 1250]
-    elif self.num_classes == 2500 - 1250: # 1250
-      labels = labels[:, 1250: 2500]
-    elif self.num_classes == 3600 - 2500: # 1100
-      labels = labels[:, 2500: 3600]
-    elif self.num_classes == 4716 - 3600: # 1116
-      labels = labels[:, 3600: 4716]
-    '''
-    labels.set_shape([None, self.num_classes])
+    if self.sparse_label_max > 0:
+      labels = self.label_space.sparse_ids_batch(features["labels"],
+                                                 self.sparse_label_max)
+    else:
+      labels = self.label_space.sparse_to_indicator(features["labels"])
 
     concatenated_features = tf.concat([
         features[feature_name] for feature_name in self.feature_names], 1)
@@ -221,9 +255,7 @@ class YT8MAggregatedFeatureReader(BaseReader):
 
     # sparse_labels = features["labels"].values
     if self.num_max_labels == 4716:
-      sparse_labels, label_weights = tf.py_func(gen_sparse_label_batch, [labels], [tf.int64, tf.float32])
-      sparse_labels = tf.reshape(sparse_labels, [-1, self.num_max_labels])
-      label_weights = tf.reshape(label_weights, [-1, self.num_max_labels])
+      sparse_labels, label_weights = gen_sparse_label_batch(labels)
 
     return features["video_id"], concatenated_features, labels, sparse_labels, tf.ones([tf.shape(serialized_examples)[0]]), label_weights, input_weights
 
@@ -241,7 +273,13 @@ class YT8MFrameFeatureReader(BaseReader):
                feature_sizes=[1024],
                feature_names=["inc3"],
                max_frames=300,
-               num_max_labels=-1):
+               num_max_labels=-1,
+               read_batch_size=0,
+               keep_quantized=False,
+               label_space=None,
+               sparse_label_max=0,
+               frame_sampling=None,
+               frame_sampling_size=0):
     """Construct a YT8MFrameFeatureReader.
 
     Args:
@@ -249,6 +287,28 @@ class YT8MFrameFeatureReader(BaseReader):
       feature_sizes: positive integer(s) for the feature dimensions as a list.
       feature_names: the feature name(s) in the tensorflow record as a list.
       max_frames: the maximum number of frames to process.
+      read_batch_size: if larger than 1, read and decode up to this many
+        SequenceExamples per op invocation, see prepare_reader_batch.
+      keep_quantized: if True, the video matrices are emitted as uint8 and
+        dequantized after batching with dequantize_frames, which keeps a 4x
+        smaller representation in the input queues.
+      label_space: the LabelSpace of the dense labels, by default derived
+        from num_classes.
+      sparse_label_max: if positive, the dense labels are emitted as this
+        many int16 label ids padded with -1, see label_space.
+      frame_sampling: keep only some frames of every video, before they are
+        dequantized, concatenated and enqueued:
+          "stride": every frame_sampling_size-th frame.
+          "window": a random window of frame_sampling_size frames.
+          "uniform": frame_sampling_size distinct frames drawn uniformly at
+            random without replacement, in temporal order; all frames of a
+            shorter video.
+          "segment_mean": the means of frame_sampling_size equal segments.
+        None keeps all frames.
+      frame_sampling_size: the parameter of frame_sampling.
+
+    Raises:
+      ValueError: frame_sampling is unknown.
     """
 
     assert len(feature_names) == len(feature_sizes), \
@@ -260,10 +320,76 @@ class YT8MFrameFeatureReader(BaseReader):
     self.feature_names = feature_names
     self.max_frames = max_frames
     self.num_max_labels = num_max_labels
+    self.read_batch_size = read_batch_size
+    self.keep_quantized = keep_quantized
+    self.label_space = (label_space or
+                        label_space_lib.LabelSpace.for_num_classes(num_classes))
+    # the label transforms of num_max_labels > 0 need the dense labels
+    self.sparse_label_max = sparse_label_max if num_max_labels <= 0 else 0
     self.pad_id = self.num_classes
     self.sos_id = self.num_classes + 1
     self.eos_id = self.num_classes + 2
-    self.classes = set(range(self.num_classes))
+    if frame_sampling not in (None, "stride", "window", "uniform",
+                              "segment_mean"):
+      raise ValueError("unknown frame_sampling: {}".format(frame_sampling))
+    self.frame_sampling = frame_sampling
+    self.frame_sampling_size = frame_sampling_size
+    # the length the frames of a video are padded to
+    if frame_sampling is None:
+      self.num_output_frames = max_frames
+    elif frame_sampling == "stride":
+      self.num_output_frames = (max_frames + frame_sampling_size - 1) // \
+          frame_sampling_size
+    else:
+      self.num_output_frames = min(frame_sampling_size, max_frames)
+
+  def sample_frames(self, features):
+    """Decodes the features of one video and keeps the sampled frames.
+
+    The frames of all features are selected together and stay uint8;
+    segment means are rounded back to uint8.
+
+    Args:
+      features: the parsed sequence features.
+
+    Returns:
+      A tuple of the list of unpadded uint8 frame matrices, one per feature,
+      and the number of kept frames.
+    """
+    decoded_matrices = [
+        tf.reshape(tf.decode_raw(features[feature_name], tf.uint8),
+                   [-1, feature_size])
+        for feature_name, feature_size in zip(self.feature_names,
+                                              self.feature_sizes)]
+    num_frames = tf.minimum(tf.shape(decoded_matrices[0])[0], self.max_frames)
+    size = self.frame_sampling_size
+
+    if self.frame_sampling == "segment_mean":
+      num_segments = tf.minimum(num_frames, size)
+      segment_ids = tf.range(num_frames) * num_segments // num_frames
+      counts = tf.unsorted_segment_sum(tf.ones([num_frames]), segment_ids,
+                                       num_segments)
+      sampled_matrices = []
+      for decoded in decoded_matrices:
+        sums = tf.unsorted_segment_sum(
+            tf.to_float(decoded[:num_frames]), segment_ids, num_segments)
+        sampled_matrices.append(tf.cast(
+            tf.round(sums / tf.expand_dims(counts, 1)), tf.uint8))
+      return sampled_matrices, num_segments
+
+    if self.frame_sampling == "stride":
+      indices = tf.range(0, num_frames, size)
+    elif self.frame_sampling == "window":
+      start = tf.random_uniform([], maxval=tf.maximum(num_frames - size, 0) + 1,
+                                dtype=tf.int32)
+      indices = tf.range(start, tf.minimum(start + size, num_frames))
+    else:
+      # without replacement, and empty for a video without frames
+      indices = tf.random_shuffle(tf.range(num_frames))[:size]
+      # ascending order
+      indices = -tf.nn.top_k(-indices, k=tf.size(indices)).values
+    return ([tf.gather(decoded, indices) for decoded in decoded_matrices],
+            tf.size(indices))
 
   def get_video_matrix(self,
                        features,
@@ -281,14 +407,16 @@ class YT8MFrameFeatureReader(BaseReader):
       min_quantized_value: the minimum of the quantized value.
 
     Returns:
-      feature_matrix: matrix of all frame-features
+      feature_matrix: matrix of all frame-features, uint8 if keep_quantized
       num_frames: number of frames in the sequence
     """
-    decoded_features = tf.reshape(
-        tf.cast(tf.decode_raw(features, tf.uint8), tf.float32),
-        [-1, feature_size])
-
+    decoded_features = tf.reshape(tf.decode_raw(features, tf.uint8),
+                                  [-1, feature_size])
     num_frames = tf.minimum(tf.shape(decoded_features)[0], max_frames)
+    if self.keep_quantized:
+      return resize_axis(decoded_features, 0, max_frames), num_frames
+
+    decoded_features = tf.cast(decoded_features, tf.float32)
     feature_matrix = utils.Dequantize(decoded_features,
                                       max_quantized_value,
                                       min_quantized_value)
@@ -309,6 +437,13 @@ class YT8MFrameFeatureReader(BaseReader):
     Returns:
       A tuple of video indexes, video features, labels, and padding data.
     """
+    # sort_and_pad and random_pick_one work on one example at a time
+    if self.read_batch_size > 1 and self.num_max_labels in (-1, 0, 4716):
+      return self.prepare_reader_batch(filename_queue,
+                                       self.read_batch_size,
+                                       max_quantized_value,
+                                       min_quantized_value)
+
     reader = tf.TFRecordReader()
     _, serialized_example = reader.read(filename_queue)
 
@@ -324,23 +459,17 @@ class YT8MFrameFeatureReader(BaseReader):
 
     # read ground truth labels
     sparse_labels = contexts["labels"].values
-    dense_labels = (tf.cast(
-        tf.sparse_to_dense(sparse_labels, (4716,), 1,
-            validate_indices=False),
-        tf.bool))
+    dense_labels = self.labels_of_example(sparse_labels)
     if self.num_max_labels == 1:
-      sparse_labels, label_weights = tf.py_func(random_pick_one, [sparse_labels], [tf.int64, tf.int64])
-      sparse_labels = tf.reshape(sparse_labels, [1,])
-      label_weights = tf.reshape(label_weights, [1,])
+      sparse_labels, label_weights = random_pick_one(sparse_labels,
+                                                     self.num_classes)
     elif self.num_max_labels > 0:
       if self.num_max_labels == 4716:
-        sparse_labels, label_weights = tf.py_func(gen_sparse_label, [sparse_labels], [tf.int64, tf.float32])
-        sparse_labels = tf.reshape(sparse_labels, [self.num_max_labels])
-        label_weights = tf.reshape(label_weights, [self.num_max_labels])
+        sparse_labels, label_weights = gen_sparse_label(sparse_labels)
       else:
-        sparse_labels, label_weights = tf.py_func(sort_and_pad, [sparse_labels], [tf.int64, tf.int64])
-        sparse_labels = tf.reshape(sparse_labels, [self.num_max_labels])
-        label_weights = tf.reshape(label_weights, [self.num_max_labels])
+        sparse_labels, label_weights = sort_and_pad(
+            sparse_labels, self.num_max_labels, self.sos_id, self.eos_id,
+            self.pad_id)
     else:
       sparse_labels = dense_labels
       label_weights = tf.constant(1, dtype=tf.int64)
@@ -355,22 +484,32 @@ class YT8MFrameFeatureReader(BaseReader):
 
     num_frames = -1  # the number of frames in the video
     feature_matrices = [None] * num_features  # an array of different features
-    for feature_index in range(num_features):
-      feature_matrix, num_frames_in_this_feature = self.get_video_matrix(
-          features[self.feature_names[feature_index]],
-          self.feature_sizes[feature_index],
-          self.max_frames,
-          max_quantized_value,
-          min_quantized_value)
-      if num_frames == -1:
-        num_frames = num_frames_in_this_feature
-      else:
-        tf.assert_equal(num_frames, num_frames_in_this_feature)
-
-      feature_matrices[feature_index] = feature_matrix
-
-    # cap the number of frames at self.max_frames
-    num_frames = tf.minimum(num_frames, self.max_frames)
+    if self.frame_sampling is not None:
+      sampled_matrices, num_frames = self.sample_frames(features)
+      for feature_index, feature_matrix in enumerate(sampled_matrices):
+        if not self.keep_quantized:
+          feature_matrix = utils.Dequantize(tf.to_float(feature_matrix),
+                                            max_quantized_value,
+                                            min_quantized_value)
+        feature_matrices[feature_index] = resize_axis(
+            feature_matrix, 0, self.num_output_frames)
+    else:
+      for feature_index in range(num_features):
+        feature_matrix, num_frames_in_this_feature = self.get_video_matrix(
+            features[self.feature_names[feature_index]],
+            self.feature_sizes[feature_index],
+            self.max_frames,
+            max_quantized_value,
+            min_quantized_value)
+        if num_frames == -1:
+          num_frames = num_frames_in_this_feature
+        else:
+          tf.assert_equal(num_frames, num_frames_in_this_feature)
+
+        feature_matrices[feature_index] = feature_matrix
+
+    # cap the number of frames at self.num_output_frames
+    num_frames = tf.minimum(num_frames, self.num_output_frames)
 
     # concatenate different features
     video_matrix = tf.concat(feature_matrices, 1)
@@ -387,24 +526,123 @@ class YT8MFrameFeatureReader(BaseReader):
     input_weights = tf.ones([num_frames,], dtype=tf.float32)
     input_weights = tf.pad(
         input_weights,
-        [[0, self.max_frames - num_frames]],
+        [[0, self.num_output_frames - num_frames]],
         "CONSTANT")
-    input_weights.set_shape([self.max_frames])
+    input_weights.set_shape([self.num_output_frames])
     batch_input_weights = tf.expand_dims(input_weights, 0)
 
     return batch_video_ids, batch_video_matrix, batch_dense_labels, batch_sparse_labels, \
            batch_frames, batch_label_weights, batch_input_weights
 
+  def labels_of_example(self, class_ids):
+    """The dense labels of one video, or its label ids with sparse_label_max."""
+    if self.sparse_label_max > 0:
+      return self.label_space.sparse_ids(class_ids, self.sparse_label_max)
+    return self.label_space.sparse_to_dense(class_ids)
+
+  def parse_quantized_example(self, serialized_example):
+    """Parses one SequenceExample into its padded, still quantized frames.
+
+    Returns:
+      A tuple of the video id, the 'num_output_frames' x 'sum(feature_sizes)'
+      uint8 frame matrix padded with zeros, the number of frames and the
+      dense labels.
+    """
+    contexts, features = tf.parse_single_sequence_example(
+        serialized_example,
+        context_features={"video_id": tf.FixedLenFeature(
+            [], tf.string),
+                          "labels": tf.VarLenFeature(tf.int64)},
+        sequence_features={
+            feature_name : tf.FixedLenSequenceFeature([], dtype=tf.string)
+            for feature_name in self.feature_names
+        })
+    dense_labels = self.labels_of_example(contexts["labels"].values)
+
+    if self.frame_sampling is not None:
+      sampled_matrices, num_frames = self.sample_frames(features)
+      feature_matrices = [resize_axis(feature_matrix, 0, self.num_output_frames)
+                          for feature_matrix in sampled_matrices]
+    else:
+      num_frames = None
+      feature_matrices = []
+      for feature_name, feature_size in zip(self.feature_names,
+                                            self.feature_sizes):
+        decoded_features = tf.reshape(
+            tf.decode_raw(features[feature_name], tf.uint8), [-1, feature_size])
+        if num_frames is None:
+          num_frames = tf.minimum(tf.shape(decoded_features)[0],
+                                  self.max_frames)
+        feature_matrices.append(resize_axis(decoded_features, 0,
+                                            self.max_frames))
+    return (contexts["video_id"], tf.concat(feature_matrices, 1), num_frames,
+            dense_labels)
+
+  def prepare_reader_batch(self,
+                           filename_queue,
+                           batch_size,
+                           max_quantized_value=2,
+                           min_quantized_value=-2):
+    """Creates a reader thread that decodes up to batch_size videos at once.
+
+    One read_up_to and one map_fn replace batch_size reads and per-video
+    subgraphs. The frames stay uint8 through the parsing and padding; the
+    cast, dequantization and padding mask are applied to the whole batch,
+    or left to build_graph when keep_quantized is set.
+
+    Returns:
+      The same tuple as prepare_reader, with up to batch_size videos.
+    """
+    reader = tf.TFRecordReader()
+    _, serialized_examples = reader.read_up_to(filename_queue, batch_size)
+
+    video_ids, quantized_matrix, num_frames, dense_labels = tf.map_fn(
+        self.parse_quantized_example, serialized_examples,
+        dtype=(tf.string, tf.uint8, tf.int32,
+               tf.int16 if self.sparse_label_max > 0 else tf.bool),
+        parallel_iterations=32, back_prop=False)
+
+    input_weights = tf.sequence_mask(num_frames, self.num_output_frames,
+                                     dtype=tf.float32)
+    quantized_matrix.set_shape([None, self.num_output_frames,
+                                sum(self.feature_sizes)])
+    if self.keep_quantized:
+      video_matrix = quantized_matrix
+    else:
+      video_matrix = dequantize_frames(quantized_matrix, num_frames,
+                                       max_quantized_value,
+                                       min_quantized_value)
+    if self.sparse_label_max > 0:
+      dense_labels.set_shape([None, self.sparse_label_max])
+    else:
+      dense_labels.set_shape([None, self.label_space.num_classes])
+
+    if self.num_max_labels == 4716:
+      # the weights of gen_sparse_label in prepare_reader, not the 3 /
+      # num_classes of gen_sparse_label_batch
+      sparse_labels, label_weights = _sparse_label_from_dense(
+          dense_labels, 1. / self.num_classes)
+    else:
+      sparse_labels = dense_labels
+      label_weights = tf.ones([tf.shape(serialized_examples)[0]],
+                              dtype=tf.int64)
+
+    return video_ids, video_matrix, dense_labels, sparse_labels, \
+           num_frames, label_weights, input_weights
+
 class YT8MScoreFeatureReader(BaseReader):
   def __init__(self,
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["mean_inc3"],
-               num_max_labels=-1):
+               num_max_labels=-1,
+               label_space=None):
     self.num_classes = num_classes
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.num_max_labels = num_max_labels
+    self.label_space = (label_space or
+                        label_space_lib.LabelSpace.for_num_classes(num_classes))
 
   def prepare_reader(self, filename_queue, batch_size=1024):
     reader = tf.TFRecordReader()
@@ -416,17 +654,14 @@ class YT8MScoreFeatureReader(BaseReader):
                    "scores": tf.FixedLenFeature([5 * 4716], tf.float32)}
 
     features = tf.parse_example(serialized_examples, features=feature_map)
-    labels = tf.sparse_to_indicator(features["labels"], 4716)
-    labels.set_shape([None, self.num_classes])
+    labels = self.label_space.sparse_to_indicator(features["labels"])
 
     concatenated_features = features['scores']
     sparse_labels, label_weights, input_weights = labels, labels, labels
 
     # sparse_labels = features["labels"].values
     if self.num_max_labels == 4716:
-      sparse_labels, label_weights = tf.py_func(gen_sparse_label_batch, [labels], [tf.int64, tf.float32])
-      sparse_labels = tf.reshape(sparse_labels, [-1, self.num_max_labels])
-      label_weights = tf.reshape(label_weights, [-1, self.num_max_labels])
+      sparse_labels, label_weights = gen_sparse_label_batch(labels)
 
     return features["video_id"], concatenated_features, labels, sparse_labels, tf.ones([tf.shape(serialized_examples)[0]]), label_weights, input_weights
 
@@ -436,11 +671,14 @@ class YT8M555FeatureReader(BaseReader):
                num_classes=4716,
                feature_sizes=[1024],
                feature_names=["mean_inc3"],
-               num_max_labels=-1):
+               num_max_labels=-1,
+               label_space=None):
     self.num_classes = num_classes
     self.feature_sizes = feature_sizes
     self.feature_names = feature_names
     self.num_max_labels = num_max_labels
+    self.label_space = (label_space or
+                        label_space_lib.LabelSpace.for_num_classes(num_classes))
 
   def prepare_reader(self, filename_queue, batch_size=1024):
     reader = tf.TFRecordReader()
@@ -452,8 +690,7 @@ class YT8M555FeatureReader(BaseReader):
                    "feats": tf.FixedLenFeature([20 * 256], tf.float32)}
 
     features = tf.parse_example(serialized_examples, features=feature_map)
-    labels = tf.sparse_to_indicator(features["labels"], 4716)
-    labels.set_shape([None, self.num_classes])
+    labels = self.label_space.sparse_to_indicator(features["labels"])
 
     concatenated_features = features['feats']
     sparse_labels, label_weights, input_weights = labels, labels, labels
@@ -0,0 +1,173 @@
+"""A memory-mapped row store for the feature matrices of the hdfs readers.
+
+Opening mean.h5 with h5py's driver='core' copies the whole 'feas' matrix
+(about 4.9M x 1152 floats for the video-level features) into the private heap
+of every training and eval process at startup. The converter writes the matrix
+once as a row-major .npy file, a small header followed by the raw rows, next
+to the .h5 file. The readers open it with np.load(mmap_mode="r"): startup is
+near instant and all processes on a machine share one page-cache copy.
+
+Select the backend of the hdfs readers with config.hdfs_backend = "npy".
+
+Usage:
+  python -m yt8m.data_io.row_store \
+      /data/state/linchao/YT/video_hdfs/train/mean.h5 \
+      /data/state/linchao/YT/video_hdfs/validate/mean.h5
+"""
+
+import argparse
+import os
+
+import h5py
+import numpy as np
+
+# "h5" reads the rows with h5py, "npy" from the converted memory-mapped store
+BACKENDS = ("h5", "npy")
+
+
+def store_path(h5_path):
+  """The path of the row store converted from h5_path."""
+  return os.path.splitext(h5_path)[0] + ".npy"
+
+
+def convert(h5_path, npy_path=None, dataset="feas", chunk_rows=65536):
+  """Copies an HDF5 matrix into a .npy row store, chunk_rows at a time.
+
+  The store is written to a temporary file first, so readers never open a
+  partial store.
+
+  Returns:
+    The path of the row store.
+  """
+  npy_path = npy_path or store_path(h5_path)
+  tmp_path = npy_path + ".tmp"
+  with h5py.File(h5_path, "r") as fin:
+    data = fin[dataset]
+    rows = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=data.dtype,
+                                     shape=data.shape)
+    for start in xrange(0, data.shape[0], chunk_rows):
+      rows[start: start + chunk_rows] = data[start: start + chunk_rows]
+    rows.flush()
+    del rows
+  os.rename(tmp_path, npy_path)
+  return npy_path
+
+
+def open_rows(npy_path):
+  """Memory-maps a row store read-only."""
+  return np.load(npy_path, mmap_mode="r")
+
+
+def open_feas(h5_path, backend="h5", mem_map=False):
+  """Opens the 'feas' rows of h5_path with a backend.
+
+  Args:
+    h5_path: the HDF5 file; the "npy" backend opens the row store converted
+      from it.
+    backend: one of BACKENDS.
+    mem_map: with the "h5" backend, load the whole file into memory with
+      driver='core'.
+
+  Raises:
+    ValueError: The backend is unknown.
+  """
+  if backend == "npy":
+    return open_rows(store_path(h5_path))
+  elif backend == "h5":
+    if mem_map:
+      return h5py.File(h5_path, 'r', driver='core')['feas']
+    return h5py.File(h5_path, 'r')['feas']
+  raise ValueError("unknown hdfs backend {}, expected one of {}.".format(
+      backend, BACKENDS))
+
+
+def gather_rows(data, rows, out=None):
+  """Gathers data[rows] with the rows read in ascending order.
+
+  h5py only accepts increasing fancy indices, and sorted rows turn the page
+  faults of a memory-mapped store into forward reads.
+
+  Args:
+    data: an h5py dataset or a NumPy (memory-mapped) matrix.
+    rows: a 1-D array of distinct row indices.
+    out: optional 'len(rows)' x 'data.shape[1]' array to write the rows to,
+      converting them to its dtype.
+
+  Returns:
+    A 'len(rows)' x 'data.shape[1]' array in the order of rows.
+  """
+  rows = np.asarray(rows)
+  order = np.argsort(rows)
+  if out is None:
+    out = np.empty((rows.shape[0],) + tuple(data.shape[1:]), dtype=data.dtype)
+  out[order] = data[rows[order]]
+  return out
+
+
+class BlockShuffleSampler(object):
+  """Draws shuffled batches of rows while reading only whole blocks.
+
+  Every epoch the contiguous blocks of block_size rows are shuffled. Groups
+  of buffer_blocks blocks are read in ascending order, each with one
+  sequential slice, into a shuffle buffer whose rows are shuffled and cut
+  into batches. Rows left over from a buffer move on to the next one, so
+  every row is drawn once per epoch.
+
+  The randomness is set by the buffer, block_size * buffer_blocks rows drawn
+  from buffer_blocks random places: a batch mixes rows of up to
+  buffer_blocks blocks, and rows of one block stay within one buffer. With
+  block_size=1 this is a plain shuffle with random reads.
+  """
+
+  def __init__(self, data, batch_size, block_size, buffer_blocks, seed=None):
+    self.data = data
+    self.batch_size = batch_size
+    self.block_size = block_size
+    self.buffer_blocks = buffer_blocks
+    self.rng = np.random.RandomState(seed)
+    self.block_starts = np.arange(0, data.shape[0], block_size)
+
+  def read_buffer(self, block_starts):
+    """Reads the blocks at block_starts, returns their rows and data."""
+    block_starts = np.sort(block_starts)
+    num_rows = self.data.shape[0]
+    rows = [np.arange(start, min(start + self.block_size, num_rows))
+            for start in block_starts]
+    data = [self.data[start: start + self.block_size]
+            for start in block_starts]
+    return np.concatenate(rows), np.concatenate(data)
+
+  def batches(self):
+    """Yields (rows, data) batches forever."""
+    carry_rows = np.zeros([0], dtype=np.int64)
+    carry_data = np.zeros((0,) + tuple(self.data.shape[1:]),
+                          dtype=self.data.dtype)
+    while True:
+      order = self.rng.permutation(self.block_starts.shape[0])
+      for i in xrange(0, order.shape[0], self.buffer_blocks):
+        rows, data = self.read_buffer(
+            self.block_starts[order[i: i + self.buffer_blocks]])
+        rows = np.concatenate([carry_rows, rows])
+        data = np.concatenate([carry_data, data])
+        perm = self.rng.permutation(rows.shape[0])
+        rows, data = rows[perm], data[perm]
+        num_batched = rows.shape[0] // self.batch_size * self.batch_size
+        for start in xrange(0, num_batched, self.batch_size):
+          end = start + self.batch_size
+          yield rows[start: end], data[start: end]
+        carry_rows, carry_data = rows[num_batched:], data[num_batched:]
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Convert the 'feas' matrices of HDF5 files to .npy row "
+      "stores next to them.")
+  parser.add_argument("h5_paths", nargs="+")
+  parser.add_argument("--chunk_rows", type=int, default=65536)
+  args = parser.parse_args()
+  for h5_path in args.h5_paths:
+    print("wrote {}".format(convert(h5_path, chunk_rows=args.chunk_rows)))
+
+
+if __name__ == "__main__":
+  main()
@@ -1,3 +1,4 @@
+import os
 import time
 import h5py
 import cPickle as pkl
@@ -48,32 +49,58 @@ def restore(saver, sess, train_dir):
     return global_step_val
 
 
+def score_paths(model_ckpt_path, stage, shard_id=-1):
+  """Returns the paths of the dumped score h5 and video id pickle."""
+  model_id = model_ckpt_path.split("/")[-2] + "-" + model_ckpt_path.split("-")[-1]
+  if shard_id >= 0:
+    stage = "{}.shard-{}".format(stage, shard_id)
+  prefix = "/data/D2DCRC/linchao/YT/scores/{}.{}".format(model_id, stage)
+  return prefix + ".h5", prefix + ".pkl"
+
+def metrics_state_path(shard_dir, shard_id):
+  """Returns where an eval shard saves its EvaluationMetrics state."""
+  return os.path.join(shard_dir, "metrics-{}.state".format(shard_id))
+
 def evaluation_loop(self, saver, model_ckpt_path):
   global_step_val = model_ckpt_path.split("/")[-1].split("-")[-1]
-  evl_metrics = eval_util.EvaluationMetrics(self.model.num_classes, self.config.top_k)
+  evl_metrics = eval_util.EvaluationMetrics(self.model.num_classes, self.config.top_k,
+                                           self.config.gap_num_bins)
 
   # summary_writer = tf.summary.FileWriter(
       # self.train_dir, graph=tf.get_default_graph())
   summary_writer = None
 
   sess_config = tf.ConfigProto()
-  sess_config.gpu_options.per_process_gpu_memory_fraction = 0.9
+  sess_config.gpu_options.per_process_gpu_memory_fraction = 0.9 / self.num_eval_shards
+  if self.eval_threads_per_shard > 0:
+    sess_config.intra_op_parallelism_threads = self.eval_threads_per_shard
+    sess_config.inter_op_parallelism_threads = self.eval_threads_per_shard
   video_ids = []
   output_scores = 1 # 1->output score, 2-> output features
   if output_scores == 1:
-    model_id = model_ckpt_path.split("/")[-2] + "-" + model_ckpt_path.split("-")[-1]
     # num_insts = 4906660
     # stage = "train"
     num_insts = 1401828
     stage = "validate"
     # num_insts = 700640
     # stage = "test"
-    video_ids_pkl_path = "/data/D2DCRC/linchao/YT/scores/{}.{}.pkl".format(model_id, stage)
+    maxshape = None
+    if self.eval_shard_id >= 0:
+      # the size of a shard is unknown, the dataset grows as batches arrive;
+      # only then is it chunked, offline_scorer memory-maps contiguous ones
+      num_insts = 0
+      maxshape = (None, self.model.num_classes)
+    scores_h5_path, video_ids_pkl_path = score_paths(
+        model_ckpt_path, stage, self.eval_shard_id)
     # video_ids_pkl_path = pkl.load(open("/data/D2DCRC/linchao/YT/{}_vids_dict.pkl".format(stage)))
     # log_path = "/data/D2DCRC/linchao/YT/scores/{}.{}.touch".format(model_id, stage)
-    pred_out = h5py.File("/data/D2DCRC/linchao/YT/scores/{}.{}.h5".format(model_id, stage), "w")
+    pred_out = h5py.File(scores_h5_path, "w")
     pred_dataset = pred_out.create_dataset('scores', shape=(num_insts, self.model.num_classes),
+                                            maxshape=maxshape,
                                             dtype=np.float32)
+    if not self.label_space.is_full:
+      # the global class id of every score column
+      pred_out.create_dataset("class_ids", data=self.label_space.class_ids)
   elif output_scores == 2:
     output_prefix = "/data/uts700/linchao/yt8m/data/555_netvlad/train"
     tfrecord_cntr = 0
@@ -109,6 +136,8 @@ def evaluation_loop(self, saver, model_ckpt_path):
         if output_scores == 1:
           # for i in xrange(len(video_id)):
             # pred_dataset[video_ids_pkl_path[video_id[i]], :] = predictions[i]
+          if pred_dataset.shape[0] < len(video_ids) + len(video_id):
+            pred_dataset.resize(len(video_ids) + len(video_id), axis=0)
           pred_dataset[len(video_ids): len(video_ids) + len(video_id), :] = predictions
           video_ids += video_id
         elif output_scores == 2:
@@ -156,6 +185,9 @@ def evaluation_loop(self, saver, model_ckpt_path):
       logging.info(
           "Done with batched inference. Now calculating global performance "
           "metrics.")
+      if self.eval_shard_id >= 0:
+        evl_metrics.save(metrics_state_path(self.eval_shard_dir,
+                                            self.eval_shard_id))
       if output_scores == 1:
         pred_out.close()
         # with open(log_path, 'w') as fout:
@@ -36,7 +36,8 @@ ap = average_precision_calculator.AveragePrecisionCalculator.ap(p, a)
 the case where partial predictions can be observed at a time (Tensorflow
 predictions). In this case, we first call the function accumulate many times
 to process parts of the ranked list. After processing all the parts, we call
-peek_interpolated_ap_at_n.
+peek_interpolated_ap_at_n. The accumulated pairs are kept in float32/uint8
+numpy buffers and sorted once, when the average precision is peeked.
 ```
 p1 = np.array([random.random() for _ in xrange(5)])
 a1 = np.array([random.choice([0, 1]) for _ in xrange(5)])
@@ -49,10 +50,19 @@ calculator.accumulate(p1, a1)
 calculator.accumulate(p2, a2)
 ap3 = calculator.peek_ap_at_n()
 ```
+
+3) Use ap_at_n_batch to calculate the average precision of many independent
+ranked lists of the same length, one list per row, in a single call.
+```
+p = np.random.rand(100, 10)
+a = np.random.rand(100, 10) > 0.5
+
+aps = average_precision_calculator.AveragePrecisionCalculator.ap_at_n_batch(
+    p, a, n=None)
+```
 """
 
-import heapq
-import random
+import io
 import numbers
 
 import numpy
@@ -78,12 +88,15 @@ class AveragePrecisionCalculator(object):
 
     self._top_n = top_n  # average precision at n
     self._total_positives = 0  # total number of positives have seen
-    self._heap = []  # max heap of (prediction, actual)
+    self._size = 0  # number of (prediction, actual) pairs kept
+    # columnar store of (prediction, actual), grown by doubling
+    self._predictions = numpy.zeros([0], dtype=numpy.float32)
+    self._actuals = numpy.zeros([0], dtype=numpy.uint8)
 
   @property
   def heap_size(self):
-    """Gets the heap size maintained in the class."""
-    return len(self._heap)
+    """Gets the number of (prediction, actual) pairs kept in the class."""
+    return self._size
 
   @property
   def num_accumulated_positives(self):
@@ -116,26 +129,100 @@ class AveragePrecisionCalculator(object):
       if not isinstance(num_positives, numbers.Number) or num_positives < 0:
         raise ValueError("'num_positives' was provided but it wan't a nonzero number.")
 
+    predictions = numpy.ravel(numpy.asarray(predictions, dtype=numpy.float32))
+    actuals = numpy.ravel(numpy.asarray(actuals) > 0)
+
     if not num_positives is None:
       self._total_positives += num_positives
     else:
-      self._total_positives += numpy.size(numpy.where(actuals > 0))
-    topk = self._top_n
-    heap = self._heap
-
-    for i in xrange(numpy.size(predictions)):
-      if topk is None or len(heap) < topk:
-        heapq.heappush(heap, (predictions[i], actuals[i]))
-      else:
-        if predictions[i] > heap[0][0]:  # heap[0] is the smallest
-          heapq.heappop(heap)
-          heapq.heappush(heap, (predictions[i], actuals[i]))
+      self._total_positives += numpy.count_nonzero(actuals)
+
+    if self._top_n == 0:
+      return
+    self._reserve(self._size + predictions.size)
+    end = self._size + predictions.size
+    self._predictions[self._size: end] = predictions
+    self._actuals[self._size: end] = actuals
+    self._size = end
+
+  def _reserve(self, size):
+    """Make room for at least size pairs.
+
+    Without top_n the buffers grow by doubling. With top_n they are bounded:
+    once full, only the top_n highest predictions are kept, selected with a
+    partition instead of a full sort.
+    """
+    capacity = self._predictions.size
+    if size <= capacity:
+      return
+    if self._top_n is not None and self._size > self._top_n:
+      size -= self._size - self._top_n
+      self._keep_top_n()
+      if size <= capacity:
+        return
+    capacity = max(size, 2 * capacity, 1024)
+    if self._top_n is not None:
+      capacity = max(size, min(capacity, 2 * self._top_n))
+    predictions = numpy.zeros([capacity], dtype=numpy.float32)
+    actuals = numpy.zeros([capacity], dtype=numpy.uint8)
+    predictions[:self._size] = self._predictions[:self._size]
+    actuals[:self._size] = self._actuals[:self._size]
+    self._predictions, self._actuals = predictions, actuals
+
+  def _keep_top_n(self):
+    """Drop all but the top_n highest predictions from the buffers."""
+    top_n = self._top_n
+    if self._size <= top_n:
+      return
+    keep = numpy.argpartition(
+        self._predictions[:self._size], self._size - top_n)[-top_n:]
+    self._predictions[:top_n] = self._predictions[keep]
+    self._actuals[:top_n] = self._actuals[keep]
+    self._size = top_n
 
   def clear(self):
     """Clear the accumulated predictions."""
-    self._heap = []
+    self._size = 0
+    self._predictions = numpy.zeros([0], dtype=numpy.float32)
+    self._actuals = numpy.zeros([0], dtype=numpy.uint8)
     self._total_positives = 0
 
+  def merge(self, other):
+    """Add the predictions accumulated by another calculator to this one.
+
+    Args:
+      other: an AveragePrecisionCalculator with the same top_n.
+
+    Raises:
+      ValueError: An error occurred when the top_n of the calculators differ.
+    """
+    if other._top_n != self._top_n:
+      raise ValueError("cannot merge calculators with different top_n.")
+    self.accumulate(other._predictions[:other._size],
+                    other._actuals[:other._size],
+                    num_positives=other._total_positives)
+
+  def to_bytes(self):
+    """Serialize the accumulated state to a byte string."""
+    buf = io.BytesIO()
+    numpy.savez(
+        buf,
+        top_n=numpy.array(-1 if self._top_n is None else self._top_n),
+        total_positives=numpy.array(self._total_positives),
+        predictions=self._predictions[:self._size],
+        actuals=self._actuals[:self._size])
+    return buf.getvalue()
+
+  @classmethod
+  def from_bytes(cls, data):
+    """Restore a calculator from the output of to_bytes."""
+    state = numpy.load(io.BytesIO(data))
+    top_n = int(state["top_n"])
+    calculator = cls(None if top_n < 0 else top_n)
+    calculator.accumulate(state["predictions"], state["actuals"],
+                          num_positives=state["total_positives"].item())
+    return calculator
+
   def peek_ap_at_n(self):
     """Peek the non-interpolated average precision at n.
 
@@ -146,9 +233,10 @@ class AveragePrecisionCalculator(object):
     """
     if self.heap_size <= 0:
       return 0
-    predlists = numpy.array(zip(*self._heap))
-    ap = self.ap_at_n(predlists[0],
-                      predlists[1],
+    if self._top_n is not None:
+      self._keep_top_n()
+    ap = self.ap_at_n(self._predictions[:self._size],
+                      self._actuals[:self._size],
                       n=self._top_n,
                       total_num_positives=self._total_positives)
     return ap
@@ -202,54 +290,136 @@ class AveragePrecisionCalculator(object):
     if len(predictions) != len(actuals):
       raise ValueError("the shape of predictions and actuals does not match.")
 
+    predictions = numpy.reshape(numpy.asarray(predictions), [1, -1])
+    actuals = numpy.reshape(numpy.asarray(actuals), [1, -1])
+    if total_num_positives is not None:
+      total_num_positives = [total_num_positives]
+    aps = AveragePrecisionCalculator.ap_at_n_batch(
+        predictions, actuals, n=n, total_num_positives=total_num_positives)
+    return float(aps[0])
+
+  @staticmethod
+  def ap_at_n_batch(predictions, actuals, n=20, total_num_positives=None):
+    """Calculate the non-interpolated average precision of many ranked lists.
+
+    Every row is ranked and scored independently, exactly as ap_at_n would
+    score it on its own, but all rows are handled by one sort and one
+    cumulative sum.
+
+    Args:
+      predictions: a numpy 2-D array storing the prediction scores. Dimensions
+        are 'num_lists' x 'list_length'.
+      actuals: a numpy 2-D array storing the ground truth labels, with the same
+        shape as predictions. Any value larger than 0 will be treated as
+        positives, otherwise as negatives.
+      n: the top n items to be considered in ap@n, or None for all items.
+      total_num_positives: (optionally) a 1-D array with the number of total
+        positives of every list. If specified, it will be used in calculation.
+
+    Returns:
+      A numpy 1-D array with the non-interpolated average precision at n of
+      every list.
+
+    Raises:
+      ValueError: An error occurred when
+      1) the inputs are not 2-D arrays of the same shape;
+      2) the input n is not a positive integer;
+      3) total_num_positives does not have one entry per list.
+    """
+    predictions = numpy.asarray(predictions)
+    actuals = numpy.asarray(actuals)
+    if predictions.ndim != 2 or predictions.shape != actuals.shape:
+      raise ValueError("the shape of predictions and actuals does not match.")
+
     if n is not None:
       if not isinstance(n, int) or n <= 0:
         raise ValueError("n must be 'None' or a positive integer."
                          " It was '%s'." % n)
 
-    ap = 0.0
+    num_lists, list_length = predictions.shape
+    positives = actuals > 0
+    if total_num_positives is None:
+      numpos = numpy.sum(positives, axis=1)
+    else:
+      numpos = numpy.asarray(total_num_positives, dtype=numpy.float64)
+      if numpos.shape != (num_lists,):
+        raise ValueError("total_num_positives must have one entry per list.")
 
-    predictions = numpy.array(predictions)
-    actuals = numpy.array(actuals)
+    r = list_length
+    if n is not None:
+      numpos = numpy.minimum(numpos, n)
+      r = min(r, n)
+    if num_lists == 0 or r == 0:
+      return numpy.zeros([num_lists])
 
-    # add a shuffler to avoid overestimating the ap
-    predictions, actuals = AveragePrecisionCalculator._shuffle(predictions,
-                                                               actuals)
-    sortidx = sorted(
-        range(len(predictions)),
-        key=lambda k: predictions[k],
-        reverse=True)
+    sortidx = AveragePrecisionCalculator.rank(predictions)[:, :r]
+    ranked_positives = positives[numpy.arange(num_lists)[:, None], sortidx]
 
-    if total_num_positives is None:
-      numpos = numpy.size(numpy.where(actuals > 0))
-    else:
-      numpos = total_num_positives
+    # precision at every rank, summed over the ranks holding a positive
+    poscount = numpy.cumsum(ranked_positives, axis=1, dtype=numpy.float64)
+    precisions = poscount / numpy.arange(1, r + 1)
+    sum_precisions = numpy.sum(
+        numpy.where(ranked_positives, precisions, 0.), axis=1)
 
-    if numpos == 0:
-      return 0
+    aps = numpy.zeros([num_lists])
+    has_positives = numpos > 0
+    aps[has_positives] = sum_precisions[has_positives] / numpos[has_positives]
+    return aps
 
-    if n is not None:
-      numpos = min(numpos, n)
-    delta_recall = 1.0 / numpos
-    poscount = 0.0
+  @staticmethod
+  def rank(predictions, seed=0):
+    """Sort every row of predictions in descending order.
 
-    # calculate the ap
-    r = len(sortidx)
-    if n is not None:
-      r = min(r, n)
-    for i in xrange(r):
-      if actuals[sortidx[i]] > 0:
-        poscount += 1
-        ap += poscount / (i + 1) * delta_recall
-    return ap
+    Every row is shuffled with a seeded permutation before a stable sort, so
+    ties are broken randomly to avoid overestimating the ap.
+
+    Args:
+      predictions: a numpy 2-D array storing the prediction scores.
+      seed: the seed of the shuffle.
+
+    Returns:
+      A numpy 2-D array of column indices, best scored first.
+    """
+    num_lists, list_length = predictions.shape
+    random_state = numpy.random.RandomState(seed)
+    if num_lists == 1:
+      shuffle = random_state.permutation(list_length)[None, :]
+    else:
+      shuffle = numpy.argsort(random_state.random_sample(predictions.shape), 1)
+    rows = numpy.arange(num_lists)[:, None]
+    shuffled = predictions[rows, shuffle]
+
+    if shuffled.dtype == numpy.float32 and list_length < 2 ** 32:
+      # Pack the descending key of every score and its shuffled position
+      # into one uint64. A plain sort of the keys is a stable descending sort
+      # of the scores, and is much faster than argsort for tens of millions
+      # of entries.
+      keys = AveragePrecisionCalculator.descending_keys(shuffled)
+      keys <<= numpy.uint64(32)
+      keys |= numpy.arange(list_length, dtype=numpy.uint64)
+      keys.sort(axis=1)
+      order = (keys & numpy.uint64(0xffffffff)).astype(numpy.int64)
+    else:
+      if shuffled.dtype.kind != "f":
+        shuffled = shuffled.astype(numpy.float64)
+      order = numpy.argsort(-shuffled, axis=1, kind="mergesort")
+    return shuffle[rows, order]
 
   @staticmethod
-  def _shuffle(predictions, actuals):
-    random.seed(0)
-    suffidx = random.sample(range(len(predictions)), len(predictions))
-    predictions = predictions[suffidx]
-    actuals = actuals[suffidx]
-    return predictions, actuals
+  def descending_keys(predictions):
+    """Map float32 scores to integers that sort in descending score order.
+
+    Args:
+      predictions: a numpy array of float32 prediction scores.
+
+    Returns:
+      A uint64 numpy array of the same shape holding 32-bit keys: a higher
+      score gets a lower key, and equal scores get equal keys.
+    """
+    predictions = predictions + numpy.float32(0)  # -0.0 -> 0.0
+    bits = predictions.view(numpy.uint32).astype(numpy.uint64)
+    negative = (bits >> numpy.uint64(31)).astype(bool)
+    return numpy.where(negative, bits, ~bits & numpy.uint64(0x7fffffff))
 
   @staticmethod
   def _zero_one_normalize(predictions, epsilon=1e-7):
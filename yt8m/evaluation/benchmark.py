@@ -0,0 +1,82 @@
+"""Micro benchmarks of the numpy evaluation metrics.
+
+Compares the vectorized metrics in eval_util with the per-video Python loops
+they replaced, on random predictions of the given batch shape.
+
+Usage:
+  python -m yt8m.evaluation.benchmark --batch_size=512 --num_classes=4716
+"""
+
+import argparse
+import time
+
+import numpy
+
+from . import eval_util
+
+
+def calculate_precision_at_equal_recall_rate_loop(predictions, actuals):
+  """The per-video loop implementation of PERR, kept as a reference."""
+  aggregated_precision = 0.0
+  num_videos = actuals.shape[0]
+  for row in numpy.arange(num_videos):
+    num_labels = int(numpy.sum(actuals[row]))
+    top_indices = numpy.argpartition(predictions[row],
+                                     -num_labels)[-num_labels:]
+    item_precision = 0.0
+    for label_index in top_indices:
+      if predictions[row][label_index] > 0:
+        item_precision += actuals[row][label_index]
+    item_precision /= top_indices.size
+    aggregated_precision += item_precision
+  aggregated_precision /= num_videos
+  return aggregated_precision
+
+
+def random_batch(batch_size, num_classes, mean_labels=3., seed=0):
+  """Random predictions and labels with about mean_labels labels per video."""
+  random_state = numpy.random.RandomState(seed)
+  predictions = random_state.rand(batch_size, num_classes).astype(
+      numpy.float32)
+  actuals = (random_state.rand(batch_size, num_classes) <
+             mean_labels / num_classes).astype(numpy.float32)
+  # labelled classes score a bit higher, like a half-trained model
+  predictions += actuals * random_state.rand(batch_size, num_classes) * 0.5
+  return predictions, actuals
+
+
+def time_fn(fn, args, repeats):
+  """Returns the result and the best wall time of repeats calls of fn."""
+  best = float("inf")
+  for _ in xrange(repeats):
+    start = time.time()
+    result = fn(*args)
+    best = min(best, time.time() - start)
+  return result, best
+
+
+def benchmark_perr(batch_size, num_classes, repeats):
+  predictions, actuals = random_batch(batch_size, num_classes)
+  loop_perr, loop_time = time_fn(
+      calculate_precision_at_equal_recall_rate_loop,
+      (predictions, actuals), repeats)
+  perr, vectorized_time = time_fn(
+      eval_util.calculate_precision_at_equal_recall_rate,
+      (predictions, actuals), repeats)
+  print("PERR %d x %d: loop %.4fs (%.4f) | vectorized %.4fs (%.4f) | "
+        "speedup %.1fx" % (batch_size, num_classes, loop_time, loop_perr,
+                           vectorized_time, perr,
+                           loop_time / vectorized_time))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__)
+  parser.add_argument("--batch_size", type=int, default=512)
+  parser.add_argument("--num_classes", type=int, default=4716)
+  parser.add_argument("--repeats", type=int, default=10)
+  args = parser.parse_args()
+  benchmark_perr(args.batch_size, args.num_classes, args.repeats)
+
+
+if __name__ == "__main__":
+  main()
@@ -14,12 +14,14 @@
 
 """Provides functions to help with evaluating models."""
 import datetime
+import io
 import numpy
 import time
 import numpy as np
 
 from . import mean_average_precision_calculator as map_calculator
 from . import average_precision_calculator as ap_calculator
+from . import histogram_average_precision_calculator as hist_ap_calculator
 
 def flatten(l):
   """ Merges a list of lists into a single list. """
@@ -45,6 +47,11 @@ def calculate_hit_at_one(predictions, actuals):
 def calculate_precision_at_equal_recall_rate(predictions, actuals):
   """Performs a local (numpy) calculation of the PERR.
 
+  Every video is scored on its top n predictions, n being its number of
+  labels. The whole batch is handled at once: the top max(n) predictions of
+  every row are selected and sorted, and a rank-vs-label-count mask keeps the
+  top n of each row.
+
   Args:
     predictions: Matrix containing the outputs of the model.
       Dimensions are 'batch' x 'num_classes'.
@@ -54,20 +61,25 @@ def calculate_precision_at_equal_recall_rate(predictions, actuals):
   Returns:
     float: The average precision at equal recall rate across the entire batch.
   """
-  aggregated_precision = 0.0
   num_videos = actuals.shape[0]
-  for row in numpy.arange(num_videos):
-    num_labels = int(numpy.sum(actuals[row]))
-    top_indices = numpy.argpartition(predictions[row],
-                                     -num_labels)[-num_labels:]
-    item_precision = 0.0
-    for label_index in top_indices:
-      if predictions[row][label_index] > 0:
-        item_precision += actuals[row][label_index]
-    item_precision /= top_indices.size
-    aggregated_precision += item_precision
-  aggregated_precision /= num_videos
-  return aggregated_precision
+  num_labels = numpy.sum(actuals, axis=1).astype(numpy.int64)
+  max_labels = int(numpy.max(num_labels)) if num_videos > 0 else 0
+  if max_labels <= 0:
+    return 0.0
+
+  rows = numpy.arange(num_videos)[:, None]
+  top_indices = numpy.argpartition(predictions, -max_labels,
+                                   axis=1)[:, -max_labels:]
+  top_predictions = predictions[rows, top_indices]
+  order = numpy.argsort(-top_predictions, axis=1)
+  top_indices = top_indices[rows, order]
+  top_predictions = top_predictions[rows, order]
+
+  in_top_n = numpy.arange(max_labels) < num_labels[:, None]
+  hits = numpy.sum(actuals[rows, top_indices] *
+                   (in_top_n & (top_predictions > 0)), axis=1)
+  item_precision = hits / numpy.maximum(num_labels, 1).astype(numpy.float64)
+  return numpy.mean(item_precision)
 
 def calculate_gap(predictions, actuals, top_k=20):
   """Performs a local (numpy) calculation of the global average precision.
@@ -85,8 +97,10 @@ def calculate_gap(predictions, actuals, top_k=20):
     float: The global average precision.
   """
   gap_calculator = ap_calculator.AveragePrecisionCalculator()
-  sparse_predictions, sparse_labels, num_positives = top_k_by_class(predictions, actuals, top_k)
-  gap_calculator.accumulate(flatten(sparse_predictions), flatten(sparse_labels), sum(num_positives))
+  _, sparse_predictions, sparse_labels, num_positives = top_k_by_class_csr(
+      predictions, actuals, top_k)
+  gap_calculator.accumulate(sparse_predictions, sparse_labels,
+                            numpy.sum(num_positives))
   return gap_calculator.peek_ap_at_n()
 
 def top_k_by_class(predictions, labels, k=20):
@@ -106,24 +120,60 @@ def top_k_by_class(predictions, labels, k=20):
     those predictions. The entries in 'true_positives' are the number of true
     positives for each class in the ground truth.
 
+  Raises:
+    ValueError: An error occurred when the k is not a positive integer.
+  """
+  class_offsets, out_predictions, out_labels, out_true_positives = \
+      top_k_by_class_csr(predictions, labels, k)
+  out_predictions = numpy.split(out_predictions, class_offsets[1:-1])
+  out_labels = numpy.split(out_labels, class_offsets[1:-1])
+  return out_predictions, out_labels, list(out_true_positives)
+
+def top_k_by_class_csr(predictions, labels, k=20):
+  """Extracts the top k predictions for each video, grouped by class.
+
+  This is the vectorized form of top_k_by_class: the whole batch goes through
+  one argpartition and one stable sort by class, and the result is returned as
+  compressed sparse rows with one row per class.
+
+  Args:
+    predictions: A numpy matrix containing the outputs of the model.
+      Dimensions are 'batch' x 'num_classes'.
+    labels: A numpy matrix containing the ground truth labels.
+      Dimensions are 'batch' x 'num_classes'.
+    k: the top k entries to preserve in each prediction.
+
+  Returns:
+    A tuple (class_offsets, predictions, labels, true_positives).
+    'predictions' and 'labels' are 1-D arrays holding the top k entries of
+    every video, grouped by class and in video order within a class; the
+    entries of class i are at [class_offsets[i]: class_offsets[i + 1]].
+    'class_offsets' has num_classes + 1 entries. 'true_positives' is a 1-D
+    array with the number of true positives for each class in the ground
+    truth.
+
   Raises:
     ValueError: An error occurred when the k is not a positive integer.
   """
   if k <= 0:
     raise ValueError("k must be a positive integer.")
-  k = min(k, predictions.shape[1])
-  num_classes = predictions.shape[1]
-  prediction_triplets= []
-  for video_index in range(predictions.shape[0]):
-    prediction_triplets.extend(top_k_triplets(predictions[video_index],labels[video_index], k))
-  out_predictions = [[] for v in xrange(num_classes)]
-  out_labels = [[] for v in xrange(num_classes)]
-  for triplet in prediction_triplets:
-    out_predictions[triplet[0]].append(triplet[1])
-    out_labels[triplet[0]].append(triplet[2])
-  out_true_positives = [numpy.sum(labels[:,i]) for i in xrange(num_classes)]
-
-  return out_predictions, out_labels, out_true_positives
+  num_videos, num_classes = predictions.shape
+  k = min(k, num_classes)
+
+  top_classes = numpy.argpartition(predictions, -k, axis=1)[:, -k:]
+  rows = numpy.arange(num_videos)[:, None]
+  top_predictions = predictions[rows, top_classes].ravel()
+  top_labels = labels[rows, top_classes].ravel()
+  top_classes = top_classes.ravel()
+
+  # mergesort is stable, which keeps the video order inside every class
+  by_class = numpy.argsort(top_classes, kind="mergesort")
+  class_offsets = numpy.zeros([num_classes + 1], dtype=numpy.int64)
+  numpy.cumsum(numpy.bincount(top_classes, minlength=num_classes),
+               out=class_offsets[1:])
+  true_positives = numpy.sum(labels, axis=0)
+  return (class_offsets, top_predictions[by_class], top_labels[by_class],
+          true_positives)
 
 def top_k_triplets(predictions, labels, k=20):
   """Get the top_k for a 1-d numpy array. Returns a sparse list of tuples in
@@ -136,22 +186,31 @@ def top_k_triplets(predictions, labels, k=20):
 class EvaluationMetrics(object):
   """A class to store the evaluation metrics."""
 
-  def __init__(self, num_class, top_k):
+  def __init__(self, num_class, top_k, gap_num_bins=None):
     """Construct an EvaluationMetrics object to store the evaluation metrics.
 
     Args:
       num_class: A positive integer specifying the number of classes.
       top_k: A positive integer specifying how many predictions are considered per video.
+      gap_num_bins: If set, the global average precision is approximated from
+        score histograms with this many bins instead of being computed
+        exactly.
 
     Raises:
       ValueError: An error occurred when MeanAveragePrecisionCalculator cannot
         not be constructed.
     """
+    self.num_class = num_class
+    self.gap_num_bins = gap_num_bins
     self.sum_hit_at_one = 0.0
     self.sum_perr = 0.0
     self.sum_loss = 0.0
     self.map_calculator = map_calculator.MeanAveragePrecisionCalculator(num_class)
-    self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
+    if gap_num_bins:
+      self.global_ap_calculator = \
+          hist_ap_calculator.HistogramAveragePrecisionCalculator(gap_num_bins)
+    else:
+      self.global_ap_calculator = ap_calculator.AveragePrecisionCalculator()
     self.top_k = top_k
     self.num_examples = 0
 
@@ -178,9 +237,12 @@ class EvaluationMetrics(object):
     mean_loss = numpy.mean(loss)
 
     # Take the top 20 predictions.
-    sparse_predictions, sparse_labels, num_positives = top_k_by_class(predictions, labels, self.top_k)
-    self.map_calculator.accumulate(sparse_predictions, sparse_labels, num_positives)
-    self.global_ap_calculator.accumulate(flatten(sparse_predictions), flatten(sparse_labels), sum(num_positives))
+    class_offsets, sparse_predictions, sparse_labels, num_positives = \
+        top_k_by_class_csr(predictions, labels, self.top_k)
+    self.map_calculator.accumulate_csr(class_offsets, sparse_predictions,
+                                       sparse_labels, num_positives)
+    self.global_ap_calculator.accumulate(sparse_predictions, sparse_labels,
+                                         numpy.sum(num_positives))
 
     self.num_examples += batch_size
     self.sum_hit_at_one += mean_hit_at_one * batch_size
@@ -222,6 +284,71 @@ class EvaluationMetrics(object):
     self.global_ap_calculator.clear()
     self.num_examples = 0
 
+  def merge(self, other):
+    """Add the metrics accumulated by another EvaluationMetrics object.
+
+    Workers that evaluate disjoint parts of the data can be merged into the
+    exact metrics of the whole epoch.
+
+    Args:
+      other: an EvaluationMetrics object built with the same arguments.
+
+    Raises:
+      ValueError: An error occurred when the two objects are not compatible.
+    """
+    if (other.num_class != self.num_class or other.top_k != self.top_k or
+        other.gap_num_bins != self.gap_num_bins):
+      raise ValueError("cannot merge EvaluationMetrics built with different "
+                       "num_class, top_k or gap_num_bins.")
+    self.sum_hit_at_one += other.sum_hit_at_one
+    self.sum_perr += other.sum_perr
+    self.sum_loss += other.sum_loss
+    self.num_examples += other.num_examples
+    self.map_calculator.merge(other.map_calculator)
+    self.global_ap_calculator.merge(other.global_ap_calculator)
+
+  def to_bytes(self):
+    """Serialize the accumulated metric state to a byte string."""
+    buf = io.BytesIO()
+    numpy.savez(
+        buf,
+        num_class=numpy.array(self.num_class),
+        top_k=numpy.array(self.top_k),
+        gap_num_bins=numpy.array(self.gap_num_bins or 0),
+        sums=numpy.array([self.sum_hit_at_one, self.sum_perr, self.sum_loss]),
+        num_examples=numpy.array(self.num_examples),
+        map_state=numpy.frombuffer(self.map_calculator.to_bytes(),
+                                   dtype=numpy.uint8),
+        gap_state=numpy.frombuffer(self.global_ap_calculator.to_bytes(),
+                                   dtype=numpy.uint8))
+    return buf.getvalue()
+
+  @classmethod
+  def from_bytes(cls, data):
+    """Restore an EvaluationMetrics object from the output of to_bytes."""
+    state = numpy.load(io.BytesIO(data))
+    metrics = cls(int(state["num_class"]), int(state["top_k"]),
+                  int(state["gap_num_bins"]) or None)
+    metrics.sum_hit_at_one, metrics.sum_perr, metrics.sum_loss = [
+        float(v) for v in state["sums"]]
+    metrics.num_examples = int(state["num_examples"])
+    metrics.map_calculator = metrics.map_calculator.from_bytes(
+        state["map_state"].tobytes())
+    metrics.global_ap_calculator = metrics.global_ap_calculator.from_bytes(
+        state["gap_state"].tobytes())
+    return metrics
+
+  def save(self, path):
+    """Write the accumulated metric state to path."""
+    with open(path, "wb") as fout:
+      fout.write(self.to_bytes())
+
+  @classmethod
+  def load(cls, path):
+    """Read an EvaluationMetrics object written by save."""
+    with open(path, "rb") as fin:
+      return cls.from_bytes(fin.read())
+
 def transform_preds_mean(self, predictions):
   s = time.time()
   eos_id = self.num_classes + 2
@@ -0,0 +1,198 @@
+"""Approximate the average precision from fixed-resolution score histograms.
+
+Predictions in [0, 1] are binned into 'num_bins' equal-width bins, and only the
+number of positives and negatives that fall into every bin is kept. The state
+is a pair of small count arrays (plus the number of positives), independent of
+how many predictions have been accumulated. Two states are merged by adding
+them, so sharded evaluation processes can each accumulate a part of the data
+and reduce to one GAP without shipping raw predictions.
+
+The bins are ranked from the highest scores to the lowest. All predictions in
+one bin are treated as tied: every positive in bin b is credited with the
+precision at the end of the bin,
+
+  (positives up to and including b) / (predictions up to and including b).
+
+Error bound: let a bin b hold p_b positives and m_b predictions, preceded by
+P_b positives and D_b predictions in higher bins. However the predictions are
+ordered inside the bin, the precision at every positive in it lies in
+
+  [(P_b + 1) / (D_b + m_b), (P_b + p_b) / (D_b + p_b)],
+
+and so does the estimate. The absolute error of the estimated AP is therefore
+at most
+
+  sum_b p_b * ((P_b + p_b) / (D_b + p_b) - (P_b + 1) / (D_b + m_b)) / num_pos,
+
+which peek_ap_error_bound computes from the histograms. Bins holding a single
+prediction contribute nothing, so the bound shrinks as num_bins grows (and
+is exactly zero when no two predictions share a bin).
+
+Example usage:
+```
+calculator = HistogramAveragePrecisionCalculator(num_bins=100000)
+calculator.accumulate(p1, a1)
+other = HistogramAveragePrecisionCalculator(num_bins=100000)
+other.accumulate(p2, a2)
+calculator.merge(other)
+gap = calculator.peek_ap_at_n()
+```
+"""
+
+import io
+import numbers
+
+import numpy
+
+
+class HistogramAveragePrecisionCalculator(object):
+  """Approximate the average precision with a constant amount of memory."""
+
+  def __init__(self, num_bins=100000):
+    """Construct a HistogramAveragePrecisionCalculator.
+
+    Args:
+      num_bins: A positive integer specifying the number of equal-width bins
+        the range [0, 1] of the predictions is divided into. 10k to 1M bins
+        are typical.
+
+    Raises:
+      ValueError: An error occurred when num_bins is not a positive integer.
+    """
+    if not isinstance(num_bins, int) or num_bins <= 0:
+      raise ValueError("num_bins must be a positive integer.")
+
+    self._num_bins = num_bins
+    self._total_positives = 0  # total number of positives have seen
+    self._pos_counts = numpy.zeros([num_bins], dtype=numpy.int64)
+    self._neg_counts = numpy.zeros([num_bins], dtype=numpy.int64)
+
+  @property
+  def num_bins(self):
+    """Gets the number of bins of the histograms."""
+    return self._num_bins
+
+  @property
+  def heap_size(self):
+    """Gets the number of predictions that have been accumulated."""
+    return int(self._pos_counts.sum() + self._neg_counts.sum())
+
+  @property
+  def num_accumulated_positives(self):
+    """Gets the number of positive samples that have been accumulated."""
+    return self._total_positives
+
+  def accumulate(self, predictions, actuals, num_positives=None):
+    """Accumulate the predictions and their ground truth labels.
+
+    Args:
+      predictions: a list storing the prediction scores, expected in [0, 1].
+        Scores outside the range are clipped into the first or last bin.
+      actuals: a list storing the ground truth labels. Any value
+      larger than 0 will be treated as positives, otherwise as negatives.
+      num_positives: If the 'predictions' and 'actuals' inputs aren't complete,
+      then it's possible some true positives were missed in them. In that case,
+      you can provide 'num_positives' in order to accurately track recall.
+
+    Raises:
+      ValueError: An error occurred when the shape of predictions and actuals
+      does not match, or num_positives is not a non-negative number.
+    """
+    if len(predictions) != len(actuals):
+      raise ValueError("the shape of predictions and actuals does not match.")
+
+    if num_positives is not None:
+      if not isinstance(num_positives, numbers.Number) or num_positives < 0:
+        raise ValueError("'num_positives' was provided but it wan't a nonzero number.")
+
+    predictions = numpy.ravel(numpy.asarray(predictions, dtype=numpy.float64))
+    actuals = numpy.ravel(numpy.asarray(actuals) > 0)
+
+    if num_positives is not None:
+      self._total_positives += num_positives
+    else:
+      self._total_positives += numpy.count_nonzero(actuals)
+
+    bins = numpy.clip(predictions * self._num_bins, 0, self._num_bins - 1)
+    bins = bins.astype(numpy.int64)
+    self._pos_counts += numpy.bincount(bins[actuals],
+                                       minlength=self._num_bins)
+    self._neg_counts += numpy.bincount(bins[~actuals],
+                                       minlength=self._num_bins)
+
+  def merge(self, other):
+    """Add the state accumulated by another calculator to this one.
+
+    Args:
+      other: a HistogramAveragePrecisionCalculator with the same num_bins.
+
+    Raises:
+      ValueError: An error occurred when the number of bins differ.
+    """
+    if other.num_bins != self._num_bins:
+      raise ValueError("cannot merge histograms with %d and %d bins." %
+                       (self._num_bins, other.num_bins))
+    self._pos_counts += other._pos_counts
+    self._neg_counts += other._neg_counts
+    self._total_positives += other._total_positives
+
+  def clear(self):
+    """Clear the accumulated predictions."""
+    self._pos_counts[:] = 0
+    self._neg_counts[:] = 0
+    self._total_positives = 0
+
+  def peek_ap_at_n(self):
+    """Peek the approximate non-interpolated average precision.
+
+    Returns:
+      The approximate non-interpolated average precision of all accumulated
+      predictions (default 0).
+    """
+    ap, _ = self._ap_and_error_bound()
+    return ap
+
+  def peek_ap_error_bound(self):
+    """Peek the worst-case absolute error of peek_ap_at_n.
+
+    Returns:
+      An upper bound of the difference between peek_ap_at_n and the exact
+      average precision, whatever the order of the predictions inside a bin.
+    """
+    _, error_bound = self._ap_and_error_bound()
+    return error_bound
+
+  def _ap_and_error_bound(self):
+    if self._total_positives <= 0:
+      return 0, 0
+    # rank the bins from the highest scores to the lowest
+    pos = self._pos_counts[::-1].astype(numpy.float64)
+    total = pos + self._neg_counts[::-1]
+    occupied = pos > 0
+    pos_end = numpy.cumsum(pos)[occupied]
+    total_end = numpy.cumsum(total)[occupied]
+    pos, total = pos[occupied], total[occupied]
+
+    ap = numpy.sum(pos * pos_end / total_end) / self._total_positives
+    upper = pos_end / (total_end - total + pos)
+    lower = (pos_end - pos + 1) / total_end
+    error_bound = numpy.sum(pos * (upper - lower)) / self._total_positives
+    return float(ap), float(error_bound)
+
+  def to_bytes(self):
+    """Serialize the state to a compact byte string."""
+    buf = io.BytesIO()
+    numpy.savez_compressed(
+        buf, pos_counts=self._pos_counts, neg_counts=self._neg_counts,
+        total_positives=numpy.array(self._total_positives))
+    return buf.getvalue()
+
+  @classmethod
+  def from_bytes(cls, data):
+    """Restore a calculator from the output of to_bytes."""
+    state = numpy.load(io.BytesIO(data))
+    calculator = cls(int(state["pos_counts"].size))
+    calculator._pos_counts[:] = state["pos_counts"]
+    calculator._neg_counts[:] = state["neg_counts"]
+    calculator._total_positives = state["total_positives"].item()
+    return calculator
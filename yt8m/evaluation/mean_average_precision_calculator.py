@@ -35,14 +35,24 @@ calculator = mean_average_precision_calculator.MeanAveragePrecisionCalculator(
 calculator.accumulate(p, a)
 aps = calculator.peek_map_at_n()
 ```
+
+Predictions that are already grouped by class in compressed sparse rows, as
+returned by eval_util.top_k_by_class_csr, can be passed to accumulate_csr
+directly.
 """
 
+import io
+
 import numpy
 import average_precision_calculator
 
 
 class MeanAveragePrecisionCalculator(object):
   """This class is to calculate mean average precision.
+
+  The (class, prediction, actual) triplets of all classes are kept in one set
+  of parallel numpy buffers, and the average precision of every class is
+  computed with a single ranking and segmented cumulative sums.
   """
 
   def __init__(self, num_class):
@@ -50,23 +60,19 @@ class MeanAveragePrecisionCalculator(object):
 
     Args:
       num_class: A positive Integer specifying the number of classes.
-      top_n_array: A list of positive integers specifying the top n for each
-      class. The top n in each class will be used to calculate its average
-      precision at n.
-      The size of the array must be num_class.
 
     Raises:
-      ValueError: An error occurred when num_class is not a positive integer;
-      or the top_n_array is not a list of positive integers.
+      ValueError: An error occurred when num_class is not a positive integer.
     """
     if not isinstance(num_class, int) or num_class <= 0:
       raise ValueError("num_class must be a positive integer.")
 
-    self._ap_calculators = []  # member of AveragePrecisionCalculator
     self._num_class = num_class  # total number of classes
-    for i in xrange(num_class):
-      self._ap_calculators.append(
-          average_precision_calculator.AveragePrecisionCalculator())
+    if num_class <= 2 ** 16:
+      self._class_dtype = numpy.uint16
+    else:
+      self._class_dtype = numpy.int32
+    self.clear()
 
   def accumulate(self, predictions, actuals, num_positives=None):
     """Accumulate the predictions and their ground truth labels.
@@ -85,20 +91,163 @@ class MeanAveragePrecisionCalculator(object):
       ValueError: An error occurred when the shape of predictions and actuals
       does not match.
     """
-    if not num_positives:
-      num_positives = [None for i in predictions.shape[1]]
+    if len(predictions) != self._num_class or len(actuals) != self._num_class:
+      raise ValueError("predictions and actuals must have one list per class.")
+    lengths = [len(p) for p in predictions]
+    if lengths != [len(a) for a in actuals]:
+      raise ValueError("the shape of predictions and actuals does not match.")
+
+    class_offsets = numpy.zeros([self._num_class + 1], dtype=numpy.int64)
+    numpy.cumsum(lengths, out=class_offsets[1:])
+    if class_offsets[-1] > 0:
+      predictions = numpy.concatenate([numpy.ravel(p) for p in predictions])
+      actuals = numpy.concatenate([numpy.ravel(a) for a in actuals])
+    else:
+      predictions, actuals = numpy.zeros([0]), numpy.zeros([0])
+    self.accumulate_csr(class_offsets, predictions, actuals, num_positives)
+
+  def accumulate_csr(self, class_offsets, predictions, actuals,
+                     num_positives=None):
+    """Accumulate predictions grouped by class in compressed sparse rows.
+
+    This is the layout returned by eval_util.top_k_by_class_csr.
+
+    Args:
+      class_offsets: A 1-D array with num_class + 1 entries; the entries of
+        class i are at [class_offsets[i]: class_offsets[i + 1]].
+      predictions: A 1-D array storing the prediction scores.
+      actuals: A 1-D array storing the ground truth labels. Any value larger
+        than 0 will be treated as positives, otherwise as negatives.
+      num_positives: If provided, a 1-D array with the number of true
+        positives for each class. If not provided, the number of true
+        positives will be inferred from the 'actuals' array.
 
-    calculators = self._ap_calculators
-    for i in xrange(len(predictions)):
-      calculators[i].accumulate(predictions[i], actuals[i], num_positives[i])
+    Raises:
+      ValueError: An error occurred when the shapes of the inputs do not
+      match.
+    """
+    class_offsets = numpy.asarray(class_offsets, dtype=numpy.int64)
+    predictions = numpy.ravel(numpy.asarray(predictions, dtype=numpy.float32))
+    actuals = numpy.ravel(numpy.asarray(actuals) > 0)
+    if class_offsets.shape != (self._num_class + 1,):
+      raise ValueError("class_offsets must have num_class + 1 entries.")
+    if predictions.size != actuals.size or predictions.size != class_offsets[-1]:
+      raise ValueError("the shape of predictions and actuals does not match.")
+
+    class_ids = numpy.repeat(
+        numpy.arange(self._num_class, dtype=self._class_dtype),
+        numpy.diff(class_offsets))
+    if num_positives is None:
+      self._total_positives += numpy.bincount(
+          class_ids, weights=actuals, minlength=self._num_class)
+    else:
+      num_positives = numpy.asarray(num_positives, dtype=numpy.float64)
+      if num_positives.shape != (self._num_class,):
+        raise ValueError("num_positives must have one entry per class.")
+      self._total_positives += num_positives
+    self._append(class_ids, predictions, actuals)
+
+  def _append(self, class_ids, predictions, actuals):
+    """Append (class, prediction, actual) triplets to the buffers."""
+    self._reserve(self._size + predictions.size)
+    end = self._size + predictions.size
+    self._class_ids[self._size: end] = class_ids
+    self._predictions[self._size: end] = predictions
+    self._actuals[self._size: end] = actuals
+    self._size = end
+
+  def merge(self, other):
+    """Add the predictions accumulated by another calculator to this one.
+
+    Args:
+      other: a MeanAveragePrecisionCalculator with the same num_class.
+
+    Raises:
+      ValueError: An error occurred when the number of classes differ.
+    """
+    if other._num_class != self._num_class:
+      raise ValueError("cannot merge calculators with different num_class.")
+    size = other._size
+    self._append(other._class_ids[:size], other._predictions[:size],
+                 other._actuals[:size])
+    self._total_positives += other._total_positives
+
+  def to_bytes(self):
+    """Serialize the accumulated state to a byte string."""
+    buf = io.BytesIO()
+    numpy.savez(buf,
+                total_positives=self._total_positives,
+                class_ids=self._class_ids[:self._size],
+                predictions=self._predictions[:self._size],
+                actuals=self._actuals[:self._size])
+    return buf.getvalue()
+
+  @classmethod
+  def from_bytes(cls, data):
+    """Restore a calculator from the output of to_bytes."""
+    state = numpy.load(io.BytesIO(data))
+    calculator = cls(int(state["total_positives"].size))
+    calculator._append(state["class_ids"], state["predictions"],
+                       state["actuals"])
+    calculator._total_positives[:] = state["total_positives"]
+    return calculator
+
+  def _reserve(self, size):
+    """Grow the buffers by doubling until they hold at least size triplets."""
+    capacity = self._predictions.size
+    if size <= capacity:
+      return
+    capacity = max(size, 2 * capacity, 1024)
+    buffers = []
+    for buf in (self._class_ids, self._predictions, self._actuals):
+      new_buf = numpy.zeros([capacity], dtype=buf.dtype)
+      new_buf[:self._size] = buf[:self._size]
+      buffers.append(new_buf)
+    self._class_ids, self._predictions, self._actuals = buffers
+
+  def _rank_by_class(self, seed=0):
+    """Sort the accumulated triplets by class, then by descending prediction.
+
+    Ties are broken randomly to avoid overestimating the ap.
+
+    Returns:
+      The class ids and the boolean ground truth labels in sorted order.
+    """
+    size = self._size
+    predictions = self._predictions[:size]
+    random_state = numpy.random.RandomState(seed)
+    if self._class_dtype == numpy.uint16:
+      # One uint64 key per triplet, sorted without an argsort:
+      # class id (16 bits) | descending score (32 bits) |
+      # random tie-break (15 bits) | label (1 bit).
+      keys = self._class_ids[:size].astype(numpy.uint64) << numpy.uint64(48)
+      keys |= average_precision_calculator.AveragePrecisionCalculator \
+          .descending_keys(predictions) << numpy.uint64(16)
+      keys |= random_state.randint(
+          0, 2 ** 15, size=size).astype(numpy.uint64) << numpy.uint64(1)
+      keys |= self._actuals[:size]
+      keys.sort()
+      class_ids = (keys >> numpy.uint64(48)).astype(numpy.int64)
+      actuals = (keys & numpy.uint64(1)).astype(bool)
+    else:
+      # Rank everything by score once, then stably group by class, which
+      # leaves every class segment ranked by score.
+      ranked = average_precision_calculator.AveragePrecisionCalculator.rank(
+          predictions[None, :], seed)[0]
+      ranked = ranked[numpy.argsort(self._class_ids[ranked], kind="mergesort")]
+      class_ids = self._class_ids[ranked]
+      actuals = self._actuals[ranked].astype(bool)
+    return class_ids, actuals
 
   def clear(self):
-    for calculator in self._ap_calculators:
-      calculator.clear()
+    self._size = 0
+    self._class_ids = numpy.zeros([0], dtype=self._class_dtype)
+    self._predictions = numpy.zeros([0], dtype=numpy.float32)
+    self._actuals = numpy.zeros([0], dtype=numpy.uint8)
+    self._total_positives = numpy.zeros([self._num_class])
 
   def is_empty(self):
-    return ([calculator.heap_size for calculator in self._ap_calculators] ==
-            [0 for _ in range(self._num_class)])
+    return self._size == 0
 
   def peek_map_at_n(self):
     """Peek the non-interpolated mean average precision at n.
@@ -107,6 +256,26 @@ class MeanAveragePrecisionCalculator(object):
       An array of non-interpolated average precision at n (default 0) for each
       class.
     """
-    aps = [self._ap_calculators[i].peek_ap_at_n()
-           for i in xrange(self._num_class)]
-    return aps
+    aps = numpy.zeros([self._num_class])
+    size = self._size
+    if size == 0:
+      return aps.tolist()
+
+    class_ids, actuals = self._rank_by_class()
+    class_starts = numpy.zeros([self._num_class + 1], dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(class_ids, minlength=self._num_class),
+                 out=class_starts[1:])
+    segment_start = class_starts[class_ids]
+
+    # per class cumulative count of positives and rank within the class
+    poscount = numpy.cumsum(actuals, dtype=numpy.float64)
+    poscount -= numpy.concatenate([[0.], poscount])[segment_start]
+    rank = numpy.arange(1, size + 1) - segment_start
+    sum_precisions = numpy.bincount(
+        class_ids[actuals], weights=(poscount / rank)[actuals],
+        minlength=self._num_class)
+
+    has_positives = self._total_positives > 0
+    aps[has_positives] = (sum_precisions[has_positives] /
+                          self._total_positives[has_positives])
+    return aps.tolist()
@@ -0,0 +1,106 @@
+"""TensorFlow ops computing the training metrics inside the graph.
+
+These are the in-graph counterparts of calculate_hit_at_one,
+calculate_precision_at_equal_recall_rate and calculate_gap in eval_util. A
+training step then only fetches a few scalars instead of the whole
+'batch' x 'num_classes' prediction and label matrices. Ties between equal
+scores are broken by class index instead of randomly, so the values can differ
+slightly from the NumPy versions.
+"""
+
+import tensorflow as tf
+
+
+def _gather_labels(labels, indices):
+  """Gathers labels[i, indices[i, j]] into a matrix shaped like indices."""
+  num_classes = tf.shape(labels)[1]
+  rows = tf.expand_dims(tf.range(tf.shape(indices)[0]), 1)
+  flat_indices = rows * num_classes + indices
+  return tf.gather(tf.reshape(labels, [-1]), flat_indices)
+
+
+def top_k_predictions(predictions, labels, k=20):
+  """Selects the top k predictions of every video.
+
+  Args:
+    predictions: 'batch' x 'num_classes' tensor of the model outputs.
+    labels: 'batch' x 'num_classes' float tensor of the ground truth labels.
+    k: how many predictions to keep per video.
+
+  Returns:
+    A tuple (top_scores, top_labels): 'batch' x 'k' tensors of the top k scores
+    of every video in descending order, and the labels of those classes.
+  """
+  num_classes = predictions.get_shape().as_list()[1]
+  if num_classes is not None:
+    k = min(k, num_classes)
+  top_scores, top_indices = tf.nn.top_k(predictions, k=k)
+  return top_scores, _gather_labels(labels, top_indices)
+
+
+def hit_at_one(predictions, labels):
+  """The average hit at one across the batch."""
+  top_indices = tf.expand_dims(tf.to_int32(tf.argmax(predictions, 1)), 1)
+  return tf.reduce_mean(_gather_labels(labels, top_indices))
+
+
+def precision_at_equal_recall_rate(predictions, labels):
+  """The average precision at equal recall rate across the batch.
+
+  Every video is scored on its top n predictions, n being its number of
+  labels, using one top_k over the largest n of the batch.
+  """
+  num_labels = tf.to_int32(tf.reduce_sum(labels, 1))
+  max_labels = tf.maximum(tf.reduce_max(num_labels), 1)
+  top_scores, top_indices = tf.nn.top_k(predictions, k=max_labels)
+  in_top_n = tf.less(tf.expand_dims(tf.range(max_labels), 0),
+                     tf.expand_dims(num_labels, 1))
+  in_top_n = tf.logical_and(in_top_n, top_scores > 0)
+  hits = tf.reduce_sum(
+      _gather_labels(labels, top_indices) * tf.to_float(in_top_n), 1)
+  return tf.reduce_mean(hits / tf.to_float(tf.maximum(num_labels, 1)))
+
+
+def gap_components(predictions, labels, top_k=20):
+  """The per-batch inputs of the global average precision.
+
+  Returns:
+    A tuple (scores, labels, num_positives): the flattened top_k scores and
+    labels of every video, and the number of positives in the batch.
+  """
+  top_scores, top_labels = top_k_predictions(predictions, labels, top_k)
+  return (tf.reshape(top_scores, [-1]), tf.reshape(top_labels, [-1]),
+          tf.reduce_sum(labels))
+
+
+def global_average_precision(predictions, labels, top_k=20):
+  """The global average precision of the top_k predictions of the batch."""
+  scores, top_labels, num_positives = gap_components(predictions, labels,
+                                                     top_k)
+  num_scores = tf.size(scores)
+  _, order = tf.nn.top_k(scores, k=num_scores)
+  sorted_labels = tf.gather(top_labels, order)
+  precisions = tf.cumsum(sorted_labels) / tf.to_float(
+      tf.range(1, num_scores + 1))
+  return tf.reduce_sum(precisions * sorted_labels) / tf.maximum(
+      num_positives, 1.)
+
+
+def build_metric_ops(predictions, labels, top_k=20):
+  """Builds the training metrics of a batch.
+
+  Args:
+    predictions: 'batch' x 'num_classes' tensor of the model outputs.
+    labels: 'batch' x 'num_classes' tensor of the ground truth labels.
+    top_k: how many predictions per video the GAP considers.
+
+  Returns:
+    A dictionary of the scalar tensors "hit_at_one", "perr" and "gap".
+  """
+  with tf.name_scope("train_metrics"):
+    labels = tf.to_float(labels)
+    return {
+        "hit_at_one": hit_at_one(predictions, labels),
+        "perr": precision_at_equal_recall_rate(predictions, labels),
+        "gap": global_average_precision(predictions, labels, top_k),
+    }
@@ -0,0 +1,129 @@
+"""Scores dumped predictions without TensorFlow.
+
+eval_loop dumps the '(num_insts, num_classes)' score matrix of a checkpoint to
+'{model_id}.{stage}.h5' and the video ids of the rows to '{model_id}.{stage}.pkl'.
+This command reads the score matrices in row chunks (memory-mapped when the
+h5 dataset is stored contiguously), joins the rows with a label index built by
+yt8m.data_io.label_index, and computes GAP, MAP, Hit@1 and PERR. Every score
+file is scored by its own process.
+
+Usage:
+  python -m yt8m.evaluation.offline_scorer \
+      --label_index=validate_label_index --num_workers=8 scores/*.h5
+"""
+
+import argparse
+import multiprocessing
+import os
+import cPickle as pkl
+
+import h5py
+import numpy as np
+
+from . import eval_util
+from yt8m.data_io import label_index
+
+
+def open_scores(h5_path):
+  """Opens the 'scores' matrix of h5_path, memory-mapped when possible.
+
+  Returns:
+    A tuple of the score matrix and the global class id of every column, None
+    if the columns are the global class ids.
+  """
+  with h5py.File(h5_path, "r") as fin:
+    dataset = fin["scores"]
+    shape, dtype = dataset.shape, dataset.dtype
+    offset = dataset.id.get_offset()
+    class_ids = fin["class_ids"][:] if "class_ids" in fin else None
+  if offset is not None:
+    return np.memmap(h5_path, dtype=dtype, mode="r", offset=offset,
+                     shape=shape), class_ids
+  # chunked or compressed datasets are read through h5py
+  return h5py.File(h5_path, "r")["scores"], class_ids
+
+
+def score_file(h5_path, index_dir, top_k=20, chunk_size=8192,
+               gap_num_bins=None):
+  """Computes the epoch metrics of one dumped score file.
+
+  Args:
+    h5_path: the score h5 file; the video ids are read from the pickle with
+      the same name.
+    index_dir: the directory of the label index.
+    top_k: how many predictions are considered per video.
+    chunk_size: the number of rows read at a time.
+    gap_num_bins: if set, approximate the GAP with this many histogram bins.
+
+  Returns:
+    A tuple (h5_path, epoch_info_dict, num_missing) where num_missing counts
+    the videos that are not in the label index and were skipped.
+  """
+  with open(os.path.splitext(h5_path)[0] + ".pkl", "rb") as fin:
+    video_ids = pkl.load(fin)
+  index = label_index.LabelIndex.load(index_dir)
+  scores, class_ids = open_scores(h5_path)
+  num_classes = scores.shape[1]
+  # the dataset may be preallocated with more rows than videos
+  num_insts = min(len(video_ids), scores.shape[0])
+
+  evl_metrics = eval_util.EvaluationMetrics(num_classes, top_k, gap_num_bins)
+  num_missing = 0
+  for start in xrange(0, num_insts, chunk_size):
+    end = min(start + chunk_size, num_insts)
+    rows = index.lookup(video_ids[start: end])
+    found = rows >= 0
+    num_missing += int(np.sum(~found))
+    if not np.any(found):
+      continue
+    predictions = np.asarray(scores[start: end], dtype=np.float32)[found]
+    if class_ids is None:
+      labels = index.dense_labels(rows[found], num_classes)
+    else:
+      labels = index.dense_labels(rows[found], class_ids.max() + 1)
+      labels = labels[:, class_ids]
+    evl_metrics.accumulate(predictions, labels, np.zeros([labels.shape[0]]))
+  return h5_path, evl_metrics.get(), num_missing
+
+
+def _score_file(args):
+  return score_file(*args)
+
+
+def format_epoch_info(name, epoch_info_dict):
+  """Formats the metrics like utils.AddEpochSummary, which eval.py parses."""
+  return ("epoch/eval number {0} | Avg_Hit@1: {1:.4f} | Avg_PERR: {2:.4f} "
+          "| MAP: {3:.4f} | GAP: {4:.4f}").format(
+              name, epoch_info_dict["avg_hit_at_one"],
+              epoch_info_dict["avg_perr"], np.mean(epoch_info_dict["aps"]),
+              epoch_info_dict["gap"])
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Score dumped predictions against a label index.")
+  parser.add_argument("score_files", nargs="+")
+  parser.add_argument("--label_index", required=True)
+  parser.add_argument("--top_k", type=int, default=20)
+  parser.add_argument("--chunk_size", type=int, default=8192)
+  parser.add_argument("--gap_num_bins", type=int, default=None)
+  parser.add_argument("--num_workers", type=int,
+                      default=multiprocessing.cpu_count())
+  args = parser.parse_args()
+
+  tasks = [(h5_path, args.label_index, args.top_k, args.chunk_size,
+            args.gap_num_bins) for h5_path in args.score_files]
+  pool = multiprocessing.Pool(min(args.num_workers, len(tasks)))
+  try:
+    for h5_path, epoch_info_dict, num_missing in pool.imap(_score_file, tasks):
+      if num_missing:
+        print("{}: skipped {} videos missing from the label index".format(
+            h5_path, num_missing))
+      print(format_epoch_info(os.path.basename(h5_path), epoch_info_dict))
+  finally:
+    pool.close()
+    pool.join()
+
+
+if __name__ == "__main__":
+  main()
@@ -5,12 +5,15 @@ import numpy as np
 from tensorflow import logging
 from tensorflow import gfile
 
-def format_lines(video_ids, predictions, top_k):
+def format_lines(video_ids, predictions, top_k, label_space=None):
   batch_size = len(video_ids)
   for video_index in xrange(batch_size):
     top_indices = np.argpartition(predictions[video_index], -top_k)[-top_k:]
-    line = [(class_index, predictions[video_index][class_index])
-            for class_index in top_indices]
+    # report the global class ids of the output columns
+    class_ids = (top_indices if label_space is None else
+                 label_space.to_global(top_indices))
+    line = [(class_id, predictions[video_index][class_index])
+            for class_id, class_index in zip(class_ids, top_indices)]
     line = sorted(line, key=lambda p: -p[1])
     yield video_ids[video_index] + "," + " ".join("%i %f" % pair
                                                   for pair in line) + "\n"
@@ -45,7 +48,8 @@ def inference_loop(self, saver, model_ckpt_path):
         num_examples_processed += len(res["predictions"].shape[0])
         logging.info("num examples processed: %d; elapsed seconds: %.2f " % (
             num_examples_processed, time.time() - start_time))
-        for line in format_lines(res["video_id"], res["predictions"], self.config.top_k):
+        for line in format_lines(res["video_id"], res["predictions"], self.config.top_k,
+                                 self.label_space):
           out_file.write(line)
         out_file.flush()
     except tf.errors.OutOfRangeError:
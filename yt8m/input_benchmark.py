@@ -0,0 +1,240 @@
+"""Measures the throughput of the input pipeline of a config without a model.
+
+Builds only the input graph of --config_name, as main.Expr.build_inputs does
+for training (any of the TFRecord readers, or the hdfs feeders with use_hdfs),
+pulls batches for --duration_secs after a warm up and reports
+  examples/sec and MB/sec of the numeric batch tensors,
+  the fill of every input queue over time,
+  the CPU utilization of the process,
+  the p50/p99 latency of a batch.
+Every combination of the --num_readers, --batch_sizes and --capacities sweeps
+is run on a fresh graph; the results are printed and written to --output_json
+for regression tracking. With use_hdfs, num_readers sets the feeder threads.
+
+Usage, on shards from yt8m/tests/synthetic_data.py:
+  python -m yt8m.input_benchmark --config_name=BaseConfig \
+      --data_pattern='/tmp/yt8m_synthetic/frame/train/train-*.tfrecord' \
+      --num_readers=1,4,8 --batch_sizes=256,1024 --duration_secs=30 \
+      --output_json=frame_input.json
+"""
+
+import itertools
+import json
+import multiprocessing
+import os
+import threading
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import app
+from tensorflow import flags
+from tensorflow import logging
+
+from . import main as yt8m_main
+import utils
+from .config import base as base_config
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("data_pattern", "",
+                    "Overrides the data_pattern of the config, e.g. with "
+                    "synthetic shards.")
+flags.DEFINE_string("hdfs_data_dir", "",
+                    "Overrides the hdfs_data_dir of the config.")
+flags.DEFINE_bool("benchmark_phase_train", True,
+                  "Benchmark the shuffling training pipeline, else the "
+                  "evaluation pipeline.")
+flags.DEFINE_string("num_readers", "",
+                    "Comma separated reader counts to sweep, empty for the "
+                    "config value.")
+flags.DEFINE_string("batch_sizes", "",
+                    "Comma separated batch sizes to sweep, empty for the "
+                    "config value.")
+flags.DEFINE_string("capacities", "",
+                    "Comma separated batching queue capacities to sweep, "
+                    "empty for the config value.")
+flags.DEFINE_float("warmup_secs", 10., "Pull batches this long unmeasured.")
+flags.DEFINE_float("duration_secs", 30., "Measure this long.")
+flags.DEFINE_float("fill_interval_secs", 1.,
+                   "Sample the queue sizes at this interval.")
+flags.DEFINE_string("output_json", "", "Write the results to this file.")
+
+
+class InputExpr(yt8m_main.Expr):
+  """An Expr that only sets up a config, to build its input pipeline."""
+
+  def __init__(self, config):
+    self.setup(config.stage, config)
+
+
+def parse_sweep(values, default):
+  values = [int(v) for v in values.split(",") if v.strip()]
+  return values or [default]
+
+
+def queue_capacity(queue):
+  try:
+    return queue.queue_ref.op.get_attr("capacity")
+  except ValueError:
+    return None
+
+
+def batch_bytes(tensors):
+  """The bytes of the numeric tensors of a batch; strings are not counted."""
+  return tf.add_n([tf.to_int64(tf.size(t)) * t.dtype.size
+                   for t in tensors if t.dtype != tf.string])
+
+
+class QueueSampler(threading.Thread):
+  """Samples the sizes of the input queues every interval seconds."""
+
+  def __init__(self, sess, queues, interval):
+    super(QueueSampler, self).__init__()
+    self.daemon = True
+    self.sess = sess
+    self.names = [queue.name for queue in queues]
+    self.sizes = [queue.size() for queue in queues]
+    self.interval = interval
+    self.samples = []
+    self._stop_event = threading.Event()
+
+  def run(self):
+    start = time.time()
+    while not self._stop_event.is_set():
+      try:
+        sizes = self.sess.run(self.sizes)
+      except tf.errors.OpError:
+        return
+      self.samples.append((time.time() - start, sizes))
+      self._stop_event.wait(self.interval)
+
+  def stop(self):
+    self._stop_event.set()
+    self.join()
+
+
+def run_benchmark(config, num_readers, batch_size, capacity):
+  """Benchmarks the input pipeline of config with the given settings.
+
+  Returns:
+    A dictionary of the settings and the measures, see the module docstring.
+  """
+  config.num_readers = num_readers
+  config.hdfs_num_threads = num_readers
+  config.batch_size = batch_size
+  config.input_queue_capacity = capacity
+  with tf.Graph().as_default():
+    expr = InputExpr(config)
+    tensors = [t for t in expr.build_inputs() if t is not None]
+    num_examples = tf.shape(tensors[0])[0]
+    num_bytes = batch_bytes(tensors)
+    queues = [runner.queue
+              for runner in tf.get_collection(tf.GraphKeys.QUEUE_RUNNERS)]
+
+    with tf.Session() as sess:
+      sess.run([tf.global_variables_initializer(),
+                tf.local_variables_initializer()])
+      coord = tf.train.Coordinator()
+      threads = tf.train.start_queue_runners(sess=sess, coord=coord)
+      sampler = QueueSampler(sess, queues, FLAGS.fill_interval_secs)
+      sampler.start()
+
+      latencies, total_examples, total_bytes = [], 0, 0
+      exhausted = False
+      start, cpu_start = time.time(), os.times()
+      try:
+        while time.time() - start < FLAGS.warmup_secs:
+          sess.run(num_examples)
+        start, cpu_start = time.time(), os.times()
+        while time.time() - start < FLAGS.duration_secs:
+          batch_start = time.time()
+          examples_val, bytes_val = sess.run([num_examples, num_bytes])
+          latencies.append(time.time() - batch_start)
+          total_examples += examples_val
+          total_bytes += bytes_val
+      except tf.errors.OutOfRangeError:
+        exhausted = True
+      finally:
+        elapsed = time.time() - start
+        cpu_end = os.times()
+        sampler.stop()
+        coord.request_stop()
+        coord.join(threads, stop_grace_period_secs=10,
+                   ignore_live_threads=True)
+
+  cpu_secs = (cpu_end[0] - cpu_start[0]) + (cpu_end[1] - cpu_start[1])
+  latencies_ms = np.array(latencies or [0.]) * 1000.
+  queue_fill = {}
+  for i, name in enumerate(sampler.names):
+    samples = [[round(t, 3), int(sizes[i])] for t, sizes in sampler.samples]
+    queue_fill[name] = {
+        "capacity": queue_capacity(queues[i]),
+        "mean": float(np.mean([size for _, size in samples]))
+                if samples else None,
+        "samples": samples,
+    }
+  return {
+      "config_name": FLAGS.config_name,
+      "input_feat_type": config.input_feat_type,
+      "use_hdfs": config.use_hdfs,
+      "phase_train": config.phase_train,
+      "num_readers": num_readers,
+      "batch_size": batch_size,
+      "capacity": capacity,
+      "duration_secs": elapsed,
+      "exhausted": exhausted,
+      "num_batches": len(latencies),
+      "num_examples": int(total_examples),
+      "examples_per_sec": float(total_examples) / elapsed,
+      "mb_per_sec": float(total_bytes) / elapsed / 2. ** 20,
+      "batch_latency_ms": {
+          "p50": float(np.percentile(latencies_ms, 50)),
+          "p99": float(np.percentile(latencies_ms, 99)),
+          "mean": float(np.mean(latencies_ms)),
+      },
+      # busy cores, and the share of all cores of the machine
+      "cpu_cores": cpu_secs / elapsed,
+      "cpu_utilization": cpu_secs / elapsed / multiprocessing.cpu_count(),
+      "queue_fill": queue_fill,
+  }
+
+
+def format_result(result):
+  return ("num_readers {num_readers} | batch_size {batch_size} | capacity "
+          "{capacity} | {examples_per_sec:.0f} ex/s | {mb_per_sec:.1f} MB/s | "
+          "p50 {p50:.1f} ms | p99 {p99:.1f} ms | cpu {cpu_cores:.2f} "
+          "cores").format(p50=result["batch_latency_ms"]["p50"],
+                          p99=result["batch_latency_ms"]["p99"], **result)
+
+
+def main(unused_argv):
+  logging.set_verbosity(tf.logging.INFO)
+  config = utils.find_class_by_name(FLAGS.config_name,
+                                    [base_config,])("benchmark")
+  config.phase_train = FLAGS.benchmark_phase_train
+  # run for the duration instead of stopping after an epoch
+  config.num_epochs = None
+  if FLAGS.data_pattern:
+    config.data_pattern = FLAGS.data_pattern
+  if FLAGS.hdfs_data_dir:
+    config.hdfs_data_dir = FLAGS.hdfs_data_dir
+  default_readers = (config.hdfs_num_threads if config.use_hdfs
+                     else config.num_readers)
+
+  results = []
+  for num_readers, batch_size, capacity in itertools.product(
+      parse_sweep(FLAGS.num_readers, default_readers),
+      parse_sweep(FLAGS.batch_sizes, config.batch_size),
+      parse_sweep(FLAGS.capacities, config.input_queue_capacity)):
+    result = run_benchmark(config, num_readers, batch_size, capacity)
+    print(format_result(result))
+    results.append(result)
+
+  if FLAGS.output_json:
+    with open(FLAGS.output_json, "w") as fout:
+      json.dump(results, fout, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+  app.run()
@@ -36,11 +36,14 @@ from yt8m.data_io import vlad_reader
 from yt8m.data_io import hdfs_reader
 from yt8m.data_io import hdfs_reader_bias
 from yt8m.data_io import hdfs_reader_no_bias
+from yt8m.data_io import label_space
+from yt8m.evaluation import metric_ops
 import utils
 from .config import base as base_config
 import models.conv.train as conv_train
 import train_loop
 import eval_loop
+import sharded_eval
 import inference_loop
 
 FLAGS = flags.FLAGS
@@ -48,18 +51,61 @@ FLAGS = flags.FLAGS
 flags.DEFINE_string("stage", "train", "")
 flags.DEFINE_string("model_ckpt_path", "", "")
 flags.DEFINE_string("config_name", "BaseConfig", "")
+flags.DEFINE_integer("num_eval_shards", 1,
+                     "Split the eval files into this many shards, each "
+                     "evaluated by its own local process.")
+flags.DEFINE_integer("eval_threads_per_shard", 0,
+                     "TensorFlow threads of every eval process, 0 for the "
+                     "default.")
+flags.DEFINE_integer("eval_shard_id", -1,
+                     "Set by the sharded eval driver: the shard evaluated by "
+                     "this process.")
+flags.DEFINE_string("eval_shard_dir", "",
+                    "Set by the sharded eval driver: where the shard writes "
+                    "its metric state.")
 
 class Expr(object):
   def __init__(self):
-    self.stage = FLAGS.stage
+    self.setup(FLAGS.stage, utils.find_class_by_name(
+        FLAGS.config_name, [base_config,])(FLAGS.stage))
+    inputs = self.build_inputs()
+
+    self.build_graph(inputs)
+    logging.info("built graph")
+    init_fn = self.model.get_train_init_fn()
+
+    if self.model.var_moving_average_decay > 0:
+      print("Using moving average")
+      variable_averages = tf.train.ExponentialMovingAverage(
+          self.model.var_moving_average_decay)
+      variables_to_restore = variable_averages.variables_to_restore()
+      eval_saver = tf.train.Saver(variables_to_restore)
+    else:
+      eval_saver = tf.train.Saver(tf.global_variables())
+
+    if self.stage == "train":
+      train_loop.train_loop(self, self.model_ckpt_path, init_fn=init_fn)
+    elif self.stage == "eval":
+      eval_loop.evaluation_loop(self, eval_saver, self.model_ckpt_path)
+    elif self.stage == "inference":
+      inference_loop.inference_loop(self, eval_saver, self.model_ckpt_path)
+
+  def setup(self, stage, config):
+    """Sets up the config, model and input settings without building a graph."""
+    self.stage = stage
     self.model_ckpt_path = FLAGS.model_ckpt_path
-    self.config = utils.find_class_by_name(FLAGS.config_name,
-                                           [base_config,])(self.stage)
+    self.config = config
     self.phase_train = self.config.phase_train
     self.task = 0
     self.ps_tasks = 0
     self.is_chief = (self.task == 0)
     self.master = ""
+    self.num_eval_shards = FLAGS.num_eval_shards
+    self.eval_threads_per_shard = FLAGS.eval_threads_per_shard
+    self.eval_shard_id = FLAGS.eval_shard_id
+    self.eval_shard_dir = FLAGS.eval_shard_dir
+    # set by bucket_batch_join when the frames are bucketed by length
+    self.bucket_stats = None
 
     self.batch_size = self.config.batch_size
 
@@ -72,6 +118,16 @@ class Expr(object):
          h_lstm, fusion, h3gru, gru_attn_new, ln_h_lstm, bi_h_lstm, bi_h_lstm_new,
          dilation_model, convGRU, randomseq, stack_gru, context,
          gru_2_skip_3_random_dropout, clockwork, attn_models])()
+    # models that skip BaseModel.__init__ are assumed to need max_frames steps
+    if (self.config.frame_bucket_boundaries and
+        self.config.input_feat_type == "frame" and
+        not getattr(self.model, "supports_dynamic_frames", False)):
+      # a bucket is padded to its longest video, not to max_frames
+      raise ValueError(
+          "{} does not set supports_dynamic_frames and cannot be trained "
+          "with frame_bucket_boundaries.".format(self.config.model_name))
+    self.label_space = label_space.LabelSpace.from_config(
+        self.config, self.model.num_classes)
     self.label_loss_fn = utils.find_class_by_name(
         self.config.label_loss, [losses])()
     self.optimizer = utils.find_class_by_name(
@@ -80,42 +136,39 @@ class Expr(object):
     # convert feature_names and feature_sizes to lists of values
     self.feature_names, self.feature_sizes = utils.GetListOfFeatureNamesAndSizes(
         self.config.feature_names, self.config.feature_sizes)
+
+  def build_inputs(self):
+    """Builds the input pipeline of the config.
+
+    Returns:
+      The tuple (video_id_batch, model_input_raw, dense_labels_batch,
+      sparse_labels_batch, num_frames, label_weights_batch,
+      input_weights_batch) consumed by build_graph.
+    """
     if self.config.use_hdfs:
       inputs = hdfs_reader_no_bias.enqueue_data(
           self.config.input_feat_type, self.phase_train, self.batch_size,
-          self.model.num_classes, sum(self.feature_sizes))
+          self.model.num_classes, sum(self.feature_sizes),
+          max_labels=self.config.sparse_label_max,
+          num_threads=self.config.hdfs_num_threads,
+          capacity=self.config.input_queue_capacity or 1500,
+          data_dir=self.config.hdfs_data_dir,
+          backend=self.config.hdfs_backend,
+          block_size=self.config.hdfs_block_size,
+          buffer_blocks=self.config.hdfs_shuffle_buffer_blocks,
+          num_processes=self.config.hdfs_num_processes)
       video_id_batch, dense_labels_batch, model_input_raw = inputs
       sparse_labels_batch, num_frames, label_weights_batch = None, None, None
       input_weights_batch = None
-      inputs = video_id_batch, model_input_raw, dense_labels_batch, \
-               sparse_labels_batch, num_frames, label_weights_batch, \
-               input_weights_batch
+      return video_id_batch, model_input_raw, dense_labels_batch, \
+             sparse_labels_batch, num_frames, label_weights_batch, \
+             input_weights_batch
     else:
-      inputs = self.get_input_data_tensors(
+      return self.get_input_data_tensors(
           self.config.data_pattern,
           num_readers=self.config.num_readers,
           num_epochs=self.config.num_epochs)
 
-    self.build_graph(inputs)
-    logging.info("built graph")
-    init_fn = self.model.get_train_init_fn()
-
-    if self.model.var_moving_average_decay > 0:
-      print("Using moving average")
-      variable_averages = tf.train.ExponentialMovingAverage(
-          self.model.var_moving_average_decay)
-      variables_to_restore = variable_averages.variables_to_restore()
-      eval_saver = tf.train.Saver(variables_to_restore)
-    else:
-      eval_saver = tf.train.Saver(tf.global_variables())
-
-    if self.stage == "train":
-      train_loop.train_loop(self, self.model_ckpt_path, init_fn=init_fn)
-    elif self.stage == "eval":
-      eval_loop.evaluation_loop(self, eval_saver, self.model_ckpt_path)
-    elif self.stage == "inference":
-      inference_loop.inference_loop(self, eval_saver, self.model_ckpt_path)
-
   def get_input_data_tensors(self,
                              data_pattern,
                              num_epochs=None,
@@ -127,41 +180,104 @@ class Expr(object):
       if not files:
         raise IOError("Unable to find files. data_pattern='" +
                       data_pattern + "'")
+      if self.eval_shard_id >= 0:
+        files = sorted(files)[self.eval_shard_id::self.num_eval_shards]
+        logging.info("eval shard %d of %d", self.eval_shard_id,
+                     self.num_eval_shards)
       logging.info("number of training files: " + str(len(files)))
       filename_queue = tf.train.string_input_producer(
           files, shuffle=self.phase_train, num_epochs=num_epochs)
       data = [
           reader.prepare_reader(filename_queue) for _ in xrange(num_readers)]
 
+      if (self.config.frame_bucket_boundaries and
+          self.config.input_feat_type == "frame"):
+        return self.bucket_batch_join(data)
+      capacity = self.config.input_queue_capacity
       if self.phase_train:
+        capacity = capacity or self.batch_size * 10
         return tf.train.shuffle_batch_join(
             data,
             batch_size=self.batch_size,
-            capacity=self.batch_size * 10,
-            min_after_dequeue=self.batch_size * 5,
+            capacity=capacity,
+            min_after_dequeue=capacity // 2,
             allow_smaller_final_batch=True,
             enqueue_many=True)
       else:
         return tf.train.batch_join(
             data,
             batch_size=self.batch_size,
-            capacity=self.batch_size * 3,
+            capacity=capacity or self.batch_size * 3,
             allow_smaller_final_batch=True,
             enqueue_many=True)
 
+  def bucket_batch_join(self, data):
+    """Batches frame-level videos of similar lengths together.
+
+    The videos of all readers are first shuffled (in training) into a stream
+    of single examples, which is split into buckets by num_frames at
+    config.frame_bucket_boundaries. A batch holds videos of one bucket and is
+    padded to its longest video instead of max_frames.
+    """
+    capacity = self.config.input_queue_capacity
+    if self.phase_train:
+      capacity = capacity or self.batch_size * 10
+      examples = tf.train.shuffle_batch_join(
+          data,
+          batch_size=1,
+          capacity=capacity,
+          min_after_dequeue=capacity // 2,
+          enqueue_many=True)
+    else:
+      examples = tf.train.batch_join(
+          data,
+          batch_size=1,
+          capacity=capacity or self.batch_size * 3,
+          allow_smaller_final_batch=True,
+          enqueue_many=True)
+    video_id, video_matrix, dense_labels, sparse_labels, num_frames, \
+        label_weights, input_weights = [t[0] for t in examples]
+    video_matrix = video_matrix[:num_frames]
+    input_weights = input_weights[:num_frames]
+
+    bucket_id, batch = tf.contrib.training.bucket_by_sequence_length(
+        num_frames,
+        [video_id, video_matrix, dense_labels, sparse_labels, num_frames,
+         label_weights, input_weights],
+        batch_size=self.batch_size,
+        bucket_boundaries=self.config.frame_bucket_boundaries,
+        num_threads=self.config.num_readers,
+        capacity=self.batch_size * 2,
+        dynamic_pad=True,
+        allow_smaller_final_batch=True)
+    self.bucket_stats = {
+        "bucket_id": bucket_id,
+        "num_frames": batch[4],
+        "padded_length": tf.shape(batch[1])[1],
+    }
+    return batch
+
   def get_reader(self):
     if self.config.input_feat_type == "frame":
       reader = readers.YT8MFrameFeatureReader(
           num_classes=self.model.num_classes,
           feature_names=self.feature_names,
           num_max_labels=self.model.num_max_labels,
-          feature_sizes=self.feature_sizes)
+          feature_sizes=self.feature_sizes,
+          label_space=self.label_space,
+          sparse_label_max=self.config.sparse_label_max,
+          frame_sampling=self.model.frame_sampling,
+          frame_sampling_size=self.model.frame_sampling_size,
+          read_batch_size=self.config.frame_read_batch_size,
+          keep_quantized=self.config.frame_keep_quantized)
     elif self.config.input_feat_type == "video":
       reader = readers.YT8MAggregatedFeatureReader(
           num_classes=self.model.num_classes,
           feature_names=self.feature_names,
           num_max_labels=self.model.num_max_labels,
-          feature_sizes=self.feature_sizes,)
+          feature_sizes=self.feature_sizes,
+          label_space=self.label_space,
+          sparse_label_max=self.config.sparse_label_max,)
           # label_smoothing=self.config.label_smoothing)
     elif self.config.input_feat_type == "vlad":
       reader = vlad_reader.YT8MVLADFeatureReader(
@@ -172,13 +288,15 @@ class Expr(object):
           num_classes=self.model.num_classes,
           feature_names=self.feature_names,
           num_max_labels=self.model.num_max_labels,
-          feature_sizes=self.feature_sizes,)
+          feature_sizes=self.feature_sizes,
+          label_space=self.label_space,)
     elif self.config.input_feat_type == "555":
       reader = readers.YT8M555FeatureReader(
           num_classes=self.model.num_classes,
           feature_names=self.feature_names,
           num_max_labels=self.model.num_max_labels,
-          feature_sizes=self.feature_sizes,)
+          feature_sizes=self.feature_sizes,
+          label_space=self.label_space,)
     return reader
 
   def build_graph(self, inputs):
@@ -189,23 +307,30 @@ class Expr(object):
 
       video_id_batch, model_input_raw, dense_labels_batch, sparse_labels_batch, num_frames, label_weights_batch, input_weights_batch = inputs
       feature_dim = len(model_input_raw.get_shape()) - 1
+      if model_input_raw.dtype == tf.uint8:
+        # the frame reader kept the features quantized through the queues
+        model_input_raw = readers.dequantize_frames(model_input_raw,
+                                                    num_frames)
 
       if self.model.normalize_input:
         print("L2 Normalizing input")
         model_input = tf.nn.l2_normalize(model_input_raw, feature_dim)
       else:
         model_input = model_input_raw
-      # TODO
-      if self.model.num_classes == 1000:
-        logging.info("num classes: 1000")
-        dense_labels_batch = dense_labels_batch[:, :1000]
-        # sparse_labels_batch = sparse_labels_batch[:, :1000]
-      if self.model.num_classes == 1001:
-        logging.info("num classes: 1001")
-        dense_labels_batch = dense_labels_batch[:, 1000: 2001]
-      if self.model.num_classes == 3000:
-        logging.info("num classes: 3000")
-        dense_labels_batch = dense_labels_batch[:, 1000: 4000]
+      if dense_labels_batch.dtype == tf.int16:
+        # sparse label transport: the readers emitted the label ids in place
+        # of every dense label tensor
+        label_ids_batch = dense_labels_batch
+        dense_labels_batch = self.label_space.densify(label_ids_batch)
+        if sparse_labels_batch is not None and \
+            sparse_labels_batch.dtype == tf.int16:
+          sparse_labels_batch = dense_labels_batch
+        if label_weights_batch is not None and \
+            label_weights_batch.dtype == tf.int16:
+          label_weights_batch = dense_labels_batch
+        if input_weights_batch is not None and \
+            input_weights_batch.dtype == tf.int16:
+          input_weights_batch = dense_labels_batch
       dense_labels_batch = tf.cast(dense_labels_batch, tf.float32)
       # dense_labels_batch = tf.Print(dense_labels_batch, [tf.reduce_sum(dense_labels_batch, 1)])
       with tf.name_scope("model"):
@@ -245,6 +370,18 @@ class Expr(object):
             "dense_labels": dense_labels_batch,
             "global_norm": global_norm,
         }
+        if self.bucket_stats is not None:
+          self.feed_out["bucket_stats"] = self.bucket_stats
+          self.feed_out1["bucket_stats"] = self.bucket_stats
+        if (self.model.in_graph_train_metrics and
+            not isinstance(predictions, list)):
+          train_metrics = metric_ops.build_metric_ops(
+              predictions, dense_labels_batch, self.config.top_k)
+          num_examples = tf.shape(dense_labels_batch)[0]
+          for feed_out in (self.feed_out, self.feed_out1):
+            del feed_out["predictions"], feed_out["dense_labels"]
+            feed_out["metrics"] = train_metrics
+            feed_out["num_examples"] = num_examples
       elif self.stage == "eval":
         self.feed_out = {
           "video_id": video_id_batch,
@@ -264,7 +401,15 @@ class Expr(object):
 def main(unused_argv):
   logging.set_verbosity(tf.logging.INFO)
   print("tensorflow version: %s" % tf.__version__)
-  Expr()
+  if (FLAGS.stage == "eval" and FLAGS.num_eval_shards > 1 and
+      FLAGS.eval_shard_id < 0):
+    config = utils.find_class_by_name(FLAGS.config_name,
+                                      [base_config,])(FLAGS.stage)
+    sharded_eval.sharded_evaluation(
+        config, FLAGS.config_name, FLAGS.model_ckpt_path,
+        FLAGS.num_eval_shards, FLAGS.eval_threads_per_shard)
+  else:
+    Expr()
 
 if __name__ == "__main__":
   app.run()
@@ -24,6 +24,10 @@ class LSTMEncDec(models.BaseModel):
     self.cell_size = 1024
     self.max_steps = 150
     self.num_max_labels = 10
+    # the reader keeps a random window of max_steps frames, so only those are
+    # dequantized and enqueued
+    self.frame_sampling = "window"
+    self.frame_sampling_size = self.max_steps
 
   def create_model(self, model_input, vocab_size, num_frames,
                    is_training=True, sparse_labels=None, label_weights=None,
@@ -31,6 +35,8 @@ class LSTMEncDec(models.BaseModel):
 
     self.phase_train = is_training
     num_frames = tf.cast(tf.expand_dims(num_frames, 1), tf.float32)
+    # on the max_steps window of the reader this only repeats the last frame
+    # of a shorter video
     model_inputs = utils.SampleRandomSequence(model_input, num_frames,
                                               self.max_steps)
 
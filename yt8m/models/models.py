@@ -27,6 +27,17 @@ class BaseModel(object):
     self.num_max_labels = -1
     self.num_classes = 4716
     self.decay_lr = False
+    # compute the training metrics in the graph and fetch only the scalars,
+    # instead of fetching the predictions for the NumPy metrics
+    self.in_graph_train_metrics = False
+    # let the frame reader keep only some frames of every video, see
+    # readers.YT8MFrameFeatureReader
+    self.frame_sampling = None
+    self.frame_sampling_size = 0
+    # whether the model accepts frame-level input of any length, as batches
+    # bucketed by num_frames are padded to their longest video; models with a
+    # fixed step count (max_steps, a hard-coded 300) keep the default
+    self.supports_dynamic_frames = False
 
   def create_model(self, unused_model_input, **unused_params):
     raise NotImplementedError()
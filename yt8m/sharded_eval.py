@@ -0,0 +1,151 @@
+"""Evaluates one checkpoint with several local processes.
+
+The eval files are split into shards, and every shard is evaluated by its own
+`yt8m.main --stage=eval` process. Each process saves its EvaluationMetrics
+state (and its scores, when they are dumped); the driver then merges the
+states into the metrics of the whole split and concatenates the scores.
+"""
+
+import os
+import subprocess
+import sys
+import cPickle as pkl
+
+import h5py
+import numpy as np
+from tensorflow import gfile
+from tensorflow import logging
+
+from yt8m.evaluation import eval_util
+import eval_loop
+import utils
+
+
+def merge_scores(shard_paths, scores_h5_path, video_ids_pkl_path,
+                 chunk_size=10000):
+  """Concatenates the scores and video ids dumped by the shards, in order.
+
+  The merged scores are one fixed-shape dataset, stored contiguously so that
+  offline_scorer can memory-map it.
+  """
+  num_insts, num_classes, class_ids = 0, None, None
+  for shard_h5_path, _ in shard_paths:
+    with h5py.File(shard_h5_path, "r") as shard_in:
+      num_insts += shard_in["scores"].shape[0]
+      num_classes = shard_in["scores"].shape[1]
+      if class_ids is None and "class_ids" in shard_in:
+        class_ids = shard_in["class_ids"][:]
+  video_ids = []
+  with h5py.File(scores_h5_path, "w") as pred_out:
+    pred_dataset = pred_out.create_dataset(
+        "scores", shape=(num_insts, num_classes), dtype=np.float32)
+    if class_ids is not None:
+      pred_out.create_dataset("class_ids", data=class_ids)
+    start = 0
+    for shard_h5_path, shard_pkl_path in shard_paths:
+      with h5py.File(shard_h5_path, "r") as shard_in:
+        shard_scores = shard_in["scores"]
+        shard_insts = shard_scores.shape[0]
+        for i in xrange(0, shard_insts, chunk_size):
+          end = min(i + chunk_size, shard_insts)
+          pred_dataset[start + i: start + end, :] = shard_scores[i: end, :]
+        start += shard_insts
+      with open(shard_pkl_path) as fin:
+        video_ids += pkl.load(fin)
+      os.remove(shard_h5_path)
+      os.remove(shard_pkl_path)
+  with open(video_ids_pkl_path, "w") as fout:
+    pkl.dump(video_ids, fout)
+
+
+def sharded_evaluation(config, config_name, model_ckpt_path, num_shards,
+                       threads_per_shard=0):
+  """Runs the eval of model_ckpt_path in num_shards local processes.
+
+  Args:
+    config: the config object of the experiment.
+    config_name: the name of the config class, passed on to the workers.
+    model_ckpt_path: the checkpoint to evaluate.
+    num_shards: the number of worker processes.
+    threads_per_shard: the TensorFlow thread count of every worker, 0 for the
+      default.
+
+  Raises:
+    IOError: No eval files match the data pattern.
+    RuntimeError: A worker failed or did not produce its metric state.
+  """
+  global_step_val = model_ckpt_path.split("/")[-1].split("-")[-1]
+  files = gfile.Glob(config.data_pattern)
+  if not files:
+    raise IOError("Unable to find files. data_pattern='" +
+                  config.data_pattern + "'")
+  num_shards = min(num_shards, len(files))
+
+  shard_dir = os.path.join(os.path.dirname(model_ckpt_path),
+                           "eval_shards-{}".format(global_step_val))
+  if not gfile.Exists(shard_dir):
+    gfile.MakeDirs(shard_dir)
+  logging.info("evaluating %d files in %d shards, logs in %s", len(files),
+               num_shards, shard_dir)
+
+  stage = "validate"
+  shard_paths = [eval_loop.score_paths(model_ckpt_path, stage, shard_id)
+                 for shard_id in xrange(num_shards)]
+  # the outputs of an earlier run must not be mistaken for those of this one
+  stale_paths = gfile.Glob(os.path.join(shard_dir, "metrics-*.state"))
+  for h5_path, pkl_path in shard_paths:
+    stale_paths += [h5_path, pkl_path]
+  for path in stale_paths:
+    if os.path.exists(path):
+      os.remove(path)
+
+  workers = []
+  for shard_id in xrange(num_shards):
+    cmd = [sys.executable, "-m", "yt8m.main",
+           "--stage=eval",
+           "--model_ckpt_path={}".format(model_ckpt_path),
+           "--config_name={}".format(config_name),
+           "--num_eval_shards={}".format(num_shards),
+           "--eval_threads_per_shard={}".format(threads_per_shard),
+           "--eval_shard_id={}".format(shard_id),
+           "--eval_shard_dir={}".format(shard_dir)]
+    log_fout = open(os.path.join(shard_dir, "shard-{}.log".format(shard_id)),
+                    "w")
+    workers.append((subprocess.Popen(cmd, stdout=log_fout,
+                                     stderr=subprocess.STDOUT), log_fout))
+  for worker, log_fout in workers:
+    worker.wait()
+    log_fout.close()
+  for shard_id, (worker, _) in enumerate(workers):
+    if worker.returncode != 0:
+      raise RuntimeError("eval shard {} exited with code {}, see {}".format(
+          shard_id, worker.returncode,
+          os.path.join(shard_dir, "shard-{}.log".format(shard_id))))
+
+  evl_metrics = None
+  for shard_id in xrange(num_shards):
+    state_path = eval_loop.metrics_state_path(shard_dir, shard_id)
+    if not os.path.exists(state_path):
+      raise RuntimeError("eval shard {} failed, see {}".format(
+          shard_id, os.path.join(shard_dir, "shard-{}.log".format(shard_id))))
+    shard_metrics = eval_util.EvaluationMetrics.load(state_path)
+    if evl_metrics is None:
+      evl_metrics = shard_metrics
+    else:
+      evl_metrics.merge(shard_metrics)
+
+  if all(os.path.exists(h5_path) for h5_path, _ in shard_paths):
+    logging.info("merging the scores of %d shards", num_shards)
+    scores_h5_path, video_ids_pkl_path = eval_loop.score_paths(
+        model_ckpt_path, stage)
+    merge_scores(shard_paths, scores_h5_path, video_ids_pkl_path)
+
+  epoch_info_dict = evl_metrics.get()
+  epoch_info_dict["epoch_id"] = global_step_val
+  epochinfo = utils.AddEpochSummary(
+      None,
+      global_step_val,
+      epoch_info_dict,
+      summary_scope="Eval")
+  logging.info(epochinfo)
+  return epoch_info_dict
@@ -26,6 +26,10 @@ from . import video_level_models
 
 
 class FrameLevelLogisticModel(models.BaseModel):
+  def __init__(self):
+    super(FrameLevelLogisticModel, self).__init__()
+    # averages the frames whatever their number
+    self.supports_dynamic_frames = True
 
   def create_model(self, model_input, vocab_size, num_frames, l2_penalty=1e-8, **unused_params):
     """Creates a model which uses a logistic classifier over the average of the
@@ -74,6 +74,7 @@ class MoeConfig(object):
 class MoeModel(models.BaseModel):
   """A softmax over a mixture of logistic models (with L2 regularization)."""
   def __init__(self):
+    super(MoeModel, self).__init__()
     self.normalize_input = True
     self.clip_global_norm = 1
     self.var_moving_average_decay = 0
@@ -1,14 +1,14 @@
 import cPickle as pkl
 
+from yt8m.data_io import label_index
 
-# vid_to_labels = pkl.load(open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_vid_to_labels.pkl"))
+
+# the label to videos lists are the inverse CSR of the label index
+index = label_index.LabelIndex.load("/data/uts700/linchao/yt8m/YT/data/vid_info/train_label_index")
 
 label_to_vids = {}
-cnt = 0
-for vid, labels in vid_to_labels.iteritems():
-    for l in labels:
-        c = label_to_vids.get(l, [])
-        c.append(vid)
-        label_to_vids[l] = c
-        cnt += 1
+for l in xrange(index.num_labels):
+    vids = index.video_ids_of_label(l).tolist()
+    if vids:
+        label_to_vids[l] = vids
 pkl.dump(label_to_vids, open("/data/uts700/linchao/yt8m/YT/data/vid_info/train_label_to_vids.pkl", "w"))
@@ -6,6 +6,8 @@ import h5py
 import tensorflow as tf
 from tensorflow import gfile
 
+from yt8m.data_io import label_index
+
 def int64_feature(values):
   """Returns a TF-Feature of int64s.
 
@@ -50,7 +52,7 @@ def write():
     tfrecord_writer.write(example.SerializeToString())
 
 def write_from_hdfs(split_id):
-  train_vid_to_labels = pkl.load(open("/data/D2DCRC/linchao/YT/train_vid_to_labels.pkl"))
+  train_label_index = label_index.LabelIndex.load("/data/D2DCRC/linchao/YT/train_label_index")
   fin = h5py.File("/data/D2DCRC/linchao/YT/vlad_feas_256_256_nonorm/train/feas_{0}.h5".format(split_id))
   vids = fin.keys()
   writer_counter = 0
@@ -59,7 +61,8 @@ def write_from_hdfs(split_id):
     print(i, vid)
     data = fin[vid].value
     data = np.array(data, dtype=np.float16)
-    labels = [int(_) for _ in train_vid_to_labels[vid]]
+    labels = [int(_) for _ in train_label_index.label_lists(
+        train_label_index.rows_of([vid]))[0]]
     example = matrix_to_tfexample(
         data.tostring(), labels, video_id=str(vid))
     if writer_counter % 1200 == 0:
@@ -71,8 +74,6 @@ def write_from_hdfs(split_id):
     tfrecord_writer.write(example.SerializeToString())
     writer_counter += 1
 
-write_from_hdfs(sys.argv[1])
-
 def read(output_filename):
   files = gfile.Glob(output_filename)
   filename_queue = tf.train.string_input_producer(
@@ -117,3 +118,6 @@ def read(output_filename):
 
 # for example in tf.python_io.tf_record_iterator(output_filename):
   # d = tf.train.Example.FromString(example)
+
+if __name__ == "__main__":
+  write_from_hdfs(sys.argv[1])
@@ -29,6 +29,22 @@ def matrix_to_tfexample(rgb, audio, labels=[], video_id=None):
       })
   )
 
+def frames_to_tfexample(rgb_frames, audio_frames, labels=[], video_id=None):
+  """Like matrix_to_tfexample, with one bytes entry per frame as in the
+  released frame-level data, which YT8MFrameFeatureReader parses."""
+  return tf.train.SequenceExample(
+      context=tf.train.Features(feature={
+          "labels": _int64_feature(labels),
+          "video_id": _bytes_feature([video_id]),
+      }),
+      feature_lists=tf.train.FeatureLists(feature_list={
+          "rgb": tf.train.FeatureList(
+              feature=[_bytes_feature([frame]) for frame in rgb_frames]),
+          "audio": tf.train.FeatureList(
+              feature=[_bytes_feature([frame]) for frame in audio_frames]),
+      })
+  )
+
 def write():
   output_filename = "/tmp/a.tfrecord"
   with tf.python_io.TFRecordWriter(output_filename) as tfrecord_writer:
@@ -156,7 +172,8 @@ def just_read():
     coord.request_stop()
     coord.join(threads)
 
-# write()
-print("------------------------")
-read()
-# just_read()
+if __name__ == "__main__":
+  # write()
+  print("------------------------")
+  read()
+  # just_read()
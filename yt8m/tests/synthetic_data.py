@@ -0,0 +1,266 @@
+"""Generates a synthetic YouTube-8M dataset for local benchmarking.
+
+The records use the layouts of the writers in this directory and of the
+readers in yt8m/data_io, so the input pipeline and the models run unchanged on
+a machine without the real data. Every shard is generated by its own process
+from its own seed, and a video has the same labels and features in every
+format. The output directory mirrors the layout under /data/state/linchao/YT:
+
+  frame/{stage}/{stage}-{shard}.tfrecord  frame-level SequenceExamples with
+      one quantized 'rgb' and 'audio' entry per frame (sequence_writer).
+  video/{stage}/{stage}-{shard}.tfrecord  video-level Examples with the
+      'mean_rgb' and 'mean_audio' of the frames (video_writer).
+  vlad/{stage}/{stage}-{shard}.tfrecord  256 x 256 float16 VLAD 'feas'
+      (record_writer).
+  score/{stage}/{stage}-{shard}.tfrecord  5 x 4716 float 'scores'.
+  video_hdfs/{stage}/mean.{h5,pkl}, vlad_hdfs/{stage}/mean.{h5,pkl}  the
+      'feas' matrices and row video ids of the hdfs_reader* modules.
+  vid_info/train_vid_to_labels_-1.pkl, vid_info/validate_vid_to_labels.pkl
+      the label dictionaries, and vid_info/{stage}_label_index the label
+      index of the hdfs_reader* modules (yt8m/data_io/label_index.py).
+
+Usage, from the repository root:
+  PYTHONPATH=. python yt8m/tests/synthetic_data.py \
+      --output_dir=/tmp/yt8m_synthetic \
+      --num_videos=100000 --formats=frame,video,video_hdfs --num_workers=16
+"""
+
+import argparse
+import multiprocessing
+import os
+import cPickle as pkl
+
+import h5py
+import numpy as np
+import tensorflow as tf
+
+import record_writer
+import sequence_writer
+import video_writer
+from yt8m.data_io import label_index
+
+NUM_CLASSES = 4716
+RGB_SIZE, AUDIO_SIZE = 1024, 128
+VLAD_SHAPE = (256, 256)
+NUM_SCORE_MODELS = 5
+RECORD_FORMATS = ("frame", "video", "vlad", "score")
+HDFS_FORMATS = ("video_hdfs", "vlad_hdfs")
+VID_TO_LABELS_FILES = {"train": "train_vid_to_labels_-1.pkl",
+                       "validate": "validate_vid_to_labels.pkl"}
+LABEL_INDEX_DIRS = {"train": "train_label_index",
+                    "validate": "validate_label_index"}
+
+
+def dequantize(quantized, max_q=2, min_q=-2):
+  """The NumPy counterpart of utils.Dequantize."""
+  quantized_range = max_q - min_q
+  return (quantized * (quantized_range / 255.0) +
+          (quantized_range / 512.0 + min_q))
+
+
+def sample_num_frames(rng, args, size):
+  """Samples the frame counts of size videos from --frames_dist."""
+  if args.frames_dist == "fixed":
+    num_frames = np.zeros([size], dtype=np.int64) + args.max_frames
+  elif args.frames_dist == "uniform":
+    num_frames = rng.randint(args.min_frames, args.max_frames + 1, size)
+  elif args.frames_dist == "normal":
+    num_frames = np.round(rng.normal(args.mean_frames, args.std_frames, size))
+  else:
+    raise ValueError("unknown frames_dist {}.".format(args.frames_dist))
+  return np.clip(num_frames, args.min_frames, args.max_frames).astype(np.int64)
+
+
+def sample_num_labels(rng, args, size):
+  """Samples the label counts of size videos from --labels_dist."""
+  if args.labels_dist == "fixed":
+    num_labels = np.zeros([size], dtype=np.int64) + args.max_labels
+  elif args.labels_dist == "uniform":
+    num_labels = rng.randint(1, args.max_labels + 1, size)
+  elif args.labels_dist == "poisson":
+    # the real data averages about 3.4 labels per video
+    num_labels = 1 + rng.poisson(max(args.mean_labels - 1, 0), size)
+  else:
+    raise ValueError("unknown labels_dist {}.".format(args.labels_dist))
+  return np.clip(num_labels, 1, args.max_labels).astype(np.int64)
+
+
+def class_probabilities(num_classes, skew):
+  """Zipf-like class frequencies, the real vocabulary is long-tailed."""
+  p = 1. / np.arange(1, num_classes + 1) ** skew
+  return p / p.sum()
+
+
+def generate_shard(task):
+  """Writes the records of one shard.
+
+  Args:
+    task: a tuple (args, shard_id, start, end), the shard holds the videos
+      start to end.
+
+  Returns:
+    A tuple (shard_id, video_ids, label_lists, hdfs_rows) where hdfs_rows maps
+    every requested HDF5 store to the 'feas' rows of the shard.
+  """
+  args, shard_id, start, end = task
+  rng = np.random.RandomState(args.seed * 100003 + shard_id)
+  num_videos = end - start
+  video_ids = ["{}{:08d}".format(args.stage[0], i) for i in xrange(start, end)]
+  num_frames = sample_num_frames(rng, args, num_videos)
+  num_labels = sample_num_labels(rng, args, num_videos)
+  p = class_probabilities(args.num_classes, args.label_skew)
+  label_lists = [sorted(rng.choice(args.num_classes, n, replace=False,
+                                   p=p).tolist())
+                 for n in num_labels]
+
+  writers = {}
+  for feat_type in RECORD_FORMATS:
+    if feat_type in args.formats:
+      writers[feat_type] = tf.python_io.TFRecordWriter(os.path.join(
+          args.output_dir, feat_type, args.stage,
+          "{}-{:05d}.tfrecord".format(args.stage, shard_id)))
+  hdfs_rows = {}
+  if "video_hdfs" in args.formats:
+    hdfs_rows["video_hdfs"] = np.zeros([num_videos, RGB_SIZE + AUDIO_SIZE],
+                                       dtype=np.float32)
+  if "vlad_hdfs" in args.formats:
+    hdfs_rows["vlad_hdfs"] = np.zeros(
+        [num_videos, VLAD_SHAPE[0] * VLAD_SHAPE[1]], dtype=np.float16)
+
+  for i in xrange(num_videos):
+    video_id, labels = video_ids[i], label_lists[i]
+    if "frame" in writers or "video" in writers or "video_hdfs" in hdfs_rows:
+      rgb = rng.randint(0, 256, [num_frames[i], RGB_SIZE]).astype(np.uint8)
+      audio = rng.randint(0, 256, [num_frames[i], AUDIO_SIZE]).astype(np.uint8)
+    if "frame" in writers:
+      example = sequence_writer.frames_to_tfexample(
+          [frame.tostring() for frame in rgb],
+          [frame.tostring() for frame in audio],
+          labels=labels, video_id=video_id)
+      writers["frame"].write(example.SerializeToString())
+    if "video" in writers or "video_hdfs" in hdfs_rows:
+      mean_rgb = dequantize(rgb.mean(axis=0)).astype(np.float32)
+      mean_audio = dequantize(audio.mean(axis=0)).astype(np.float32)
+    if "video" in writers:
+      example = video_writer.matrix_to_tfexample(
+          mean_rgb, mean_audio, labels=labels, video_id=video_id)
+      writers["video"].write(example.SerializeToString())
+    if "video_hdfs" in hdfs_rows:
+      hdfs_rows["video_hdfs"][i, :RGB_SIZE] = mean_rgb
+      hdfs_rows["video_hdfs"][i, RGB_SIZE:] = mean_audio
+    if "vlad" in writers or "vlad_hdfs" in hdfs_rows:
+      vlad = rng.standard_normal(VLAD_SHAPE).astype(np.float16)
+    if "vlad" in writers:
+      example = record_writer.matrix_to_tfexample(
+          vlad.tostring(), labels, video_id=video_id)
+      writers["vlad"].write(example.SerializeToString())
+    if "vlad_hdfs" in hdfs_rows:
+      hdfs_rows["vlad_hdfs"][i] = vlad.reshape([-1])
+    if "score" in writers:
+      scores = rng.uniform(0, 0.1, [NUM_SCORE_MODELS, NUM_CLASSES])
+      scores[:, labels] = rng.uniform(0.3, 1, [NUM_SCORE_MODELS, len(labels)])
+      example = tf.train.Example(features=tf.train.Features(feature={
+          "labels": video_writer._int64_feature(labels),
+          "video_id": video_writer._bytes_feature([video_id]),
+          "scores": video_writer._float_feature(scores.reshape([-1])),
+      }))
+      writers["score"].write(example.SerializeToString())
+
+  for writer in writers.values():
+    writer.close()
+  return shard_id, video_ids, label_lists, hdfs_rows
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description="Generate a synthetic YouTube-8M dataset.")
+  parser.add_argument("--output_dir", required=True)
+  parser.add_argument("--stage", default="train",
+                      choices=sorted(VID_TO_LABELS_FILES.keys()))
+  parser.add_argument("--formats", default="frame,video,video_hdfs",
+                      help="comma separated subset of {}.".format(
+                          ",".join(RECORD_FORMATS + HDFS_FORMATS)))
+  parser.add_argument("--num_videos", type=int, default=10000)
+  parser.add_argument("--shard_size", type=int, default=1200)
+  parser.add_argument("--num_classes", type=int, default=NUM_CLASSES)
+  parser.add_argument("--frames_dist", default="uniform",
+                      choices=["fixed", "uniform", "normal"])
+  parser.add_argument("--min_frames", type=int, default=1)
+  parser.add_argument("--max_frames", type=int, default=300)
+  parser.add_argument("--mean_frames", type=float, default=230.)
+  parser.add_argument("--std_frames", type=float, default=70.)
+  parser.add_argument("--labels_dist", default="poisson",
+                      choices=["fixed", "uniform", "poisson"])
+  parser.add_argument("--mean_labels", type=float, default=3.4)
+  parser.add_argument("--max_labels", type=int, default=20)
+  parser.add_argument("--label_skew", type=float, default=1.,
+                      help="Zipf exponent of the class frequencies, 0 for "
+                      "uniform classes.")
+  parser.add_argument("--seed", type=int, default=0)
+  parser.add_argument("--num_workers", type=int,
+                      default=multiprocessing.cpu_count())
+  args = parser.parse_args()
+  args.formats = [f.strip() for f in args.formats.split(",") if f.strip()]
+  for feat_type in args.formats:
+    if feat_type not in RECORD_FORMATS + HDFS_FORMATS:
+      raise ValueError("unknown format {}.".format(feat_type))
+  args.max_labels = min(args.max_labels, args.num_classes)
+
+  for feat_type in args.formats:
+    path = os.path.join(args.output_dir, feat_type, args.stage)
+    if not os.path.exists(path):
+      os.makedirs(path)
+  vid_info_dir = os.path.join(args.output_dir, "vid_info")
+  if not os.path.exists(vid_info_dir):
+    os.makedirs(vid_info_dir)
+
+  hdfs_files = {}
+  for feat_type in HDFS_FORMATS:
+    if feat_type in args.formats:
+      fout = h5py.File(os.path.join(args.output_dir, feat_type, args.stage,
+                                    "mean.h5"), "w")
+      if feat_type == "video_hdfs":
+        shape, dtype = (args.num_videos, RGB_SIZE + AUDIO_SIZE), np.float32
+      else:
+        shape, dtype = (args.num_videos, VLAD_SHAPE[0] * VLAD_SHAPE[1]), \
+            np.float16
+      fout.create_dataset("feas", shape, dtype=dtype)
+      hdfs_files[feat_type] = fout
+
+  tasks = [(args, shard_id, start, min(start + args.shard_size,
+                                       args.num_videos))
+           for shard_id, start in enumerate(
+               xrange(0, args.num_videos, args.shard_size))]
+  all_video_ids, vid_to_labels = [], {}
+  pool = multiprocessing.Pool(max(min(args.num_workers, len(tasks)), 1))
+  try:
+    # imap keeps the shards in order, so the rows of the HDF5 stores follow
+    # the video ids
+    for shard_id, video_ids, label_lists, hdfs_rows in pool.imap(
+        generate_shard, tasks):
+      start = shard_id * args.shard_size
+      for feat_type, rows in hdfs_rows.iteritems():
+        hdfs_files[feat_type]["feas"][start: start + rows.shape[0]] = rows
+      all_video_ids.extend(video_ids)
+      vid_to_labels.update(zip(video_ids, label_lists))
+      print("shard {}/{} done".format(shard_id + 1, len(tasks)))
+  finally:
+    pool.close()
+    pool.join()
+    for fout in hdfs_files.values():
+      fout.close()
+
+  for feat_type in hdfs_files:
+    with open(os.path.join(args.output_dir, feat_type, args.stage,
+                           "mean.pkl"), "wb") as fout:
+      pkl.dump(all_video_ids, fout, pkl.HIGHEST_PROTOCOL)
+  with open(os.path.join(vid_info_dir, VID_TO_LABELS_FILES[args.stage]),
+            "wb") as fout:
+    pkl.dump(vid_to_labels, fout, pkl.HIGHEST_PROTOCOL)
+  label_index.LabelIndex.build(vid_to_labels).save(
+      os.path.join(vid_info_dir, LABEL_INDEX_DIRS[args.stage]))
+  print("wrote {} videos to {}".format(len(all_video_ids), args.output_dir))
+
+
+if __name__ == "__main__":
+  main()
@@ -136,7 +136,8 @@ def just_read():
     coord.request_stop()
     coord.join(threads)
 
-# write()
-print("------------------------")
-read()
-# just_read()
+if __name__ == "__main__":
+  # write()
+  print("------------------------")
+  read()
+  # just_read()
@@ -1,6 +1,9 @@
 import time
 import os
+import threading
+import Queue
 
+import numpy as np
 import tensorflow as tf
 from tensorflow import gfile
 from tensorflow import logging
@@ -9,17 +12,35 @@ import utils
 
 slim = tf.contrib.slim
 
-def supervised_tasks(self, sv, res):
-  global_step = res["global_step"]
-  predictions = res["predictions"]
+def compute_training_metrics(self, predictions, dense_labels):
   if type(predictions) == list:
     predictions = eval_util.transform_preds(self, predictions)
-  dense_labels = res["dense_labels"]
-
   hit_at_one = eval_util.calculate_hit_at_one(predictions, dense_labels)
   perr = eval_util.calculate_precision_at_equal_recall_rate(predictions,
                                                             dense_labels)
   gap = eval_util.calculate_gap(predictions, dense_labels)
+  return hit_at_one, perr, gap
+
+def write_metric_summaries(sv, global_step, hit_at_one, perr, gap):
+  sv.summary_writer.add_summary(
+      utils.MakeSummary("model/Training_Hit@1",
+                        hit_at_one), global_step)
+  sv.summary_writer.add_summary(
+      utils.MakeSummary("model/Training_Perr", perr),
+      global_step)
+  sv.summary_writer.add_summary(
+      utils.MakeSummary("model/Training_GAP", gap),
+      global_step)
+
+def supervised_tasks(self, sv, res):
+  global_step = res["global_step"]
+  if "metrics" in res:
+    # computed in the graph, see metric_ops
+    hit_at_one, perr, gap = [res["metrics"][k]
+                             for k in ("hit_at_one", "perr", "gap")]
+  else:
+    hit_at_one, perr, gap = compute_training_metrics(
+        self, res["predictions"], res["dense_labels"])
 
   log_info = {
       "Training step": global_step,
@@ -32,15 +53,7 @@ def supervised_tasks(self, sv, res):
   }
 
   if self.is_chief and global_step % 10 == 0 and self.config.train_dir:
-    sv.summary_writer.add_summary(
-        utils.MakeSummary("model/Training_Hit@1",
-                          hit_at_one), global_step)
-    sv.summary_writer.add_summary(
-        utils.MakeSummary("model/Training_Perr", perr),
-        global_step)
-    sv.summary_writer.add_summary(
-        utils.MakeSummary("model/Training_GAP", gap),
-        global_step)
+    write_metric_summaries(sv, global_step, hit_at_one, perr, gap)
     sv.summary_writer.add_summary(
         utils.MakeSummary("global_step/Examples/Second",
                           res["examples_per_second"]),
@@ -48,6 +61,105 @@ def supervised_tasks(self, sv, res):
     sv.summary_writer.flush()
   return log_info
 
+
+class AsyncTrainingMetrics(object):
+  """Computes the training Hit@1, PERR and GAP in a background thread.
+
+  The training loop submits the fetched predictions of every
+  'config.train_metrics_every_n'-th step, optionally subsampled to
+  'config.train_metrics_sample_size' rows. Jobs go through a bounded queue and
+  submit never blocks: when the worker falls behind, the job is dropped and
+  counted in the 'model/Training_metric_jobs_dropped' summary.
+  """
+
+  def __init__(self, expr, sv, log_fout, log_lock):
+    self.expr = expr
+    self.sv = sv
+    self.log_fout = log_fout
+    self.log_lock = log_lock
+    self.every_n = max(expr.config.train_metrics_every_n, 1)
+    self.sample_size = expr.config.train_metrics_sample_size
+    self.write_summaries = expr.is_chief and bool(expr.config.train_dir)
+    self.num_dropped = 0
+    self.jobs = Queue.Queue(expr.config.train_metrics_queue_size)
+    self.rng = np.random.RandomState(0)
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def wants(self, step):
+    """Whether the metrics of the step-th step of this run are computed."""
+    return step % self.every_n == 0
+
+  def submit(self, global_step, predictions, dense_labels):
+    num_examples = dense_labels.shape[0]
+    if self.sample_size and self.sample_size < num_examples:
+      rows = np.sort(self.rng.choice(num_examples, self.sample_size,
+                                     replace=False))
+      if type(predictions) == list:
+        predictions = [p[rows] for p in predictions]
+      else:
+        predictions = predictions[rows]
+      dense_labels = dense_labels[rows]
+    try:
+      self.jobs.put_nowait((global_step, predictions, dense_labels))
+    except Queue.Full:
+      self.num_dropped += 1
+      if self.write_summaries:
+        self.sv.summary_writer.add_summary(
+            utils.MakeSummary("model/Training_metric_jobs_dropped",
+                              self.num_dropped), global_step)
+
+  def run(self):
+    while True:
+      job = self.jobs.get()
+      if job is None:
+        break
+      global_step, predictions, dense_labels = job
+      try:
+        hit_at_one, perr, gap = compute_training_metrics(
+            self.expr, predictions, dense_labels)
+      except Exception as e:
+        logging.error("training metrics of step %d failed: %s",
+                      global_step, e)
+        continue
+      log_info_str = "Training step: %d;  Hit@1: %.2f;  PERR: %.2f;  " \
+          "GAP: %.2f;  " % (global_step, hit_at_one, perr, gap)
+      logging.info(log_info_str)
+      with self.log_lock:
+        self.log_fout.write(log_info_str + '\n')
+      if self.write_summaries:
+        write_metric_summaries(self.sv, global_step, hit_at_one, perr, gap)
+
+  def stop(self):
+    """Finish the queued jobs and stop the worker."""
+    self.jobs.put(None)
+    self.thread.join()
+
+class BucketStats(object):
+  """Per-bucket batch counts and padding efficiency of bucketed batches."""
+
+  def __init__(self, num_buckets):
+    self.num_batches = np.zeros([num_buckets], dtype=np.int64)
+    self.num_frames = np.zeros([num_buckets], dtype=np.int64)
+    self.padded_frames = np.zeros([num_buckets], dtype=np.int64)
+
+  def update(self, bucket_stats):
+    bucket_id = bucket_stats["bucket_id"]
+    num_frames = bucket_stats["num_frames"]
+    self.num_batches[bucket_id] += 1
+    self.num_frames[bucket_id] += np.sum(num_frames)
+    self.padded_frames[bucket_id] += (num_frames.shape[0] *
+                                      bucket_stats["padded_length"])
+
+  def summary(self):
+    efficiency = self.num_frames / np.maximum(self.padded_frames, 1.)
+    total = np.sum(self.num_frames) / max(np.sum(self.padded_frames), 1.)
+    buckets = ["%d: %d batches, %.3f" % (i, n, e) for i, (n, e) in
+               enumerate(zip(self.num_batches, efficiency))]
+    return "Buckets (padding efficiency %.3f):  %s" % (
+        total, ";  ".join(buckets))
+
 def train_loop(self, model_ckpt_path, init_fn=None, start_supervisor_services=True):
   saver = tf.train.Saver(max_to_keep=1000000)
 
@@ -59,6 +171,18 @@ def train_loop(self, model_ckpt_path, init_fn=None, start_supervisor_services=Tr
         variables_to_restore,
         ignore_missing_vars=False,)
 
+  async_metrics = (self.config.train_metrics_async and
+                   self.feed_out.get("predictions") is not None)
+  if async_metrics:
+    # steps whose metrics are skipped do not fetch the predictions and labels
+    light_feed_out = dict(self.feed_out)
+    del light_feed_out["predictions"], light_feed_out["dense_labels"]
+    light_feed_out["num_examples"] = tf.shape(self.feed_out["dense_labels"])[0]
+    if self.feed_out1["train_op1"] is not None:
+      light_feed_out1 = dict(self.feed_out1)
+      del light_feed_out1["predictions"], light_feed_out1["dense_labels"]
+      light_feed_out1["num_examples"] = light_feed_out["num_examples"]
+
   # TODO
   sv = tf.train.Supervisor(logdir=self.config.train_dir,
                            is_chief=self.is_chief,
@@ -78,36 +202,79 @@ def train_loop(self, model_ckpt_path, init_fn=None, start_supervisor_services=Tr
   logging.info("started queue runners")
 
   log_fout = open(os.path.join(self.config.train_dir, "train.log"), "w")
+  log_lock = threading.Lock()
+  bucket_stats = None
+  if "bucket_stats" in self.feed_out:
+    bucket_stats = BucketStats(len(self.config.frame_bucket_boundaries) + 1)
+  metrics_worker = None
+  if async_metrics:
+    metrics_worker = AsyncTrainingMetrics(self, sv, log_fout, log_lock)
   try:
     logging.info("entering training loop")
+    step = 0
     while not sv.should_stop():
       batch_start_time = time.time()
-      res = sess.run(self.feed_out)
+      collect_metrics = metrics_worker is None or metrics_worker.wants(step)
+      step += 1
+      if not collect_metrics:
+        res = sess.run(light_feed_out)
+      else:
+        res = sess.run(self.feed_out)
       if self.feed_out1["train_op1"] is not None:
-        res = sess.run(self.feed_out1)
+        if not collect_metrics:
+          res = sess.run(light_feed_out1)
+        else:
+          res = sess.run(self.feed_out1)
       seconds_per_batch = time.time() - batch_start_time
-      examples_per_second = res["dense_labels"].shape[0] / seconds_per_batch
+      if "num_examples" in res:
+        num_examples = res["num_examples"]
+      else:
+        num_examples = res["dense_labels"].shape[0]
+      examples_per_second = num_examples / seconds_per_batch
 
       log_info_str = ""
-      if res["predictions"] is None:
+      if "metrics" in res:
+        res["examples_per_second"] = examples_per_second
+        log_info = supervised_tasks(self, sv, res)
+      elif res.get("predictions") is None or metrics_worker is not None:
         log_info = {
           "Training step": res["global_step"],
           "Loss": res["loss"],
           "Global norm": res["global_norm"],
           "Exps/sec": examples_per_second,
         }
+        if metrics_worker is not None:
+          if collect_metrics:
+            metrics_worker.submit(res["global_step"], res["predictions"],
+                                  res["dense_labels"])
+          log_info["Dropped metric jobs"] = metrics_worker.num_dropped
+          if (metrics_worker.write_summaries and
+              res["global_step"] % 10 == 0):
+            sv.summary_writer.add_summary(
+                utils.MakeSummary("global_step/Examples/Second",
+                                  examples_per_second), res["global_step"])
       else:
         res["examples_per_second"] = examples_per_second
         log_info = supervised_tasks(self, sv, res)
       for k, v in log_info.iteritems():
         log_info_str += "%s: %.2f;  " % (k, v)
       logging.info(log_info_str)
-      log_fout.write(log_info_str+'\n')
-      if res["global_step"] % 100 == 0:
-        log_fout.flush()
+      if bucket_stats is not None:
+        bucket_stats.update(res["bucket_stats"])
+        if step % 100 == 0:
+          log_info_str += '\n' + bucket_stats.summary()
+          logging.info(bucket_stats.summary())
+      with log_lock:
+        log_fout.write(log_info_str+'\n')
+        if res["global_step"] % 100 == 0:
+          log_fout.flush()
 
   except tf.errors.OutOfRangeError:
     logging.info("Done training -- epoch limit reached")
+  finally:
+    # finish the queued metric jobs and write their log lines
+    if metrics_worker is not None:
+      metrics_worker.stop()
   logging.info("exited training loop")
   sv.Stop()
 